@@ -1,8 +1,14 @@
 #負責讀取設定
 import os
+import sys
 from dotenv import load_dotenv
 import google.generativeai as genai
 
+# 兩個後端共用的 common/ 套件位於 repo 根目錄
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _REPO_ROOT not in sys.path:
+    sys.path.append(_REPO_ROOT)
+
 load_dotenv()
 
 class Settings:
@@ -10,6 +16,31 @@ class Settings:
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")
     ALPHA_VANTAGE_API_KEY = os.getenv("ALPHA_VANTAGE_API_KEY", "")
 
+    # 資料庫後端：sqlite (預設，本機檔案 DB_NAME) 或 postgres (DATABASE_URL，需安裝 psycopg2)
+    DB_BACKEND = os.getenv("DB_BACKEND", "sqlite").lower()
+    DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://localhost/stock")
+    DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+    DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+
+    # SQLite 連線池與 pragma
+    DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "30"))
+    DB_CACHE_SIZE_MB = int(os.getenv("DB_CACHE_SIZE_MB", "64"))
+    DB_MMAP_SIZE_MB = int(os.getenv("DB_MMAP_SIZE_MB", "256"))
+    DB_POOL_MAX_IDLE_PER_THREAD = int(os.getenv("DB_POOL_MAX_IDLE_PER_THREAD", "4"))
+
+    # 上游原始回應快取 (壓縮 + TTL + LRU)；OFFLINE_MODE=1 時只從快取讀取
+    RAW_CACHE_DIR = os.getenv("RAW_CACHE_DIR", "cache/raw")
+    RAW_CACHE_MAX_MB = int(os.getenv("RAW_CACHE_MAX_MB", "512"))
+    RAW_CACHE_COMPRESSION_LEVEL = int(os.getenv("RAW_CACHE_COMPRESSION_LEVEL", "6"))
+    OFFLINE_MODE = os.getenv("OFFLINE_MODE", "0").lower() in ("1", "true", "yes")
+    CACHE_TTL_INFO_HOURS = int(os.getenv("CACHE_TTL_INFO_HOURS", "24"))
+    CACHE_TTL_STATEMENTS_HOURS = int(os.getenv("CACHE_TTL_STATEMENTS_HOURS", "168"))
+    CACHE_TTL_HISTORY_HOURS = int(os.getenv("CACHE_TTL_HISTORY_HOURS", "6"))
+
+    # Fama-French 因子本地快取：缺上個月資料時每 FF_RECHECK_HOURS 檢查一次，最久 FF_MAX_AGE_DAYS 整批重抓
+    FF_RECHECK_HOURS = int(os.getenv("FF_RECHECK_HOURS", "24"))
+    FF_MAX_AGE_DAYS = int(os.getenv("FF_MAX_AGE_DAYS", "31"))
+
 settings = Settings()
 
 if settings.GOOGLE_API_KEY:
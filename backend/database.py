@@ -1,9 +1,70 @@
 #負責資料庫連線
-import sqlite3
 from config import settings
+from common.db_backend import make_backend
+from common.report_search import ReportIndex, create_search_index
+
+# SQLite (預設) 或 Postgres，見 config.DB_BACKEND
+backend = make_backend(settings)
+
+# AI 報告全文檢索 (common.report_search)
+REPORT_SEARCH = ReportIndex("AIReports", "id", ("NewsAnalysis", "CompetitorAnalysis"), "ai_reports")
+
 
 def get_db_connection():
-    return sqlite3.connect(settings.DB_NAME)
+    """
+    SQLite：重用本執行緒歸還的閒置連線；Postgres：從連線池取得。
+    兩者都以 close() 歸還，沒 commit 的變更會被丟棄。
+    """
+    return backend.connect()
+
+
+def get_pool_stats():
+    return backend.stats()
+
+
+def bulk_upsert(conn, table, columns, rows):
+    """大量 upsert：SQLite 為 executemany，Postgres 為 COPY 進暫存表後合併"""
+    return backend.bulk_upsert(conn, table, columns, rows)
+
+
+class BulkUpsert:
+    """可放進 db_writer 批次的大量寫入：(BulkUpsert(table, columns), rows)"""
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = columns
+
+    def __call__(self, conn, rows):
+        return bulk_upsert(conn, self.table, self.columns, rows)
+
+def migrate_ai_reports_id(cursor):
+    """
+    舊版 AIReports 以 (Stock_Id, ReportDate) 為主鍵、沒有 id 欄位：
+    SQLite 重建表格並刪除依賴隱含 rowid 的全文索引 (之後以 id 重建)；Postgres 直接加上 id 欄位。
+    """
+    if backend.dialect != "sqlite":
+        cursor.execute("ALTER TABLE IF EXISTS AIReports ADD COLUMN IF NOT EXISTS id BIGSERIAL")
+        return
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(AIReports)").fetchall()]
+    if not columns or "id" in columns:
+        return
+    print("🔧 AIReports 加上 id 欄位，重建全文索引")
+    for trigger in ("insert", "delete", "update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_ai_reports_fts_{trigger}")
+    cursor.execute("DROP TABLE IF EXISTS AIReports_fts")
+    cursor.execute("ALTER TABLE AIReports RENAME TO AIReports_old")
+    cursor.execute('''
+    CREATE TABLE AIReports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        Stock_Id TEXT,
+        ReportDate DATE,
+        NewsAnalysis TEXT,
+        CompetitorAnalysis TEXT,
+        UNIQUE(Stock_Id, ReportDate)
+    );''')
+    cursor.execute('''
+        INSERT INTO AIReports (Stock_Id, ReportDate, NewsAnalysis, CompetitorAnalysis)
+        SELECT Stock_Id, ReportDate, NewsAnalysis, CompetitorAnalysis FROM AIReports_old ORDER BY ReportDate, Stock_Id''')
+    cursor.execute("DROP TABLE AIReports_old")
 
 def create_fundamental_tables():
     conn = get_db_connection()
@@ -30,15 +91,107 @@ def create_fundamental_tables():
         UNIQUE(Stock_Id, ReportYear, RatioName)
     );''')
     
+    # id 為全文索引的 content_rowid (複合主鍵表的隱含 rowid 在 VACUUM 時可能重新編號)
+    migrate_ai_reports_id(cursor)
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS AIReports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
         Stock_Id TEXT,
         ReportDate DATE,
         NewsAnalysis TEXT,
         CompetitorAnalysis TEXT,
-        PRIMARY KEY (Stock_Id, ReportDate)
+        UNIQUE(Stock_Id, ReportDate)
+    );''')
+
+    # Fama-French 因子 (月 / 日) 與資料版本
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS FactorReturns (
+        Dataset TEXT,
+        Period DATE,
+        MktRF REAL, SMB REAL, HML REAL, RF REAL,
+        PRIMARY KEY (Dataset, Period)
+    ) WITHOUT ROWID;''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS FactorVintage (
+        Dataset TEXT PRIMARY KEY,
+        Vintage DATE,
+        Rows INTEGER,
+        FetchedAt DATETIME,
+        CheckedAt DATETIME
     );''')
 
+    # 公司基本資訊最新快照 (每個 key 一列)；值改變時由 trigger 追加到 CompanyInfo 歷史
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS CompanyInfoLatest (
+        Stock_Id TEXT,
+        DataKey TEXT,
+        DataValue TEXT,
+        NumValue REAL,
+        UpdatedAt DATE,
+        PRIMARY KEY (Stock_Id, DataKey)
+    ) WITHOUT ROWID;''')
+    if backend.dialect == "sqlite":
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_company_info_insert AFTER INSERT ON CompanyInfoLatest
+        BEGIN
+            INSERT OR REPLACE INTO CompanyInfo (Stock_Id, QueryDate, DataKey, DataValue)
+            VALUES (NEW.Stock_Id, NEW.UpdatedAt, NEW.DataKey, NEW.DataValue);
+        END;''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_company_info_update AFTER UPDATE OF DataValue ON CompanyInfoLatest
+        BEGIN
+            INSERT OR REPLACE INTO CompanyInfo (Stock_Id, QueryDate, DataKey, DataValue)
+            VALUES (NEW.Stock_Id, NEW.UpdatedAt, NEW.DataKey, NEW.DataValue);
+        END;''')
+
+        # 舊資料庫一次性移轉：以每個 key 最新一筆建立快照，並刪掉歷史中值沒變的重複列
+        if cursor.execute("SELECT 1 FROM CompanyInfoLatest LIMIT 1").fetchone() is None:
+            cursor.execute('''
+            DELETE FROM CompanyInfo WHERE sno IN (
+                SELECT sno FROM (
+                    SELECT sno, DataValue,
+                           LAG(DataValue) OVER (PARTITION BY Stock_Id, DataKey ORDER BY QueryDate) AS PrevValue
+                    FROM CompanyInfo
+                ) WHERE DataValue IS PrevValue
+            )''')
+            cursor.execute('''
+            INSERT INTO CompanyInfoLatest (Stock_Id, DataKey, DataValue, NumValue, UpdatedAt)
+            SELECT Stock_Id, DataKey, DataValue,
+                   CASE WHEN DataValue GLOB '*[0-9]*' AND DataValue NOT GLOB '*[^0-9.eE+-]*' THEN CAST(DataValue AS REAL) END,
+                   QueryDate
+            FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY Stock_Id, DataKey ORDER BY QueryDate DESC) AS rn
+                FROM CompanyInfo
+            ) WHERE rn = 1''')
+    else:
+        cursor.execute('''
+        CREATE OR REPLACE FUNCTION company_info_history() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO CompanyInfo (Stock_Id, QueryDate, DataKey, DataValue)
+            VALUES (NEW.Stock_Id, NEW.UpdatedAt, NEW.DataKey, NEW.DataValue)
+            ON CONFLICT (Stock_Id, DataKey, QueryDate) DO UPDATE SET DataValue = EXCLUDED.DataValue;
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql;''')
+        cursor.execute("DROP TRIGGER IF EXISTS trg_company_info_history ON CompanyInfoLatest")
+        cursor.execute('''
+        CREATE TRIGGER trg_company_info_history AFTER INSERT OR UPDATE OF DataValue ON CompanyInfoLatest
+        FOR EACH ROW EXECUTE FUNCTION company_info_history();''')
+
+    # 財報寬表快取 (日期 x 科目 float64 矩陣)，寫入財報時重建
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS StatementPivots (
+        Stock_Id TEXT,
+        StatementType TEXT,
+        Dates TEXT,
+        Items TEXT,
+        Matrix BLOB,
+        UpdatedAt DATETIME,
+        PRIMARY KEY (Stock_Id, StatementType)
+    );''')
+
+    # AI 報告全文檢索：SQLite 用 FTS5 (external content，trigger 同步)；Postgres 用 tsvector + GIN
+    create_search_index(cursor, backend.dialect, REPORT_SEARCH)
+
     conn.commit()
     conn.close()
     pass
\ No newline at end of file
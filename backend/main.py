@@ -3,6 +3,7 @@ import config
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from database import create_fundamental_tables
+from common.market_data import request_scope
 from routers import stock, agent
 
 
@@ -16,6 +17,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def market_data_request_scope(request, call_next):
+    # 同一個 HTTP 請求內重複的 yfinance 查詢只抓一次
+    with request_scope():
+        return await call_next(request)
+
 @app.on_event("startup")
 def startup():
     create_fundamental_tables()
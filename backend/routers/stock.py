@@ -5,6 +5,8 @@ from services.data_service import download_and_store_fundamentals, calculate_fin
 from services.ai_service import run_ai_analysis_agent
 import pandas as pd
 import datetime as dt
+from database import get_pool_stats, REPORT_SEARCH
+from common.report_search import search_reports
 
 router = APIRouter()
 
@@ -30,6 +32,11 @@ def search_ticker(keyword: str):
     results = search_symbol_alpha_vantage(keyword)
     return {"status": "success", "data": results}
 
+@router.get("/api/db_stats")
+def db_stats():
+    """SQLite 連線池統計"""
+    return {"status": "success", "data": get_pool_stats()}
+
 @router.post("/api/analyze_ai/{stock_id}")
 async def analyze_stock_ai(stock_id: str):
     stock_id = stock_id.upper()
@@ -51,9 +58,12 @@ async def analyze_stock_ai(stock_id: str):
     today = dt.date.today().strftime("%Y-%m-%d")
     cursor = conn.cursor()
 
+    # 用 upsert 而非 INSERT OR REPLACE：REPLACE 的隱含刪除不會觸發 trigger，全文索引會留下舊內容
     cursor.execute('''
-        INSERT OR REPLACE INTO AIReports (Stock_Id, ReportDate, NewsAnalysis, CompetitorAnalysis)
+        INSERT INTO AIReports (Stock_Id, ReportDate, NewsAnalysis, CompetitorAnalysis)
         VALUES (?, ?, ?, ?)
+        ON CONFLICT(Stock_Id, ReportDate) DO UPDATE SET
+            NewsAnalysis = excluded.NewsAnalysis, CompetitorAnalysis = excluded.CompetitorAnalysis
     ''', (stock_id, today, news_analysis, competitor_analysis))
     
     conn.commit()
@@ -67,6 +77,16 @@ async def analyze_stock_ai(stock_id: str):
         }
     }
 
+@router.get("/api/reports/search")
+def search_ai_reports(q: str, ticker: str = None, limit: int = 20, offset: int = 0):
+    """全文檢索所有已產生的 AI 報告 (依相關度排序，回傳片段)，可先找舊報告再決定是否重新產生"""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q is required")
+    if not 1 <= limit <= 100 or offset < 0:
+        raise HTTPException(status_code=400, detail="limit must be 1-100 and offset >= 0")
+    results = search_reports(REPORT_SEARCH, q, ticker=ticker, limit=limit, offset=offset)
+    return {"status": "success", "query": q, "count": len(results), "results": results}
+
 @router.get("/api/get_ai_report/{stock_id}")
 def get_ai_report(stock_id: str):
     conn = get_db_connection()
@@ -4,10 +4,10 @@ import os
 import datetime as dt
 import pandas as pd
 import numpy as np
-import yfinance as yf
 import google.generativeai as genai
-import pandas_datareader.data as web
 import statsmodels.api as sm
+from common import market_data
+from common.factor_service import get_factors
 
 
 def calculate_fama_french_coe(ticker_symbol, lookback_years=5):
@@ -17,15 +17,15 @@ def calculate_fama_french_coe(ticker_symbol, lookback_years=5):
     start_date = end_date - dt.timedelta(days=lookback_years*365)
     
     try:
-        ff_data = web.DataReader('F-F_Research_Data_Factors', 'famafrench', start_date, end_date)[0]
-        ff_data = ff_data / 100
-        ff_data.index = ff_data.index.to_timestamp()
+        ff_data, vintage = get_factors("monthly", start=start_date, end=end_date)
+        print(f"   Fama-French 因子資料至 {vintage}")
     except Exception:
         print("⚠️ Fama-French 數據獲取失敗，使用 Fallback 10%")
         return 0.10 
 
-    ticker = yf.Ticker(ticker_symbol)
-    stock = ticker.history(start=start_date, end=end_date, interval='1mo')
+    stock = market_data.get_history(
+        ticker_symbol, start=start_date.strftime('%Y-%m-%d'), end=end_date.strftime('%Y-%m-%d'), interval='1mo'
+    )
     if stock.empty: return 0.10
 
     stock_returns = stock['Close'].pct_change().dropna()
@@ -50,15 +50,14 @@ def calculate_fama_french_coe(ticker_symbol, lookback_years=5):
 def project_fcf_from_eps_filtered(ticker_symbol):
     """使用 Forward EPS 預測 FCF"""
     print(f"🔮 [模型 2/3] 預測 FCF ({ticker_symbol})...")
-    stock = yf.Ticker(ticker_symbol)
     
     def filter_post_2020(df):
         df.columns = pd.to_datetime(df.columns)
         return df[[c for c in df.columns if c.year >= 2021]]
 
     try:
-        financials = filter_post_2020(stock.financials)
-        cashflow = filter_post_2020(stock.cashflow)
+        financials = filter_post_2020(market_data.get_financials(ticker_symbol))
+        cashflow = filter_post_2020(market_data.get_cashflow(ticker_symbol))
         
         net_income = financials.loc['Net Income']
         fcf = cashflow.loc['Operating Cash Flow'] - abs(cashflow.loc['Capital Expenditure'])
@@ -66,7 +65,8 @@ def project_fcf_from_eps_filtered(ticker_symbol):
         ratios = (fcf / net_income).replace([np.inf, -np.inf], np.nan).dropna()
         avg_ratio = ratios.mean() if not ratios.empty else 1.0
         
-        forward_eps = stock.info.get('forwardEps') or stock.info.get('trailingEps')
+        info = market_data.get_info(ticker_symbol)
+        forward_eps = info.get('forwardEps') or info.get('trailingEps')
         return forward_eps * avg_ratio
     except Exception:
         return 0
@@ -74,8 +74,7 @@ def project_fcf_from_eps_filtered(ticker_symbol):
 def calculate_dcf(ticker_symbol, coe, fcfps_FTM, projection_years=5, terminal_growth_rate=0.00):
     """執行 DCF 估值 (0% 成長率)"""
     print(f"💰 [模型 3/3] 執行最終 DCF 估值...")
-    stock = yf.Ticker(ticker_symbol)
-    info = stock.info
+    info = market_data.get_info(ticker_symbol)
     
     current_price = info.get('currentPrice')
     currency = info.get('currency', 'USD')
@@ -84,8 +83,8 @@ def calculate_dcf(ticker_symbol, coe, fcfps_FTM, projection_years=5, terminal_gr
         currency = 'GBP'
         
     shares = info.get('sharesOutstanding')
-    financials = stock.financials
-    balance = stock.balance_sheet
+    financials = market_data.get_financials(ticker_symbol)
+    balance = market_data.get_balance_sheet(ticker_symbol)
     
     try:
         int_exp = abs(financials.loc['Interest Expense'].iloc[0]) if 'Interest Expense' in financials.index else 0
@@ -122,8 +121,9 @@ def calculate_dcf(ticker_symbol, coe, fcfps_FTM, projection_years=5, terminal_gr
     """
 
 def run_advanced_valuation(ticker):
-    """總指揮函式"""
-    coe = calculate_fama_french_coe(ticker) or 0.10
-    fcf_ftm = project_fcf_from_eps_filtered(ticker)
-    if fcf_ftm <= 0: return "Error: Insufficient Data for Valuation"
-    return calculate_dcf(ticker, coe, fcf_ftm)
\ No newline at end of file
+    """總指揮函式 (三個模型共用同一份 info / 財報)"""
+    with market_data.request_scope():
+        coe = calculate_fama_french_coe(ticker) or 0.10
+        fcf_ftm = project_fcf_from_eps_filtered(ticker)
+        if fcf_ftm <= 0: return "Error: Insufficient Data for Valuation"
+        return calculate_dcf(ticker, coe, fcf_ftm)
\ No newline at end of file
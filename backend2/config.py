@@ -1,8 +1,14 @@
 #負責讀取設定
 import os
+import sys
 from dotenv import load_dotenv
 import google.generativeai as genai
 
+# 兩個後端共用的 common/ 套件位於 repo 根目錄
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _REPO_ROOT not in sys.path:
+    sys.path.append(_REPO_ROOT)
+
 load_dotenv()
 
 class Settings:
@@ -10,6 +16,89 @@ class Settings:
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")
     ALPHA_VANTAGE_API_KEY = os.getenv("ALPHA_VANTAGE_API_KEY", "")
 
+    # 資料庫後端：sqlite (預設，本機檔案 DB_NAME) 或 postgres (DATABASE_URL，需安裝 psycopg2)
+    DB_BACKEND = os.getenv("DB_BACKEND", "sqlite").lower()
+    DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://localhost/stock")
+    DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+    DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+
+    # SQLite 連線池與 pragma
+    DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "30"))
+    DB_CACHE_SIZE_MB = int(os.getenv("DB_CACHE_SIZE_MB", "64"))
+    DB_MMAP_SIZE_MB = int(os.getenv("DB_MMAP_SIZE_MB", "256"))
+    DB_POOL_MAX_IDLE_PER_THREAD = int(os.getenv("DB_POOL_MAX_IDLE_PER_THREAD", "4"))
+    # 單一寫入執行緒：每個交易最多合併幾批寫入、等待後續寫入的時間 (毫秒)
+    DB_WRITER_MAX_BATCHES = int(os.getenv("DB_WRITER_MAX_BATCHES", "256"))
+    DB_WRITER_LINGER_MS = int(os.getenv("DB_WRITER_LINGER_MS", "5"))
+    # db_writer.write() 等待 commit 的上限 (秒)
+    DB_WRITER_TIMEOUT = float(os.getenv("DB_WRITER_TIMEOUT", "300"))
+
+    # Alpha Vantage 連線設定 (並行抓取 / 連線池)
+    ALPHA_VANTAGE_MAX_WORKERS = int(os.getenv("ALPHA_VANTAGE_MAX_WORKERS", "5"))
+    ALPHA_VANTAGE_POOL_SIZE = int(os.getenv("ALPHA_VANTAGE_POOL_SIZE", "10"))
+    ALPHA_VANTAGE_TIMEOUT = float(os.getenv("ALPHA_VANTAGE_TIMEOUT", "15"))
+
+    # Alpha Vantage 配額 (預設為免費方案 5次/分、25次/日；0 代表不限制)
+    ALPHA_VANTAGE_PER_MINUTE = int(os.getenv("ALPHA_VANTAGE_PER_MINUTE", "5"))
+    ALPHA_VANTAGE_PER_DAY = int(os.getenv("ALPHA_VANTAGE_PER_DAY", "25"))
+    # 每日額度為固定視窗，於每天此時刻 (UTC 小時) 重置
+    ALPHA_VANTAGE_DAY_RESET_UTC_HOUR = int(os.getenv("ALPHA_VANTAGE_DAY_RESET_UTC_HOUR", "0"))
+    ALPHA_VANTAGE_QUEUE_TIMEOUT = float(os.getenv("ALPHA_VANTAGE_QUEUE_TIMEOUT", "120"))
+    # 配額狀態檔 (flock 互斥)：API worker、批次匯入等所有程序與重新啟動後共用同一份額度；空字串代表只在程序內計算
+    ALPHA_VANTAGE_QUOTA_FILE = os.getenv("ALPHA_VANTAGE_QUOTA_FILE", "cache/alpha_vantage_quota.json")
+
+    # 資料新鮮度 (TTL)：未過期的 endpoint 不重新下載
+    QUOTE_TTL_MINUTES = int(os.getenv("QUOTE_TTL_MINUTES", "15"))
+    OVERVIEW_TTL_HOURS = int(os.getenv("OVERVIEW_TTL_HOURS", "24"))
+    STATEMENT_FILING_LAG_DAYS = int(os.getenv("STATEMENT_FILING_LAG_DAYS", "90"))
+    QUARTERLY_FILING_LAG_DAYS = int(os.getenv("QUARTERLY_FILING_LAG_DAYS", "45"))
+    STATEMENT_RECHECK_HOURS = int(os.getenv("STATEMENT_RECHECK_HOURS", "24"))
+
+    # 上游原始回應快取 (壓縮 + TTL + LRU)；OFFLINE_MODE=1 時只從快取讀取
+    RAW_CACHE_DIR = os.getenv("RAW_CACHE_DIR", "cache/raw")
+    RAW_CACHE_MAX_MB = int(os.getenv("RAW_CACHE_MAX_MB", "512"))
+    RAW_CACHE_COMPRESSION_LEVEL = int(os.getenv("RAW_CACHE_COMPRESSION_LEVEL", "6"))
+    OFFLINE_MODE = os.getenv("OFFLINE_MODE", "0").lower() in ("1", "true", "yes")
+    CACHE_TTL_INFO_HOURS = int(os.getenv("CACHE_TTL_INFO_HOURS", "24"))
+    CACHE_TTL_STATEMENTS_HOURS = int(os.getenv("CACHE_TTL_STATEMENTS_HOURS", "168"))
+    CACHE_TTL_HISTORY_HOURS = int(os.getenv("CACHE_TTL_HISTORY_HOURS", "6"))
+
+    # Fama-French 因子本地快取：缺上個月資料時每 FF_RECHECK_HOURS 檢查一次，最久 FF_MAX_AGE_DAYS 整批重抓
+    FF_RECHECK_HOURS = int(os.getenv("FF_RECHECK_HOURS", "24"))
+    FF_MAX_AGE_DAYS = int(os.getenv("FF_MAX_AGE_DAYS", "31"))
+
+    # 本地日K價格庫：距上次同步超過此分鐘數才補抓
+    PRICE_REFRESH_MINUTES = int(os.getenv("PRICE_REFRESH_MINUTES", "60"))
+
+    # 日K欄式封存檔 (mmap)：近 PRICE_ARCHIVE_HOT_YEARS 年不壓縮，更早的年份壓縮成冷區段
+    PRICE_ARCHIVE_DIR = os.getenv("PRICE_ARCHIVE_DIR", "cache/prices")
+    PRICE_ARCHIVE_HOT_YEARS = int(os.getenv("PRICE_ARCHIVE_HOT_YEARS", "3"))
+    PRICE_ARCHIVE_OPEN_TICKERS = int(os.getenv("PRICE_ARCHIVE_OPEN_TICKERS", "256"))
+
+    # 共享記憶體價格矩陣 (price_matrix_loader.py)：最近 PRICE_MATRIX_YEARS 年，worker 每 PRICE_MATRIX_CHECK_SECONDS 檢查是否換版
+    PRICE_MATRIX_MANIFEST = os.getenv("PRICE_MATRIX_MANIFEST", "cache/price_matrix.json")
+    PRICE_MATRIX_YEARS = int(os.getenv("PRICE_MATRIX_YEARS", "5"))
+    PRICE_MATRIX_REFRESH_SECONDS = float(os.getenv("PRICE_MATRIX_REFRESH_SECONDS", "300"))
+    PRICE_MATRIX_CHECK_SECONDS = float(os.getenv("PRICE_MATRIX_CHECK_SECONDS", "30"))
+
+    # 分析查詢層 (Parquet + DuckDB)：快照超過 ANALYTICS_REFRESH_MINUTES 重新匯出
+    ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", "cache/analytics")
+    ANALYTICS_REFRESH_MINUTES = int(os.getenv("ANALYTICS_REFRESH_MINUTES", "60"))
+    ANALYTICS_CHECK_SECONDS = float(os.getenv("ANALYTICS_CHECK_SECONDS", "30"))
+    ANALYTICS_EXPORT_CHUNK = int(os.getenv("ANALYTICS_EXPORT_CHUNK", "200000"))
+    ANALYTICS_MAX_ROWS = int(os.getenv("ANALYTICS_MAX_ROWS", "10000"))
+
+    # 整批重算財務比率 (recompute_ratios.py)：每 RATIO_BATCH_CHUNK 檔一次查詢，超過一批時分給 RATIO_BATCH_WORKERS 個程序
+    RATIO_BATCH_CHUNK = int(os.getenv("RATIO_BATCH_CHUNK", "500"))
+    RATIO_BATCH_WORKERS = int(os.getenv("RATIO_BATCH_WORKERS", str(os.cpu_count() or 1)))
+
+    # 背景工作 (worker.py)
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+    JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+    JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "120"))
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
 settings = Settings()
 
 if settings.GOOGLE_API_KEY:
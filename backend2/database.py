@@ -1,9 +1,73 @@
 #負責資料庫連線
-import sqlite3
 from config import settings
+from common.db_backend import make_backend
+from common.report_search import ReportIndex, create_search_index
+from common.statement_store import rebuild_pivots
+
+# SQLite (預設) 或 Postgres，見 config.DB_BACKEND
+backend = make_backend(settings)
+
+# AI 報告全文檢索 (common.report_search)
+REPORT_SEARCH = ReportIndex("AI_Analysis", "id", ("AnalysisContent",), "ai_analysis", extra=("CreatedAt",))
+
 
 def get_db_connection():
-    return sqlite3.connect(settings.DB_NAME)
+    """
+    SQLite：重用本執行緒歸還的閒置連線；Postgres：從連線池取得。
+    兩者都以 close() 歸還，沒 commit 的變更會被丟棄。
+    """
+    return backend.connect()
+
+
+def get_pool_stats():
+    return backend.stats()
+
+
+def bulk_upsert(conn, table, columns, rows):
+    """大量 upsert：SQLite 為 executemany，Postgres 為 COPY 進暫存表後合併"""
+    return backend.bulk_upsert(conn, table, columns, rows)
+
+
+class BulkUpsert:
+    """可放進 db_writer 批次的大量寫入：(BulkUpsert(table, columns), rows)"""
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = columns
+
+    def __call__(self, conn, rows):
+        return bulk_upsert(conn, self.table, self.columns, rows)
+
+def _is_empty(cursor, table):
+    cursor.execute(f"SELECT 1 FROM {table} LIMIT 1")
+    return cursor.fetchone() is None
+
+def backfill_derived_tables(conn):
+    """
+    衍生表上線前的資料庫：在建表的同一個交易內補建一次，讀取路徑只回傳已存在的資料。
+    順序依相依關係：LatestRatios 由 FinancialRatios 產生，同業統計再由 LatestRatios 產生。
+    """
+    # 延後匯入：services 模組本身會匯入 database
+    from services.peer_service import rebuild_peers
+    from services.screen_service import rebuild_latest_statements
+
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT DISTINCT Stock_Id FROM FinancialStatements"
+        " WHERE Stock_Id NOT IN (SELECT Stock_Id FROM StatementPivots)"
+    )
+    missing = [r[0] for r in cursor.fetchall()]
+    if missing:
+        print(f"🔧 {len(missing)} 檔股票沒有財報寬表，由 FinancialStatements 補建")
+        rebuild_pivots(conn, missing)
+
+    if _is_empty(cursor, "LatestRatios") and not _is_empty(cursor, "FinancialRatios"):
+        print("🔧 LatestRatios 為空，由 FinancialRatios 重建")
+        for sql, params in rebuild_latest_statements():
+            cursor.execute(sql, params)
+
+    if _is_empty(cursor, "PeerStats") and not _is_empty(cursor, "LatestRatios"):
+        print("🔧 PeerStats 為空，由 LatestRatios 重建")
+        rebuild_peers(conn)
 
 def create_fundamental_tables():
     conn = get_db_connection()
@@ -43,6 +107,213 @@ def create_fundamental_tables():
         UNIQUE(Stock_Id, ReportDate)
     );''')
 
+    # 5. 各 endpoint 最近一次成功下載時間 (供 TTL 判斷)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS IngestLog (
+        Stock_Id TEXT,
+        Endpoint TEXT,
+        FetchedAt DATETIME,
+        PRIMARY KEY (Stock_Id, Endpoint)
+    );''')
+
+    # 6. 批次匯入進度 (中斷後可續跑)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS IngestProgress (
+        RunId TEXT,
+        Stock_Id TEXT,
+        Status TEXT,
+        Message TEXT,
+        UpdatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (RunId, Stock_Id)
+    );''')
+
+    # 7. 背景工作佇列
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Jobs (
+        Id TEXT PRIMARY KEY,
+        Kind TEXT,
+        Payload TEXT,
+        Status TEXT DEFAULT 'queued',
+        Result TEXT,
+        Error TEXT,
+        Attempts INTEGER DEFAULT 0,
+        WorkerId TEXT,
+        CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+        StartedAt DATETIME,
+        HeartbeatAt DATETIME,
+        FinishedAt DATETIME
+    );''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON Jobs(Status, CreatedAt)")
+
+    # 8. 日K價格 (回測 / 技術分析 / 歷史走勢共用)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS DailyPrices (
+        Stock_Id TEXT,
+        TradeDate DATE,
+        Open REAL, High REAL, Low REAL, Close REAL, AdjClose REAL, Volume REAL,
+        PRIMARY KEY (Stock_Id, TradeDate)
+    ) WITHOUT ROWID;''')
+
+    # 9. Fama-French 因子 (月 / 日) 與資料版本
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS FactorReturns (
+        Dataset TEXT,
+        Period DATE,
+        MktRF REAL, SMB REAL, HML REAL, RF REAL,
+        PRIMARY KEY (Dataset, Period)
+    ) WITHOUT ROWID;''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS FactorVintage (
+        Dataset TEXT PRIMARY KEY,
+        Vintage DATE,
+        Rows INTEGER,
+        FetchedAt DATETIME,
+        CheckedAt DATETIME
+    );''')
+
+    # 10. 公司基本資訊最新快照 (每個 key 一列)；值改變時由 trigger 追加到 CompanyInfo 歷史
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS CompanyInfoLatest (
+        Stock_Id TEXT,
+        DataKey TEXT,
+        DataValue TEXT,
+        NumValue REAL,
+        UpdatedAt DATE,
+        PRIMARY KEY (Stock_Id, DataKey)
+    ) WITHOUT ROWID;''')
+    if backend.dialect == "sqlite":
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_company_info_insert AFTER INSERT ON CompanyInfoLatest
+        BEGIN
+            INSERT OR REPLACE INTO CompanyInfo (Stock_Id, QueryDate, DataKey, DataValue)
+            VALUES (NEW.Stock_Id, NEW.UpdatedAt, NEW.DataKey, NEW.DataValue);
+        END;''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_company_info_update AFTER UPDATE OF DataValue ON CompanyInfoLatest
+        BEGIN
+            INSERT OR REPLACE INTO CompanyInfo (Stock_Id, QueryDate, DataKey, DataValue)
+            VALUES (NEW.Stock_Id, NEW.UpdatedAt, NEW.DataKey, NEW.DataValue);
+        END;''')
+
+        # 舊資料庫一次性移轉：以每個 key 最新一筆建立快照，並刪掉歷史中值沒變的重複列
+        if cursor.execute("SELECT 1 FROM CompanyInfoLatest LIMIT 1").fetchone() is None:
+            cursor.execute('''
+            DELETE FROM CompanyInfo WHERE sno IN (
+                SELECT sno FROM (
+                    SELECT sno, DataValue,
+                           LAG(DataValue) OVER (PARTITION BY Stock_Id, DataKey ORDER BY QueryDate) AS PrevValue
+                    FROM CompanyInfo
+                ) WHERE DataValue IS PrevValue
+            )''')
+            cursor.execute('''
+            INSERT INTO CompanyInfoLatest (Stock_Id, DataKey, DataValue, NumValue, UpdatedAt)
+            SELECT Stock_Id, DataKey, DataValue,
+                   CASE WHEN DataValue GLOB '*[0-9]*' AND DataValue NOT GLOB '*[^0-9.eE+-]*' THEN CAST(DataValue AS REAL) END,
+                   QueryDate
+            FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY Stock_Id, DataKey ORDER BY QueryDate DESC) AS rn
+                FROM CompanyInfo
+            ) WHERE rn = 1''')
+    else:
+        cursor.execute('''
+        CREATE OR REPLACE FUNCTION company_info_history() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO CompanyInfo (Stock_Id, QueryDate, DataKey, DataValue)
+            VALUES (NEW.Stock_Id, NEW.UpdatedAt, NEW.DataKey, NEW.DataValue)
+            ON CONFLICT (Stock_Id, DataKey, QueryDate) DO UPDATE SET DataValue = EXCLUDED.DataValue;
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql;''')
+        cursor.execute("DROP TRIGGER IF EXISTS trg_company_info_history ON CompanyInfoLatest")
+        cursor.execute('''
+        CREATE TRIGGER trg_company_info_history AFTER INSERT OR UPDATE OF DataValue ON CompanyInfoLatest
+        FOR EACH ROW EXECUTE FUNCTION company_info_history();''')
+
+    # 11. 財報寬表快取 (日期 x 科目 float64 矩陣)，寫入財報時重建
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS StatementPivots (
+        Stock_Id TEXT,
+        StatementType TEXT,
+        Dates TEXT,
+        Items TEXT,
+        Matrix BLOB,
+        UpdatedAt DATETIME,
+        PRIMARY KEY (Stock_Id, StatementType)
+    );''')
+
+    # 12. 選股用寬表：每檔最新年度 (非 TTM) 的比率一列一欄，每個比率欄位各自有索引
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS LatestRatios (
+        Stock_Id TEXT PRIMARY KEY,
+        ReportYear INTEGER,
+        ROE REAL,
+        GrossMargin REAL,
+        OperatingMargin REAL,
+        NetMargin REAL,
+        RevenueGrowth REAL,
+        NetIncomeGrowth REAL,
+        EPSGrowth REAL,
+        FCFGrowth REAL,
+        DebtToEquity REAL,
+        CurrentRatio REAL,
+        InterestCoverage REAL,
+        NetDebtToEBITDA REAL,
+        AssetTurnover REAL,
+        InventoryTurnover REAL,
+        ReceivablesTurnover REAL,
+        ROIC REAL,
+        UpdatedAt DATETIME
+    );''')
+    for column in ('ReportYear', 'ROE', 'GrossMargin', 'OperatingMargin', 'NetMargin',
+                   'RevenueGrowth', 'NetIncomeGrowth', 'EPSGrowth', 'FCFGrowth',
+                   'DebtToEquity', 'CurrentRatio', 'InterestCoverage', 'NetDebtToEBITDA',
+                   'AssetTurnover', 'InventoryTurnover', 'ReceivablesTurnover', 'ROIC'):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_latest_ratios_{column.lower()} ON LatestRatios ({column})")
+
+    # 13. AI 報告全文檢索：SQLite 用 FTS5 (external content，trigger 同步)；Postgres 用 tsvector + GIN
+    create_search_index(cursor, backend.dialect, REPORT_SEARCH)
+
+    # 14. 比率輸入指紋 (每檔每個年度 / TTM 一列)：指紋沒變的期間不重算、不重寫
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS RatioInputs (
+        Stock_Id TEXT,
+        Period TEXT,
+        InputHash TEXT,
+        UpdatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (Stock_Id, Period)
+    );''')
+
+    # 15. 舊版的年度比率 view 已移除 (年度比率只存在 FinancialRatios)
+    cursor.execute("DROP VIEW IF EXISTS FinancialRatiosView")
+    cursor.execute("DROP VIEW IF EXISTS StatementYearsView")
+
+    # 16. 同業統計：每個 sector / industry 每個比率的四分位數，與各股票在組內的百分位排名 (以 LatestRatios 為準)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS PeerStats (
+        GroupType TEXT,
+        GroupName TEXT,
+        RatioName TEXT,
+        Peers INTEGER,
+        P25 REAL, Median REAL, P75 REAL,
+        UpdatedAt DATETIME,
+        PRIMARY KEY (GroupType, GroupName, RatioName)
+    );''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS PeerRanks (
+        Stock_Id TEXT,
+        GroupType TEXT,
+        GroupName TEXT,
+        RatioName TEXT,
+        ReportYear INTEGER,
+        RatioValue REAL,
+        PercentRank REAL,
+        PRIMARY KEY (Stock_Id, GroupType, RatioName)
+    );''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_peer_ranks_group ON PeerRanks (GroupType, GroupName)")
+    # 依 sector / industry 找出同組股票
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_company_info_latest_value ON CompanyInfoLatest (DataKey, DataValue)")
+
+    backfill_derived_tables(conn)
+
     conn.commit()
     conn.close()
     print("✅ 資料庫表格初始化完成 (Standardized tables created)")
\ No newline at end of file
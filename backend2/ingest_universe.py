@@ -0,0 +1,164 @@
+#批次匯入整個股票池的基本面數據 (可中斷續跑)
+#用法: python ingest_universe.py sp500.txt --workers 4 --batch-size 25
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from database import get_db_connection, create_fundamental_tables
+from services.data_service import (
+    get_stale_endpoints,
+    fetch_fundamental_rows,
+    store_fundamental_rows,
+    has_statements,
+    ratio_update_statements,
+)
+from services.db_writer import db_writer
+from services.peer_service import rebuild_peers
+from services.quota_service import PRIORITY_BATCH
+from config import settings
+
+
+def iter_tickers(path):
+    """逐行讀取股票代號 (支援 CSV 第一欄、# 註解)，不一次載入整份清單"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            ticker = line.split(",", 1)[0].strip().upper()
+            if ticker and ticker not in ("SYMBOL", "TICKER"):
+                yield ticker
+
+
+def load_completed(conn, run_id):
+    cursor = conn.cursor()
+    cursor.execute("SELECT Stock_Id FROM IngestProgress WHERE RunId = ? AND Status = 'done'", (run_id,))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def progress_statement(run_id, stock_id, status, message=""):
+    return (
+        "INSERT OR REPLACE INTO IngestProgress (RunId, Stock_Id, Status, Message, UpdatedAt) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
+        (run_id, stock_id, status, message),
+    )
+
+
+def fetch_ticker(stock_id, force_refresh):
+    """Worker 執行緒：判斷新鮮度、抓取並寫入 (多個 worker 的寫入由 db_writer 合併成同一個交易；同業統計最後統一重建)"""
+    conn = get_db_connection()
+    try:
+        stale = get_stale_endpoints(stock_id, conn, force_refresh)
+    finally:
+        conn.close()
+    if stale:
+        rows = fetch_fundamental_rows(stock_id, stale, PRIORITY_BATCH, force_refresh)
+        store_fundamental_rows(rows, refresh_peers=False)
+        if rows["failed"]:
+            # 已抓到的部分照常寫入；標記為失敗，續跑時只會重抓仍過期的 endpoint
+            raise RuntimeError(f"Endpoints not refreshed: {', '.join(rows['failed'])}")
+
+
+def run_ingest(path, run_id, workers, max_in_flight, batch_size, force_refresh=False):
+    create_fundamental_tables()
+    conn = get_db_connection()
+    completed = load_completed(conn, run_id)
+    if completed:
+        print(f"⏩ RunId={run_id}: 已完成 {len(completed)} 檔，從中斷處繼續")
+
+    started = time.monotonic()
+    done = failed = 0
+    pending = []
+
+    def report():
+        elapsed = time.monotonic() - started
+        rate = (done + failed) / elapsed * 60 if elapsed > 0 else 0.0
+        print(f"📊 完成 {done} / 失敗 {failed} | {elapsed:.0f}s | {rate:.1f} tickers/min")
+
+    def flush():
+        # 等待已排入的比率 / 進度寫入 commit 完成
+        for write in pending:
+            try:
+                write.result()
+            except Exception as e:
+                print(f"❌ 寫入失敗: {e}")
+        pending.clear()
+
+    def handle(stock_id, future):
+        nonlocal done, failed
+        try:
+            future.result()
+            if not has_statements(stock_id, conn):
+                raise RuntimeError("No statements available")
+            # 只重算財報有變動的期間；比率與進度同一批寫入：不是都寫進去就都不寫
+            statements, _ = ratio_update_statements(stock_id, conn, refresh_peers=False)
+            pending.append(db_writer.submit([*statements, progress_statement(run_id, stock_id, "done")]))
+            done += 1
+        except Exception as e:
+            pending.append(db_writer.submit([progress_statement(run_id, stock_id, "failed", str(e)[:500])]))
+            failed += 1
+        if len(pending) >= batch_size:
+            flush()
+            report()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            in_flight = {}
+            for stock_id in iter_tickers(path):
+                if stock_id in completed:
+                    continue
+                completed.add(stock_id)
+                in_flight[pool.submit(fetch_ticker, stock_id, force_refresh)] = stock_id
+                # 限制同時進行中的工作量，避免整份清單的 payload 同時留在記憶體
+                while len(in_flight) >= max_in_flight:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        handle(in_flight.pop(future), future)
+
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    handle(in_flight.pop(future), future)
+    except KeyboardInterrupt:
+        print("⚠️ 中斷，保存目前進度...")
+        raise
+    finally:
+        flush()
+        conn.close()
+        report()
+        if done:
+            # 逐檔寫入時不重算同業統計 (每檔都重算所在組別是 O(N x 組別大小))，最後整個重建一次
+            try:
+                db_writer.write([(rebuild_peers, [])])
+            except Exception as e:
+                print(f"❌ 同業統計重建失敗: {e}")
+
+    return {"done": done, "failed": failed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-ingest Alpha Vantage fundamentals for a ticker universe.")
+    parser.add_argument("tickers", help="ticker list file (one per line, or CSV with ticker in the first column)")
+    parser.add_argument("--run-id", help="checkpoint id (default: ticker file name)")
+    parser.add_argument("--workers", type=int, default=settings.ALPHA_VANTAGE_MAX_WORKERS)
+    parser.add_argument("--max-in-flight", type=int, default=None, help="max tickers fetched but not yet stored")
+    parser.add_argument("--batch-size", type=int, default=25, help="tickers between progress flushes")
+    parser.add_argument("--force-refresh", action="store_true")
+    parser.add_argument("--restart", action="store_true", help="discard the checkpoint for this run id")
+    args = parser.parse_args()
+
+    run_id = args.run_id or os.path.basename(args.tickers)
+    if args.restart:
+        create_fundamental_tables()
+        c = get_db_connection()
+        c.execute("DELETE FROM IngestProgress WHERE RunId = ?", (run_id,))
+        c.commit()
+        c.close()
+
+    run_ingest(
+        args.tickers,
+        run_id,
+        workers=args.workers,
+        max_in_flight=args.max_in_flight or args.workers * 2,
+        batch_size=args.batch_size,
+        force_refresh=args.force_refresh,
+    )
@@ -3,7 +3,9 @@ import config
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from database import create_fundamental_tables
-from routers import stock, agent
+from common.market_data import request_scope
+from services import analytics_service
+from routers import stock, agent, jobs, analytics, screen
 
 
 app = FastAPI()
@@ -16,9 +18,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def market_data_request_scope(request, call_next):
+    # 同一個 HTTP 請求內重複的 yfinance 查詢只抓一次
+    with request_scope():
+        return await call_next(request)
+
 @app.on_event("startup")
 def startup():
     create_fundamental_tables()
+    # 分析快照在背景載入 / 匯出，不佔用第一個查詢的請求
+    analytics_service.start_refresh(export=analytics_service.is_stale())
     print("\n Current API List:")
     for route in app.routes:
         print(f"   {route.methods}  {route.path}")
@@ -26,6 +36,9 @@ def startup():
 
 app.include_router(stock.router)
 app.include_router(agent.router)
+app.include_router(jobs.router)
+app.include_router(analytics.router)
+app.include_router(screen.router)
 
 if __name__ == "__main__":
     import uvicorn
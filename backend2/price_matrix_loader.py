@@ -0,0 +1,49 @@
+#共享記憶體價格矩陣 loader (每台主機執行一個，uvicorn workers 只讀 attach)
+#用法: python price_matrix_loader.py --interval 300
+import argparse
+import os
+import signal
+import time
+from database import create_fundamental_tables
+from config import settings
+from services.price_matrix import publish_matrix
+
+
+def _release(shm):
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish the shared-memory price matrix for API workers.")
+    parser.add_argument("--interval", type=float, default=settings.PRICE_MATRIX_REFRESH_SECONDS)
+    args = parser.parse_args()
+
+    # SIGTERM 與 Ctrl+C 相同處理，確保區段與 manifest 會被清掉
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    create_fundamental_tables()
+    current = None
+    try:
+        while True:
+            try:
+                shm = publish_matrix()
+            except Exception as e:
+                print(f"⚠️ 共享價格矩陣更新失敗: {e}")
+            else:
+                # 已 attach 舊版本的 worker 仍保有自己的 mapping，unlink 只是讓新 attach 找不到舊區段
+                if current is not None:
+                    _release(current)
+                current = shm
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if current is not None:
+            _release(current)
+        try:
+            os.remove(settings.PRICE_MATRIX_MANIFEST)
+        except OSError:
+            pass
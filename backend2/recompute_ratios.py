@@ -0,0 +1,19 @@
+#整批重算財務比率 (例如大量匯入之後)，不重新下載任何資料
+#用法: python recompute_ratios.py [--tickers sp500.txt] [--chunk-size 500] [--workers 8]
+import argparse
+from database import create_fundamental_tables
+from services.ratio_batch import recompute_ratios
+from ingest_universe import iter_tickers
+from config import settings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute FinancialRatios for many tickers in one batched pass.")
+    parser.add_argument("--tickers", help="ticker list file (default: every ticker with stored statements)")
+    parser.add_argument("--chunk-size", type=int, default=settings.RATIO_BATCH_CHUNK, help="tickers per query / worker task")
+    parser.add_argument("--workers", type=int, default=settings.RATIO_BATCH_WORKERS, help="worker processes")
+    args = parser.parse_args()
+
+    create_fundamental_tables()
+    stock_ids = list(iter_tickers(args.tickers)) if args.tickers else None
+    recompute_ratios(stock_ids, chunk_size=args.chunk_size, workers=args.workers)
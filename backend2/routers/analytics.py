@@ -0,0 +1,28 @@
+#分析查詢 API：以 DuckDB 對 Parquet 快照執行唯讀的跨股票 SQL
+import duckdb
+from fastapi import APIRouter, HTTPException
+from schemas import AnalyticsQuery
+from services.analytics_service import SnapshotNotReady, run_query, describe_tables
+
+router = APIRouter()
+
+@router.post("/api/analytics/query")
+def analytics_query(req: AnalyticsQuery):
+    """
+    例: SELECT RatioName, median(RatioValue) FROM ratios WHERE ReportYear = 2024 GROUP BY 1
+    可用的表: statements / ratios / company_info
+    """
+    try:
+        columns, rows, elapsed_ms = run_query(req.sql, req.params, req.limit)
+    except SnapshotNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except (ValueError, duckdb.Error) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success", "columns": columns, "rows": rows, "row_count": len(rows), "elapsed_ms": elapsed_ms}
+
+@router.get("/api/analytics/tables")
+def analytics_tables():
+    try:
+        return {"status": "success", "data": describe_tables()}
+    except SnapshotNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e))
@@ -0,0 +1,32 @@
+#背景工作 API：送出後立即回傳 job id，由 worker.py 執行
+from fastapi import APIRouter, HTTPException
+from schemas import JobRequest
+from services.job_service import submit_job, get_job, JOB_KINDS
+
+router = APIRouter()
+
+@router.post("/api/jobs")
+def create_job(req: JobRequest):
+    if req.kind not in JOB_KINDS:
+        raise HTTPException(status_code=400, detail=f"Unknown job kind. Supported: {', '.join(JOB_KINDS)}")
+    job_id = submit_job(req.kind, {"ticker": req.ticker.upper(), "force_refresh": req.force_refresh})
+    return {"status": "queued", "job_id": job_id}
+
+@router.get("/api/jobs/{job_id}")
+def job_status(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.pop("result")
+    return {"status": "success", "data": job}
+
+@router.get("/api/jobs/{job_id}/result")
+def job_result(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == "failed":
+        return {"status": "error", "job_status": job["status"], "message": job["error"]}
+    if job["status"] != "done":
+        return {"status": "pending", "job_status": job["status"]}
+    return {"status": "success", "job_status": job["status"], "result": job["result"]}
@@ -0,0 +1,29 @@
+#選股 API：以最新年度比率做複合條件篩選 (排序 + 分頁)
+from fastapi import APIRouter, HTTPException
+from schemas import ScreenRequest
+from services.screen_service import screen, SCREEN_FIELDS, OPERATORS
+
+router = APIRouter()
+
+@router.post("/api/screen")
+def screen_stocks(req: ScreenRequest):
+    """
+    例: {"filters": [{"field": "ROE", "op": ">", "value": 0.2},
+                     {"field": "Debt-to-Equity Ratio", "op": "<", "value": 0.5},
+                     {"field": "RevenueGrowth", "op": ">", "value": 0.1}],
+         "sort": "ROE", "order": "desc", "limit": 50, "offset": 0}
+    """
+    if not 1 <= req.limit <= 500 or req.offset < 0:
+        raise HTTPException(status_code=400, detail="limit must be 1-500 and offset >= 0")
+    try:
+        data = screen(
+            [(f.field, f.op, f.value) for f in req.filters],
+            sort=req.sort, order=req.order, limit=req.limit, offset=req.offset, min_year=req.min_year,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success", **data}
+
+@router.get("/api/screen/fields")
+def screen_fields():
+    return {"status": "success", "fields": SCREEN_FIELDS, "operators": list(OPERATORS)}
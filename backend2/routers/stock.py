@@ -1,45 +1,29 @@
 #Alpha Vantage Source API
+import numpy as np
 from fastapi import APIRouter, HTTPException
 from schemas import StockRequest
 from services.data_service import (
-    download_and_store_fundamentals, 
-    calculate_financial_ratios, 
+    analyze_ticker,
     get_db_connection, 
-    get_competitor_dataframe_markdown, 
     search_symbol_alpha_vantage,
-    get_context_str
 )
-from services.ai_service import generate_investment_memo, run_technical_agent
+from services.ai_service import generate_and_store_ai_report, run_technical_agent
 from services.backtest_service import run_backtest 
-import pandas as pd
-import numpy as np
-import datetime as dt
-import yfinance as yf
+from services.quota_service import get_quota_status
+from services.price_store import get_price_slice
+from services import price_matrix
+from common.report_search import search_reports
+from database import get_pool_stats, REPORT_SEARCH
+from services.db_writer import db_writer
 
 router = APIRouter()
 
 @router.post("/api/analyze")
 def analyze(req: StockRequest):
-    ticker = req.ticker.upper()
-    if not download_and_store_fundamentals(ticker):
+    data_list = analyze_ticker(req.ticker.upper(), force_refresh=req.force_refresh)
+    if data_list is None:
         raise HTTPException(status_code=404, detail="Download failed")
-    
-    conn = get_db_connection()
-    try:
-        calculate_financial_ratios(ticker, conn)
-        
-        df = pd.read_sql("SELECT * FROM FinancialRatios WHERE Stock_Id = ?", conn, params=(ticker,))
-        data_list = df.to_dict(orient="records")
-        
-        for row in data_list:
-            for key, value in row.items():
-                if isinstance(value, (float, np.floating)):
-                    if np.isnan(value) or np.isinf(value):
-                        row[key] = None
-        
-        return {"status": "success", "data": data_list}
-    finally:
-        conn.close()
+    return {"status": "success", "data": data_list}
 
 @router.get("/api/search")
 def search_ticker(keyword: str):
@@ -49,49 +33,29 @@ def search_ticker(keyword: str):
     results = search_symbol_alpha_vantage(keyword)
     return {"status": "success", "data": results}
 
-@router.post("/api/analyze_ai/{stock_id}")
-def analyze_stock_ai(stock_id: str):
-    stock_id = stock_id.upper()
-    conn = get_db_connection()
-    try:
-        comparison_md = get_competitor_dataframe_markdown([stock_id], conn)
-        summary = get_context_str(stock_id, conn)
-        if not summary or "No financial data" in summary:
-             download_and_store_fundamentals(stock_id)
-             summary = get_context_str(stock_id, conn)
-             comparison_md = get_competitor_dataframe_markdown([stock_id], conn)
+@router.get("/api/quota")
+def quota_status():
+    """Alpha Vantage 剩餘配額與排隊狀況"""
+    return {"status": "success", "data": get_quota_status()}
 
-        if not summary:
-            return {"status": "error", "message": "無法取得數據，請確認後端已下載財報"}
-        
-        ai_report = generate_investment_memo(stock_id, summary + "\n\n" + comparison_md)
-        today = dt.date.today().strftime("%Y-%m-%d")
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM AI_Analysis WHERE Stock_Id = ? AND ReportDate = ?", (stock_id, today))
-        row = cursor.fetchone()
+@router.get("/api/db_stats")
+def db_stats():
+    """SQLite 連線池、寫入佇列與共享價格矩陣統計"""
+    return {"status": "success", "data": {"pool": get_pool_stats(), "writer": db_writer.stats(), "price_matrix": price_matrix.status()}}
 
-        if row:
-            cursor.execute("""
-                UPDATE AI_Analysis 
-                SET AnalysisContent = ?, CreatedAt = CURRENT_TIMESTAMP 
-                WHERE Stock_Id = ? AND ReportDate = ?
-            """, (ai_report, stock_id, today))
-        else:
-            cursor.execute("""
-                INSERT INTO AI_Analysis (Stock_Id, ReportDate, AnalysisContent)
-                VALUES (?, ?, ?)
-            """, (stock_id, today, ai_report))
-        
-        conn.commit()
-        
-        return {"status": "success", "ticker": stock_id}
+@router.post("/api/analyze_ai/{stock_id}")
+def analyze_stock_ai(stock_id: str):
+    return generate_and_store_ai_report(stock_id.upper())
 
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return {"status": "error", "message": f"AI 模型執行失敗: {str(e)}"}
-    finally:
-        conn.close()
+@router.get("/api/reports/search")
+def search_ai_reports(q: str, ticker: str = None, limit: int = 20, offset: int = 0):
+    """全文檢索所有已產生的 AI 報告 (依相關度排序，回傳片段)，可先找舊報告再決定是否重新產生"""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q is required")
+    if not 1 <= limit <= 100 or offset < 0:
+        raise HTTPException(status_code=400, detail="limit must be 1-100 and offset >= 0")
+    results = search_reports(REPORT_SEARCH, q, ticker=ticker, limit=limit, offset=offset)
+    return {"status": "success", "query": q, "count": len(results), "results": results}
 
 @router.get("/api/get_ai_report/{stock_id}")
 def get_ai_report(stock_id: str):
@@ -131,28 +95,27 @@ def get_stock_history(ticker: str, period: str = "2y"):
     """
     try:
         ticker = ticker.upper()
-        # 使用 yfinance 抓取歷史數據
-        stock = yf.Ticker(ticker)
-        df = stock.history(period=period)
+        # 從本地價格庫讀取 (只補抓缺少的K棒)，價格與 yfinance auto_adjust 相同
+        px = get_price_slice(ticker, period=period)
         
-        if df.empty:
+        if len(px) == 0:
             return {"status": "error", "message": "No data found"}
         
-        # 整理數據格式給前端
-        df = df.reset_index()
-        df['Date'] = df['Date'].dt.strftime('%Y-%m-%d') # 轉成字串
-        
-        # 只取需要的欄位
-        data_list = []
-        for _, row in df.iterrows():
-            data_list.append({
-                "Date": row['Date'],
-                "Open": row['Open'],
-                "High": row['High'],
-                "Low": row['Low'],
-                "Close": row['Close'],
-                "Volume": row['Volume']
-            })
+        # 直接由欄位陣列整理給前端 (等同 auto_adjust：OHLC 依 Adj Close / Close 比例調整)
+        cols = px.columns
+        factor = np.nan_to_num(cols['Adj Close'] / cols['Close'], nan=1.0)
+        dates = np.datetime_as_string(px.dates, unit='D')
+        data_list = [
+            {"Date": d, "Open": o, "High": h, "Low": l, "Close": c, "Volume": v}
+            for d, o, h, l, c, v in zip(
+                dates.tolist(),
+                (cols['Open'] * factor).tolist(),
+                (cols['High'] * factor).tolist(),
+                (cols['Low'] * factor).tolist(),
+                cols['Adj Close'].tolist(),
+                cols['Volume'].tolist(),
+            )
+        ]
             
         return {"status": "success", "data": data_list}
         
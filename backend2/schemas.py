@@ -1,8 +1,34 @@
 #定義傳輸格式 (Pydantic)
+from typing import List, Optional
 from pydantic import BaseModel
 
 class StockRequest(BaseModel):
     ticker: str
+    force_refresh: bool = False
     
 class ChatRequest(BaseModel):
-    message: str
\ No newline at end of file
+    message: str
+
+class JobRequest(BaseModel):
+    kind: str
+    ticker: str
+    force_refresh: bool = False
+
+class AnalyticsQuery(BaseModel):
+    sql: str
+    params: List = []
+    limit: Optional[int] = None
+
+
+class ScreenFilter(BaseModel):
+    field: str
+    op: str
+    value: float
+
+class ScreenRequest(BaseModel):
+    filters: List[ScreenFilter] = []
+    sort: Optional[str] = None
+    order: str = "desc"
+    limit: int = 50
+    offset: int = 0
+    min_year: Optional[int] = None
@@ -3,11 +3,19 @@ import google.generativeai as genai
 import asyncio
 import traceback
 import re
+import datetime as dt
 from google.adk.agents import Agent
 from google.adk.runners import InMemoryRunner
 from google.adk.tools import google_search, AgentTool, ToolContext, FunctionTool 
 from services.tech_service import run_technical_analysis # [NEW] 匯入工具
 from config import settings
+from database import get_db_connection
+from services.db_writer import db_writer
+from services.data_service import (
+    download_and_store_fundamentals,
+    get_competitor_dataframe_markdown,
+    get_context_str,
+)
 
 
 
@@ -56,6 +64,39 @@ def generate_investment_memo(ticker: str, context: str):
         traceback.print_exc()
         return f"AI Generation Failed: {str(e)}"
     
+def generate_and_store_ai_report(stock_id: str):
+    """
+    彙整財務數據 -> 產生投資備忘錄 -> 寫入 AI_Analysis (同一天只保留最新一份)
+    """
+    conn = get_db_connection()
+    try:
+        comparison_md = get_competitor_dataframe_markdown([stock_id], conn)
+        summary = get_context_str(stock_id, conn)
+        if not summary or "No financial data" in summary:
+             download_and_store_fundamentals(stock_id)
+             summary = get_context_str(stock_id, conn)
+             comparison_md = get_competitor_dataframe_markdown([stock_id], conn)
+
+        if not summary:
+            return {"status": "error", "message": "無法取得數據，請確認後端已下載財報"}
+        
+        ai_report = generate_investment_memo(stock_id, summary + "\n\n" + comparison_md)
+        today = dt.date.today().strftime("%Y-%m-%d")
+        db_writer.write([("""
+            INSERT INTO AI_Analysis (Stock_Id, ReportDate, AnalysisContent)
+            VALUES (?, ?, ?)
+            ON CONFLICT(Stock_Id, ReportDate) DO UPDATE SET
+                AnalysisContent = excluded.AnalysisContent, CreatedAt = CURRENT_TIMESTAMP
+        """, (stock_id, today, ai_report))])
+        
+        return {"status": "success", "ticker": stock_id}
+
+    except Exception as e:
+        traceback.print_exc()
+        return {"status": "error", "message": f"AI 模型執行失敗: {str(e)}"}
+    finally:
+        conn.close()
+    
 async def run_technical_agent(ticker: str):
     print(f"--- AI Agent: Running Technical Analysis for {ticker} ---")
     
@@ -0,0 +1,222 @@
+#分析查詢層：把 FinancialStatements / FinancialRatios / CompanyInfoLatest 匯出成 Parquet (欄式)，
+#載入內嵌的 DuckDB 後以向量化 SQL 做跨股票的彙總，不必逐檔在 Python 迴圈裡處理
+import datetime as dt
+import os
+import threading
+import time
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from database import get_db_connection
+from config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows：沒有 flock，只在程序內避免重複匯出
+    fcntl = None
+
+# 表名 -> (來源查詢, Parquet schema)
+EXPORTS = {
+    "statements": (
+        "SELECT Stock_Id, StatementType, Item, ReportDate, Value FROM FinancialStatements",
+        pa.schema([("Stock_Id", pa.string()), ("StatementType", pa.string()), ("Item", pa.string()),
+                   ("ReportDate", pa.date32()), ("Value", pa.float64())]),
+    ),
+    "ratios": (
+        "SELECT Stock_Id, ReportYear, Category, RatioName, RatioValue, Formula FROM FinancialRatios",
+        pa.schema([("Stock_Id", pa.string()), ("ReportYear", pa.int32()), ("Category", pa.string()),
+                   ("RatioName", pa.string()), ("RatioValue", pa.float64()), ("Formula", pa.string())]),
+    ),
+    "company_info": (
+        "SELECT Stock_Id, DataKey, DataValue, NumValue FROM CompanyInfoLatest",
+        pa.schema([("Stock_Id", pa.string()), ("DataKey", pa.string()), ("DataValue", pa.string()),
+                   ("NumValue", pa.float64())]),
+    ),
+}
+
+_lock = threading.Lock()
+_engine = {"db": None, "mtime": None, "checked_at": 0.0, "refreshing": False}
+
+
+class SnapshotNotReady(RuntimeError):
+    """還沒有可查詢的快照 (背景正在匯出 / 載入)"""
+
+
+def _path(name):
+    return os.path.join(settings.ANALYTICS_DIR, f"{name}.parquet")
+
+
+def export_snapshot():
+    """
+    分批讀出資料表並寫成 Parquet (先寫暫存檔再原子替換，查詢中的 worker 不會讀到一半的檔案)。
+    同時只有一個程序匯出：其他程序正在匯出時直接回傳 None。
+    """
+    os.makedirs(settings.ANALYTICS_DIR, exist_ok=True)
+    with open(os.path.join(settings.ANALYTICS_DIR, ".export.lock"), "a+b") as lock:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+        try:
+            return _export_tables()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _export_tables():
+    counts = {}
+    conn = get_db_connection()
+    try:
+        for name, (query, schema) in EXPORTS.items():
+            tmp = f"{_path(name)}.{os.getpid()}.tmp"
+            rows = 0
+            with pq.ParquetWriter(tmp, schema, compression="zstd") as writer:
+                for chunk in pd.read_sql(query, conn, chunksize=settings.ANALYTICS_EXPORT_CHUNK):
+                    if "ReportDate" in chunk.columns:
+                        chunk["ReportDate"] = pd.to_datetime(chunk["ReportDate"]).dt.date
+                    writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                    rows += len(chunk)
+            os.replace(tmp, _path(name))
+            counts[name] = rows
+    finally:
+        conn.close()
+    print(f"📦 分析快照已匯出: {counts}")
+    return counts
+
+
+def _snapshot_mtime():
+    try:
+        return min(os.stat(_path(name)).st_mtime for name in EXPORTS)
+    except OSError:
+        return None
+
+
+def _lock_down(db):
+    """關閉外部檔案存取並鎖定設定 (ad-hoc 查詢不能讀寫伺服器上的其他檔案，也不能再改回來)"""
+    db.execute("SET enable_external_access = false")
+    db.execute("SET lock_configuration = true")
+    return db
+
+
+# 只用來拆解 / 分類使用者 SQL：DuckDB 解析時就會展開 PRAGMA (例如 import_database 會讀檔並執行)，
+# 不能用模組層級的預設連線 (可存取檔案)
+_parser = _lock_down(duckdb.connect(":memory:"))
+
+
+def _load_engine():
+    """把 Parquet 載入新的 in-memory DuckDB，再關閉外部檔案存取"""
+    db = duckdb.connect(":memory:")
+    for name in EXPORTS:
+        db.execute(f"CREATE TABLE {name} AS SELECT * FROM read_parquet(?)", [_path(name)])
+    return _lock_down(db)
+
+
+def is_stale(mtime=None):
+    mtime = _snapshot_mtime() if mtime is None else mtime
+    return mtime is None or time.time() - mtime > settings.ANALYTICS_REFRESH_MINUTES * 60
+
+
+def _refresh(export):
+    """背景執行緒：必要時重新匯出，再載入新的 DuckDB 並替換 (查詢中的請求繼續使用舊的)"""
+    try:
+        if export:
+            export_snapshot()
+        mtime = _snapshot_mtime()
+        if mtime is not None and mtime != _engine["mtime"]:
+            db = _load_engine()
+            with _lock:
+                _engine.update(db=db, mtime=mtime)
+    except Exception as e:
+        print(f"⚠️ 分析快照更新失敗: {e}")
+    finally:
+        with _lock:
+            _engine["refreshing"] = False
+
+
+def start_refresh(export=False):
+    """在背景更新快照 (同一程序同時只有一個)；請求執行緒不會等待匯出"""
+    with _lock:
+        if _engine["refreshing"]:
+            return False
+        _engine["refreshing"] = True
+    threading.Thread(target=_refresh, args=(export,), name="analytics-refresh", daemon=True).start()
+    return True
+
+
+def _engine_db():
+    """
+    回傳目前的 DuckDB。每 ANALYTICS_CHECK_SECONDS 檢查一次：快照超過 ANALYTICS_REFRESH_MINUTES 時在背景重新匯出，
+    其他 worker 匯出的新快照也在背景載入；還沒有任何快照時拋出 SnapshotNotReady。
+    """
+    with _lock:
+        now = time.monotonic()
+        check = now - _engine["checked_at"] >= settings.ANALYTICS_CHECK_SECONDS
+        if check:
+            _engine["checked_at"] = now
+        db = _engine["db"]
+    if check or db is None:
+        mtime = _snapshot_mtime()
+        stale = is_stale(mtime)
+        if stale or mtime != _engine["mtime"]:
+            start_refresh(export=stale)
+    if db is None:
+        raise SnapshotNotReady("Analytics snapshot is being built, retry shortly")
+    return db
+
+
+def _check_read_only(sql):
+    # 每次呼叫使用自己的 cursor，多執行緒可同時檢查
+    cursor = _parser.cursor()
+    try:
+        statements = cursor.extract_statements(sql)
+    finally:
+        cursor.close()
+    if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+        raise ValueError("Only a single SELECT statement is allowed")
+    return statements[0].query
+
+
+def run_query(sql, params=None, limit=None):
+    """
+    執行唯讀 SQL，回傳 (columns, rows, elapsed_ms)。
+    可用的表: statements / ratios / company_info (欄位同來源資料表)。
+    """
+    sql = _check_read_only(sql)
+    limit = min(limit or settings.ANALYTICS_MAX_ROWS, settings.ANALYTICS_MAX_ROWS)
+    # 每次查詢使用自己的 cursor，多執行緒可同時查詢
+    cursor = _engine_db().cursor()
+    try:
+        started = time.perf_counter()
+        result = cursor.execute(sql, params or [])
+        columns = [d[0] for d in result.description]
+        rows = result.fetchmany(limit)
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    finally:
+        cursor.close()
+    return columns, [[_jsonable(v) for v in row] for row in rows], elapsed_ms
+
+
+def _jsonable(value):
+    if isinstance(value, (dt.date, dt.datetime)):
+        return value.isoformat()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def describe_tables():
+    """各分析表的欄位與筆數"""
+    db = _engine_db()
+    cursor = db.cursor()
+    try:
+        tables = {}
+        for name in EXPORTS:
+            columns = cursor.execute(f"DESCRIBE {name}").fetchall()
+            count = cursor.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+            tables[name] = {"rows": count, "columns": {c[0]: c[1] for c in columns}}
+    finally:
+        cursor.close()
+    return {"snapshot_at": dt.datetime.fromtimestamp(_engine["mtime"]).isoformat(timespec="seconds"), "tables": tables}
@@ -1,7 +1,7 @@
 # backend2/services/backtest_service.py
-import yfinance as yf
 import pandas as pd
 import numpy as np
+from services.price_store import get_price_slice
 
 def calculate_metrics(daily_returns):
     """計算 CAGR, Sharpe, Max Drawdown"""
@@ -42,29 +42,16 @@ def run_backtest(ticker_symbol, period="5y"):
     print(f"📈 正在回測 {ticker_symbol} 過去 {period} 績效...")
     
     try:
-        tickers = [ticker_symbol, "SPY"]
+        # 1. 從本地價格庫讀取 (SPY 同樣只補抓缺少的K棒)
+        # 只取 Adj Close 欄位的 mmap 切片，不載入其他欄位
+        stock_px = get_price_slice(ticker_symbol, period=period, fields=["Adj Close"])
+        bench_px = get_price_slice("SPY", period=period, fields=["Adj Close"])
         
-        # 1. 下載數據 (先不指定欄位，下載全部回來檢查)
-        # auto_adjust=False 確保嘗試抓取原始 Adj Close，但也準備好 Fallback
-        df = yf.download(tickers, period=period, progress=False, auto_adjust=False)
-        
-        if df.empty:
+        if len(stock_px) == 0:
             return {"status": "error", "message": "Yahoo Finance returned no data."}
 
-        # 2. 決定使用哪個價格欄位 (優先找 Adj Close，沒有就用 Close)
-        # yfinance 的 columns 可能是 MultiIndex: ('Adj Close', 'AAPL')
-        price_col_name = 'Adj Close'
-        
-        # 檢查第一層 index 是否有 'Adj Close'
-        if 'Adj Close' not in df.columns.get_level_values(0):
-            if 'Close' in df.columns.get_level_values(0):
-                print("⚠️ Warning: 'Adj Close' not found, using 'Close' instead.")
-                price_col_name = 'Close'
-            else:
-                return {"status": "error", "message": f"Price columns not found. Columns: {df.columns}"}
-
-        # 取出價格數據
-        data = df[price_col_name]
+        # 2. 使用 Adj Close 計算報酬
+        data = pd.concat({ticker_symbol: stock_px.series('Adj Close'), "SPY": bench_px.series('Adj Close')}, axis=1)
         
         # 3. 處理欄位對應
         # 如果只下載到一個 ticker (另一個失敗)，data 可能是 Series 或只有一欄的 DataFrame
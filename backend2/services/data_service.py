@@ -1,12 +1,25 @@
 import requests
+import threading
 import datetime as dt
 import pandas as pd
 import numpy as np
 import time
 import json
 import traceback 
-from database import get_db_connection
+import hashlib
+from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from database import get_db_connection, BulkUpsert, backend
+from services.db_writer import db_writer
+from common.statement_store import rebuild_pivots, load_statement_pivots
+from services.screen_service import latest_ratio_statements
+from services.peer_service import GROUP_TYPES, peer_statement, refresh_moved_peers, get_peer_context
+from common.ratio_engine import Ratio, yoy, RULES_VERSION, evaluate_ratios
 from config import settings
+from services.quota_service import av_scheduler, PRIORITY_ANALYZE, PRIORITY_SEARCH
+from common.response_cache import response_cache
 
 def safe_float(val, debug_name=""):
     """防止 'None', 'null' 等字串導致 crash"""
@@ -39,87 +52,301 @@ AV_MAPPING = {
     "dividendPayout": "Cash Dividends Paid"
 }
 
-def download_and_store_fundamentals(stock_id):
+AV_BASE_URL = "https://www.alphavantage.co/query"
+
+# 財報類型 -> Alpha Vantage function
+STATEMENT_FUNCTIONS = {'Income': 'INCOME_STATEMENT', 'BalanceSheet': 'BALANCE_SHEET', 'CashFlow': 'CASH_FLOW'}
+# 季報以 StatementType 後綴區分 (例如 Income_Q)，與年報共用 FinancialStatements
+QUARTERLY_SUFFIX = '_Q'
+
+_av_session = None
+_av_session_lock = threading.Lock()
+
+
+def get_av_session():
+    """共用的 HTTP Session，保留 keep-alive 連線避免每次重新 TCP/TLS 握手"""
+    global _av_session
+    if _av_session is None:
+        with _av_session_lock:
+            if _av_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=settings.ALPHA_VANTAGE_POOL_SIZE,
+                    max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504]),
+                )
+                session.mount("https://", adapter)
+                _av_session = session
+    return _av_session
+
+
+def _av_cache_ttl(function):
+    """各 endpoint 原始回應的快取秒數"""
+    if function == 'GLOBAL_QUOTE':
+        return settings.QUOTE_TTL_MINUTES * 60
+    if function in STATEMENT_FUNCTIONS.values():
+        return settings.STATEMENT_RECHECK_HOURS * 3600
+    return settings.OVERVIEW_TTL_HOURS * 3600
+
+
+def fetch_alpha_vantage(function, priority=PRIORITY_ANALYZE, refresh=False, **params):
+    """
+    呼叫單一 Alpha Vantage endpoint (先查原始回應快取，未命中才經過配額排程)。
+    遇到錯誤或限流訊息時拋出例外，錯誤回應不會被快取。
+    """
+    def fetch():
+        av_scheduler.acquire(priority)
+        query = {"function": function, "apikey": settings.ALPHA_VANTAGE_API_KEY, **params}
+        resp = get_av_session().get(AV_BASE_URL, params=query, timeout=settings.ALPHA_VANTAGE_TIMEOUT)
+        resp.raise_for_status()
+        data = resp.json()
+        if "Error Message" in data:
+            raise RuntimeError(f"{function}: {data['Error Message']}")
+        for key in ("Note", "Information"):
+            if key in data:
+                # 每日額度用完的訊息為 "... requests per day ..."
+                av_scheduler.report_throttled(daily="per day" in str(data[key]).lower())
+                raise RuntimeError(f"{function} throttled: {data[key]}")
+        return data
+
+    return response_cache.cached("alpha_vantage", _av_cache_ttl(function), fetch, function, refresh=refresh, **params)
+
+
+def fetch_fundamental_payloads(stock_id, functions, priority=PRIORITY_ANALYZE, refresh=False):
+    """
+    並行抓取多個 endpoint，各自處理失敗。
+    回傳 {function: payload}，失敗的 endpoint 值為 None。
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=settings.ALPHA_VANTAGE_MAX_WORKERS) as pool:
+        futures = {pool.submit(fetch_alpha_vantage, func, priority, refresh, symbol=stock_id): func for func in functions}
+        for future in as_completed(futures):
+            func = futures[future]
+            try:
+                results[func] = future.result()
+                print(f"🔍 [{func}] API 回應: {str(results[func])[:200]}...")
+            except Exception as e:
+                print(f"⚠️ [{func}] 抓取失敗: {e}")
+                results[func] = None
+    return results
+
+
+def get_stale_endpoints(stock_id, conn, force_refresh=False):
+    """
+    依資料庫現有內容判斷哪些 endpoint 需要重新下載：
+    - 股價：QUOTE_TTL_MINUTES 分鐘
+    - 公司概況：OVERVIEW_TTL_HOURS 小時
+    - 財報：下一期財報 (有季報用季報，否則年報) 的預期申報日之前都視為新鮮；
+      過期後每 STATEMENT_RECHECK_HOURS 小時最多重查一次
+    """
+    all_endpoints = ['GLOBAL_QUOTE', 'OVERVIEW', *STATEMENT_FUNCTIONS.values()]
+    if force_refresh:
+        return all_endpoints
+
+    now = dt.datetime.now()
+    cursor = conn.cursor()
+    cursor.execute("SELECT Endpoint, FetchedAt FROM IngestLog WHERE Stock_Id = ?", (stock_id,))
+    fetched_at = {row[0]: dt.datetime.fromisoformat(row[1]) for row in cursor.fetchall()}
+    cursor.execute("SELECT StatementType, MAX(ReportDate) FROM FinancialStatements WHERE Stock_Id = ? GROUP BY StatementType", (stock_id,))
+    latest_report = {row[0]: dt.datetime.fromisoformat(row[1]) for row in cursor.fetchall() if row[1]}
+
+    def fetched_within(endpoint, ttl):
+        return endpoint in fetched_at and now - fetched_at[endpoint] < ttl
+
+    stale = []
+    if not fetched_within('GLOBAL_QUOTE', dt.timedelta(minutes=settings.QUOTE_TTL_MINUTES)):
+        stale.append('GLOBAL_QUOTE')
+    if not fetched_within('OVERVIEW', dt.timedelta(hours=settings.OVERVIEW_TTL_HOURS)):
+        stale.append('OVERVIEW')
+
+    for stmt_type, func_name in STATEMENT_FUNCTIONS.items():
+        last = latest_report.get(stmt_type)
+        if last is None:
+            stale.append(func_name)
+            continue
+        next_due = last + dt.timedelta(days=365 + settings.STATEMENT_FILING_LAG_DAYS)
+        last_quarter = latest_report.get(stmt_type + QUARTERLY_SUFFIX)
+        if last_quarter is not None:
+            next_due = min(next_due, last_quarter + dt.timedelta(days=91 + settings.QUARTERLY_FILING_LAG_DAYS))
+        if now < next_due or fetched_within(func_name, dt.timedelta(hours=settings.STATEMENT_RECHECK_HOURS)):
+            continue
+        stale.append(func_name)
+
+    return stale
+
+
+def _statement_rows(stock_id, stmt_type, report):
+    """將單期 Alpha Vantage 財報轉成 FinancialStatements 資料列 (年報/季報共用)"""
+    rows = []
+    report_date = report.get('fiscalDateEnding')
+    base_type = stmt_type.replace(QUARTERLY_SUFFIX, '')
+    if base_type == 'BalanceSheet':
+        short = safe_float(report.get('shortTermDebt'))
+        long_d = safe_float(report.get('longTermDebt'))
+        total_debt = short + long_d
+        cash = safe_float(report.get('cashAndCashEquivalentsAtCarryingValue'))
+        equity = safe_float(report.get('totalShareholderEquity'))
+        
+        rows.append((stock_id, stmt_type, 'Total Debt', report_date, total_debt))
+        rows.append((stock_id, stmt_type, 'Net Debt', report_date, total_debt - cash))
+        rows.append((stock_id, stmt_type, 'Invested Capital', report_date, equity + total_debt - cash))
+
+    if base_type == 'CashFlow':
+        op = safe_float(report.get('operatingCashflow'))
+        cap = safe_float(report.get('capitalExpenditures'))
+        rows.append((stock_id, stmt_type, 'Free Cash Flow', report_date, op - cap))
+    for av_key, val in report.items():
+        if av_key in AV_MAPPING:
+            rows.append((stock_id, stmt_type, AV_MAPPING[av_key], report_date, safe_float(val)))
+    return rows
+
+
+def fetch_fundamental_rows(stock_id, stale, priority=PRIORITY_ANALYZE, force_refresh=False):
+    """
+    抓取需更新的 endpoint 並轉成待寫入的資料列 (不碰資料庫)。
+    failed 為抓取失敗或被配額拒絕的 endpoint，這些 endpoint 不會寫入 IngestLog，下次仍視為過期。
+    """
+    today = dt.date.today().strftime('%Y-%m-%d')
+    payloads = fetch_fundamental_payloads(stock_id, stale, priority, force_refresh)
+
+    r_quote = payloads.get('GLOBAL_QUOTE') or {}
+    current_price = safe_float(r_quote.get("Global Quote", {}).get("05. price"))
+    
+    info_data = []
+    if current_price > 0:
+        info_data.append((stock_id, today, 'currentPrice', str(current_price)))
+    r_overview = payloads.get('OVERVIEW') or {}
+    
+    overview_map = {
+        'Symbol': 'symbol', 'Name': 'longName', 'Industry': 'industry', 
+        'Sector': 'sector', 'PERatio': 'trailingPE', 'PEG': 'trailingPegRatio',
+        'BookValue': 'priceToBook', 'DividendYield': 'dividendYield',
+        'EPS': 'trailingEps', 'ProfitMargin': 'profitMargins',
+        'OperatingMargin': 'operatingMargins', 'ReturnOnEquityTTM': 'returnOnEquity',
+        'ReturnOnAssetsTTM': 'returnOnAssets',
+        'MarketCapitalization': 'marketCap'
+    }
+    
+    for av_key, db_key in overview_map.items():
+        val = r_overview.get(av_key)
+        if val and str(val) != 'None':
+            info_data.append((stock_id, today, db_key, str(val)))
+    
+    rev_ttm = safe_float(r_overview.get('RevenueTTM'))
+    gp_ttm = safe_float(r_overview.get('GrossProfitTTM'))
+    if rev_ttm != 0:
+        info_data.append((stock_id, today, 'grossMargins', str(gp_ttm / rev_ttm)))
+
+    all_stmt_data = []
+
+    for stmt_type, func_name in STATEMENT_FUNCTIONS.items():
+        r = payloads.get(func_name) or {}
+        for report in r.get('annualReports', []):
+            all_stmt_data.extend(_statement_rows(stock_id, stmt_type, report))
+        # 季報與年報在同一個回應中，不需額外 API 呼叫
+        for report in r.get('quarterlyReports', []):
+            all_stmt_data.extend(_statement_rows(stock_id, stmt_type + QUARTERLY_SUFFIX, report))
+
+    now = dt.datetime.now().isoformat(timespec='seconds')
+    fetched = [(stock_id, func, now) for func, payload in payloads.items() if payload is not None]
+    failed = sorted(func for func, payload in payloads.items() if payload is None)
+    return {"info": info_data, "statements": all_stmt_data, "fetched": fetched, "failed": failed}
+
+
+COMPANY_INFO_UPSERT = f'''
+    INSERT INTO CompanyInfoLatest (Stock_Id, UpdatedAt, DataKey, DataValue, NumValue) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(Stock_Id, DataKey) DO UPDATE SET
+        DataValue = excluded.DataValue, NumValue = excluded.NumValue, UpdatedAt = excluded.UpdatedAt
+    WHERE {backend.is_distinct("CompanyInfoLatest.DataValue", "excluded.DataValue")}
+'''
+STATEMENT_UPSERT = BulkUpsert("FinancialStatements", ["Stock_Id", "StatementType", "Item", "ReportDate", "Value"])
+INGEST_LOG_UPSERT = BulkUpsert("IngestLog", ["Stock_Id", "Endpoint", "FetchedAt"])
+RATIO_UPSERT = BulkUpsert("FinancialRatios", ["Stock_Id", "ReportYear", "Category", "RatioName", "RatioValue", "Formula"])
+# 重算前先刪掉舊的列：upsert 蓋不掉已經算不出來的比率；TTM 只保留最新一期 (新一季跨年度時 ReportYear 不同)
+TTM_RATIO_DELETE = "DELETE FROM FinancialRatios WHERE Stock_Id = ? AND Category = 'TTM'"
+YEAR_RATIO_DELETE = "DELETE FROM FinancialRatios WHERE Stock_Id = ? AND ReportYear = ? AND Category <> 'TTM'"
+RATIO_DELETE = "DELETE FROM FinancialRatios WHERE Stock_Id = ?"
+
+
+def info_number(value):
+    """CompanyInfoLatest.NumValue：能轉成有限浮點數的值才存，其餘為 NULL"""
+    try:
+        num = float(value)
+    except (TypeError, ValueError):
+        return None
+    return num if np.isfinite(num) else None
+
+
+def company_info_rows(rows):
+    """(Stock_Id, QueryDate, DataKey, DataValue) -> CompanyInfoLatest 的 upsert 參數 (值沒變的 key 不會寫入)"""
+    return [(stock_id, day, key, value, info_number(value)) for stock_id, day, key, value in rows]
+
+
+def get_company_info(stock_id, conn):
+    """讀取最新快照 (主鍵查詢，只回傳每個 key 一列)"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT DataKey, DataValue FROM CompanyInfoLatest WHERE Stock_Id = ?", (stock_id,))
+    return dict(cursor.fetchall())
+
+
+def fundamental_row_statements(rows, refresh_peers=True):
+    """
+    把 fetch_fundamental_rows 的結果轉成 db_writer 的寫入批次。
+    refresh_peers: 有 sector / industry 快照時，同一交易內檢查是否換了組別並重算同業統計 (整批匯入最後統一重建時傳 False)。
+    """
+    grouped = sorted({stock_id for stock_id, _, key, _ in rows["info"] if key in GROUP_TYPES}) if refresh_peers else []
+    return [
+        (COMPANY_INFO_UPSERT, company_info_rows(rows["info"]) or None),
+        (STATEMENT_UPSERT, rows["statements"] or None),
+        # 有新財報時在同一交易內重建寬表，寬表不會落後於 FinancialStatements
+        (rebuild_pivots, sorted({row[0] for row in rows["statements"]}) or None),
+        (INGEST_LOG_UPSERT, rows["fetched"] or None),
+        (refresh_moved_peers, grouped or None),
+    ]
+
+
+def store_fundamental_rows(rows, refresh_peers=True):
+    """經由單一寫入執行緒寫入，commit 後才返回；有新財報時一併重建寬表"""
+    db_writer.write(fundamental_row_statements(rows, refresh_peers))
+
+
+def _statement_pivots(stock_id, conn, stmt_types):
+    # 寬表上線前寫入的財報由 create_fundamental_tables 補建，這裡只讀取
+    return load_statement_pivots(stock_id, conn, stmt_types)
+
+
+def has_statements(stock_id, conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM FinancialStatements WHERE Stock_Id = ? LIMIT 1", (stock_id,))
+    return cursor.fetchone() is not None
+
+
+def download_and_store_fundamentals(stock_id, priority=PRIORITY_ANALYZE, force_refresh=False):
     print(f"📥 [Backend 2] Alpha Vantage: 下載 {stock_id} (含股價/5年財報)...")
-    conn = get_db_connection()
     api_key = settings.ALPHA_VANTAGE_API_KEY
     
     if not api_key:
         print("❌ 錯誤: 未設定 ALPHA_VANTAGE_API_KEY")
         return False
 
+    conn = get_db_connection()
     try:
-        cursor = conn.cursor()
-        today = dt.date.today().strftime('%Y-%m-%d')
-        url_quote = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={stock_id}&apikey={api_key}"
-        r_quote = requests.get(url_quote).json()
-        current_price = safe_float(r_quote.get("Global Quote", {}).get("05. price"))
-        
-        info_data = []
-        if current_price > 0:
-            info_data.append((stock_id, today, 'currentPrice', str(current_price)))
-        url_overview = f"https://www.alphavantage.co/query?function=OVERVIEW&symbol={stock_id}&apikey={api_key}"
-        r_overview = requests.get(url_overview).json()
-        
-        overview_map = {
-            'Symbol': 'symbol', 'Name': 'longName', 'Industry': 'industry', 
-            'Sector': 'sector', 'PERatio': 'trailingPE', 'PEG': 'trailingPegRatio',
-            'BookValue': 'priceToBook', 'DividendYield': 'dividendYield',
-            'EPS': 'trailingEps', 'ProfitMargin': 'profitMargins',
-            'OperatingMargin': 'operatingMargins', 'ReturnOnEquityTTM': 'returnOnEquity',
-            'ReturnOnAssetsTTM': 'returnOnAssets',
-            'MarketCapitalization': 'marketCap'
-        }
-        
-        for av_key, db_key in overview_map.items():
-            val = r_overview.get(av_key)
-            if val and str(val) != 'None':
-                info_data.append((stock_id, today, db_key, str(val)))
-        
-        rev_ttm = safe_float(r_overview.get('RevenueTTM'))
-        gp_ttm = safe_float(r_overview.get('GrossProfitTTM'))
-        if rev_ttm != 0:
-            info_data.append((stock_id, today, 'grossMargins', str(gp_ttm / rev_ttm)))
-
-        cursor.executemany('INSERT OR IGNORE INTO CompanyInfo (Stock_Id, QueryDate, DataKey, DataValue) VALUES (?, ?, ?, ?)', info_data)
-
-        functions = {'Income': 'INCOME_STATEMENT', 'BalanceSheet': 'BALANCE_SHEET', 'CashFlow': 'CASH_FLOW'}
-        all_stmt_data = []
-
-        for stmt_type, func_name in functions.items():
-            url = f"https://www.alphavantage.co/query?function={func_name}&symbol={stock_id}&apikey={api_key}"
-            r = requests.get(url).json()
-            print(f"🔍 [{stmt_type}] API 回應: {str(r)[:200]}...")
-            time.sleep(1) # API Rate Limit 保護
-            
-            reports = r.get('annualReports', [])
-            if not reports: continue
-                
-            for report in reports:
-                report_date = report.get('fiscalDateEnding')
-                if stmt_type == 'BalanceSheet':
-                    short = safe_float(report.get('shortTermDebt'))
-                    long_d = safe_float(report.get('longTermDebt'))
-                    total_debt = short + long_d
-                    cash = safe_float(report.get('cashAndCashEquivalentsAtCarryingValue'))
-                    equity = safe_float(report.get('totalShareholderEquity'))
-                    
-                    all_stmt_data.append((stock_id, stmt_type, 'Total Debt', report_date, total_debt))
-                    all_stmt_data.append((stock_id, stmt_type, 'Net Debt', report_date, total_debt - cash))
-                    all_stmt_data.append((stock_id, stmt_type, 'Invested Capital', report_date, equity + total_debt - cash))
-
-                if stmt_type == 'CashFlow':
-                    op = safe_float(report.get('operatingCashflow'))
-                    cap = safe_float(report.get('capitalExpenditures'))
-                    all_stmt_data.append((stock_id, stmt_type, 'Free Cash Flow', report_date, op - cap))
-                for av_key, val in report.items():
-                    if av_key in AV_MAPPING:
-                        clean_val = safe_float(val)
-                        all_stmt_data.append((stock_id, stmt_type, AV_MAPPING[av_key], report_date, clean_val))
-
-        if all_stmt_data:
-            cursor.executemany('INSERT OR IGNORE INTO FinancialStatements (Stock_Id, StatementType, Item, ReportDate, Value) VALUES (?, ?, ?, ?, ?)', all_stmt_data)
-            conn.commit()
+        stale = get_stale_endpoints(stock_id, conn, force_refresh)
+        if not stale:
+            print(f"✅ {stock_id} 資料仍在有效期內，略過下載")
+            return True
+        print(f"🔄 需更新的 endpoint: {stale}")
+
+        rows = fetch_fundamental_rows(stock_id, stale, priority, force_refresh)
+        store_fundamental_rows(rows)
+
+        if rows["failed"]:
+            print(f"⚠️ {stock_id} 未更新的 endpoint: {rows['failed']}")
+            # 要求強制更新或需更新的 endpoint 全部失敗：資料沒有更新，不回報成功
+            if force_refresh or len(rows["failed"]) == len(stale):
+                return False
+
+        if has_statements(stock_id, conn):
             print("✅ Alpha Vantage 數據下載完成")
             return True
         return False
@@ -131,114 +358,262 @@ def download_and_store_fundamentals(stock_id):
     finally:
         conn.close()
 
+def analyze_ticker(stock_id, force_refresh=False):
+    """
+    下載並計算財務比率，回傳可直接序列化成 JSON 的比率列表。
+    下載失敗時回傳 None。
+    """
+    if not download_and_store_fundamentals(stock_id, force_refresh=force_refresh):
+        return None
+
+    conn = get_db_connection()
+    try:
+        calculate_financial_ratios(stock_id, conn)
+        return read_ratio_rows(stock_id, conn)
+    finally:
+        conn.close()
+
+RATIO_READ_SQL = '''
+    SELECT Stock_Id, ReportYear, Category, RatioName, RatioValue, Formula FROM FinancialRatios
+    WHERE Stock_Id = ? AND (Category <> 'TTM'
+      OR ReportYear = (SELECT MAX(ReportYear) FROM FinancialRatios WHERE Stock_Id = ? AND Category = 'TTM'))
+    ORDER BY ReportYear DESC, Category, RatioName
+'''
+
+def read_ratio_rows(stock_id, conn):
+    """FinancialRatios 的年度比率加上最新一期 TTM 比率，不經過 DataFrame"""
+    cursor = conn.cursor()
+    cursor.execute(RATIO_READ_SQL, (stock_id, stock_id))
+    columns = [d[0] for d in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
 def get_dataframes_from_db(stock_id, conn):
-    query = "SELECT StatementType, Item, ReportDate, Value FROM FinancialStatements WHERE Stock_Id = ?"
-    df_all = pd.read_sql(query, conn, params=(stock_id,))
-    
-    if df_all.empty:
+    """年報寬表 (index 為年度，由新到舊)"""
+    pivots = _statement_pivots(stock_id, conn, list(STATEMENT_FUNCTIONS))
+    if pivots is None:
         return None, None, None
 
     def get_pivot(stmt_type):
-        d = df_all[df_all['StatementType'] == stmt_type]
-        if d.empty: return pd.DataFrame()
-        p = d.pivot_table(index='ReportDate', columns='Item', values='Value')
-        p.index = pd.to_datetime(p.index).year
+        p = pivots[stmt_type]
+        if p.empty: return p
+        p = p.set_axis(p.index.year, axis=0)
+        # 會計年度變更時同一年度會有兩期：保留最新一期 (寬表由舊到新)
+        p = p[~p.index.duplicated(keep='last')]
         return p.sort_index(ascending=False)
 
     return get_pivot('Income'), get_pivot('BalanceSheet'), get_pivot('CashFlow')
 
-def calculate_financial_ratios(stock_id, conn):
+def get_quarterly_dataframes_from_db(stock_id, conn):
+    """季報寬表 (index 為季末日期，由舊到新)"""
+    quarterly_types = [t + QUARTERLY_SUFFIX for t in STATEMENT_FUNCTIONS]
+    pivots = _statement_pivots(stock_id, conn, quarterly_types)
+    if pivots is None:
+        return None, None, None
+    return tuple(pivots[t] for t in quarterly_types)
+
+def compute_ttm_ratios(stock_id, conn, quarterly=None):
+    """以最近四季滾動加總 (損益、現金流) 搭配最新一季資產負債表計算 TTM 比率，只輸出最新一期"""
+    income, balance, cash = quarterly or get_quarterly_dataframes_from_db(stock_id, conn)
+    if income is None or income.empty or balance.empty:
+        return []
+
+    def stacked(df):
+        if df is None or df.empty:
+            return None
+        return pd.concat({stock_id: df}, names=['Stock_Id'])
+
+    return ttm_ratio_rows(stacked(income), stacked(balance), stacked(cash))
+
+def ttm_ratio_rows(income, balance, cash):
+    """
+    季報寬表的 index 為 (Stock_Id, ReportDate)，依股票、日期排序；可一次放入多檔股票。
+    全部以整欄向量運算完成，跨股票的滾動 / 落後值會被遮掉。回傳每檔最新一期的 TTM 比率列。
+    """
+    stocks = income.index.get_level_values(0)
+    dates = income.index.get_level_values(1).to_series(index=income.index)
+
+    def same_stock(n):
+        return pd.Series(stocks == pd.Series(stocks).shift(n).to_numpy(), index=income.index)
+
+    # 只有同一檔股票連續四季 (跨度約 9 個月) 才是有效的 TTM
+    consecutive = (dates - dates.shift(3)).dt.days.between(250, 300) & same_stock(3)
+    flows = income.rolling(4).sum().where(consecutive, axis=0)
+    if cash is not None and not cash.empty:
+        cash_flows = cash.reindex(income.index).rolling(4).sum().where(consecutive, axis=0)
+        flows = flows.join(cash_flows, how='left', rsuffix='_cf')
+    stock_bal = balance.reindex(income.index)
+    prev_same = same_stock(4)
+
+    def col(df, item):
+        return df[item] if item in df.columns else pd.Series(np.nan, index=df.index)
+
+    def div(num, den):
+        return num / den.where(den != 0)
+
+    def yoy(series):
+        prev = series.shift(4).where(prev_same)
+        return (series - prev) / prev.abs().where(prev != 0)
+
+    rev, ni = col(flows, 'Total Revenue'), col(flows, 'Net Income')
+    op_income, fcf = col(flows, 'Operating Income'), col(flows, 'Free Cash Flow')
+    equity = col(stock_bal, 'Total Equity Gross Minority Interest')
+
+    series = [
+        ('Profitability', 'Return on Equity (ROE)', div(ni, equity), 'TTM Net Income / Equity'),
+        ('Profitability', 'Gross Margin', div(col(flows, 'Gross Profit'), rev), 'TTM Gross Profit / TTM Revenue'),
+        ('Profitability', 'Operating Margin', div(op_income, rev), 'TTM Operating Income / TTM Revenue'),
+        ('Profitability', 'Net Profit Margin', div(ni, rev), 'TTM Net Income / TTM Revenue'),
+        ('Growth', 'Revenue Growth', yoy(rev), 'TTM YoY'),
+        ('Growth', 'Net Income Growth', yoy(ni), 'TTM YoY'),
+        ('Growth', 'FCF Growth', yoy(fcf), 'TTM YoY'),
+        ('Leverage', 'Debt-to-Equity Ratio', div(col(stock_bal, 'Total Debt'), equity), 'Total Debt / Equity'),
+        ('Leverage', 'Current Ratio', div(col(stock_bal, 'Current Assets'), col(stock_bal, 'Current Liabilities')), 'CA / CL'),
+        ('Leverage', 'Interest Coverage Ratio', div(op_income, col(flows, 'Interest Expense')), 'TTM EBIT / TTM Interest'),
+        ('Leverage', 'Net Debt / EBITDA', div(col(stock_bal, 'Net Debt'), col(flows, 'EBITDA')), 'Net Debt / TTM EBITDA'),
+        ('Efficiency', 'Asset Turnover', div(rev, col(stock_bal, 'Total Assets')), 'TTM Revenue / Total Assets'),
+        ('Efficiency', 'Inventory Turnover', div(col(flows, 'Cost Of Revenue'), col(stock_bal, 'Inventory')), 'TTM COGS / Inventory'),
+        ('Efficiency', 'Receivables Turnover', div(rev, col(stock_bal, 'Accounts Receivable')), 'TTM Revenue / AR'),
+        ('Return', 'ROIC', div(op_income * 0.75, col(stock_bal, 'Invested Capital')), 'TTM NOPAT / Invested Capital'),
+    ]
+
+    # 每檔股票營收有值的最後一期
+    valid = rev.dropna()
+    latest = valid.index[~valid.index.get_level_values(0).duplicated(keep='last')]
+    if latest.empty:
+        return []
+    ratios = []
+    for category, name, values, formula in series:
+        for (stock_id, date), val in zip(latest, values.reindex(latest).to_numpy()):
+            if np.isfinite(val):
+                ratios.append((stock_id, date.year, 'TTM', f'{name} (TTM)', float(val), f'{formula} [{category}, to {date:%Y-%m-%d}]'))
+    return ratios
+
+# 年度比率定義 (common.ratio_engine 以整欄陣列一次計算所有年度)
+ANNUAL_RATIOS = [
+    Ratio('Profitability', 'Return on Equity (ROE)', ('income', 'Net Income'), ('balance', 'Total Equity Gross Minority Interest'), 'Net Income / Equity'),
+    Ratio('Profitability', 'Gross Margin', ('income', 'Gross Profit'), ('income', 'Total Revenue'), 'Gross Profit / Revenue'),
+    Ratio('Profitability', 'Operating Margin', ('income', 'Operating Income'), ('income', 'Total Revenue'), 'Operating Income / Revenue'),
+    Ratio('Profitability', 'Net Profit Margin', ('income', 'Net Income'), ('income', 'Total Revenue'), 'Net Income / Revenue'),
+    yoy('Growth', 'Revenue Growth', ('income', 'Total Revenue')),
+    yoy('Growth', 'Net Income Growth', ('income', 'Net Income')),
+    yoy('Growth', 'EPS Growth', ('income', 'Basic EPS')),
+    yoy('Growth', 'FCF Growth', ('cash', 'Free Cash Flow')),
+    Ratio('Leverage', 'Debt-to-Equity Ratio', ('balance', 'Total Debt'), ('balance', 'Total Equity Gross Minority Interest'), 'Total Debt / Equity'),
+    Ratio('Leverage', 'Current Ratio', ('balance', 'Current Assets'), ('balance', 'Current Liabilities'), 'CA / CL'),
+    Ratio('Leverage', 'Interest Coverage Ratio', ('income', 'Operating Income'), ('income', 'Interest Expense'), 'EBIT / Interest'),
+    Ratio('Leverage', 'Net Debt / EBITDA', ('balance', 'Net Debt'), ('income', 'EBITDA'), 'Net Debt / EBITDA'),
+    Ratio('Efficiency', 'Asset Turnover', ('income', 'Total Revenue'), ('balance', 'Total Assets'), 'Revenue / Total Assets'),
+    Ratio('Efficiency', 'Inventory Turnover', ('income', 'Cost Of Revenue'), ('balance', 'Inventory'), 'COGS / Inventory'),
+    Ratio('Efficiency', 'Receivables Turnover', ('income', 'Total Revenue'), ('balance', 'Accounts Receivable'), 'Revenue / AR'),
+    Ratio('Return', 'ROIC', ('income', 'Operating Income'), ('balance', 'Invested Capital'), 'NOPAT / Invested Capital', scale=0.75),
+]
+
+def compute_financial_ratios(stock_id, conn, periods=None, annual=None, quarterly=None):
+    """
+    只計算不寫入，回傳 FinancialRatios 的列 (tuple list)；年度比率定義見 ANNUAL_RATIOS。
+    periods: 只計算這些期間 (年度 int 或 'TTM')，None 為全部；annual / quarterly 為已讀出的寬表。
+    """
     print(f"🧮 [Backend 2] 計算 {stock_id} 財務比率 (DB Mode)...")
     
-    income, balance, cash = get_dataframes_from_db(stock_id, conn)
+    income, balance, cash = annual or get_dataframes_from_db(stock_id, conn)
     if income is None or balance is None: 
-        return False
+        return []
 
-    ratios = []
-    years = income.index
-    
-    df_info = pd.read_sql("SELECT DataKey, DataValue FROM CompanyInfo WHERE Stock_Id = ?", conn, params=(stock_id,))
-    info_dict = dict(zip(df_info['DataKey'], df_info['DataValue']))
-    current_price = safe_float(info_dict.get('currentPrice', 0))
-
-    for year in years:
-        try:
-            def get_val(df, item):
-                if df is not None and item in df.columns and year in df.index:
-                    return safe_float(df.loc[year, item])
-                return 0.0
-            
-            rev = get_val(income, 'Total Revenue')
-            net_income = get_val(income, 'Net Income')
-            gross_profit = get_val(income, 'Gross Profit')
-            op_income = get_val(income, 'Operating Income')
-            cost_of_rev = get_val(income, 'Cost Of Revenue')
-            interest = get_val(income, 'Interest Expense')
-            ebitda = get_val(income, 'EBITDA')
-            eps = get_val(income, 'Basic EPS')
-            
-            equity = get_val(balance, 'Total Equity Gross Minority Interest')
-            total_assets = get_val(balance, 'Total Assets')
-            total_debt = get_val(balance, 'Total Debt')
-            net_debt = get_val(balance, 'Net Debt')
-            inventory = get_val(balance, 'Inventory')
-            receivables = get_val(balance, 'Accounts Receivable')
-            curr_assets = get_val(balance, 'Current Assets')
-            curr_liab = get_val(balance, 'Current Liabilities')
-            inv_cap = get_val(balance, 'Invested Capital')
-            
-            fcf = get_val(cash, 'Free Cash Flow')
-
-            if equity: ratios.append((stock_id, year, 'Profitability', 'Return on Equity (ROE)', net_income / equity, 'Net Income / Equity'))
-            if rev:
-                ratios.append((stock_id, year, 'Profitability', 'Gross Margin', gross_profit / rev, 'Gross Profit / Revenue'))
-                ratios.append((stock_id, year, 'Profitability', 'Operating Margin', op_income / rev, 'Operating Income / Revenue'))
-                ratios.append((stock_id, year, 'Profitability', 'Net Profit Margin', net_income / rev, 'Net Income / Revenue'))
-
-            prev_year = year - 1
-            if prev_year in years:
-                prev_rev = get_val(income, 'Total Revenue')
-                prev_ni = get_val(income, 'Net Income')
-                prev_eps = get_val(income, 'Basic EPS')
-                prev_fcf = get_val(cash, 'Free Cash Flow')
-
-                if prev_rev: ratios.append((stock_id, year, 'Growth', 'Revenue Growth', (rev - prev_rev)/abs(prev_rev), 'YoY'))
-                if prev_ni: ratios.append((stock_id, year, 'Growth', 'Net Income Growth', (net_income - prev_ni)/abs(prev_ni), 'YoY'))
-                if prev_eps: ratios.append((stock_id, year, 'Growth', 'EPS Growth', (eps - prev_eps)/abs(prev_eps), 'YoY'))
-                if prev_fcf: ratios.append((stock_id, year, 'Growth', 'FCF Growth', (fcf - prev_fcf)/abs(prev_fcf), 'YoY'))
-
-            if equity: ratios.append((stock_id, year, 'Leverage', 'Debt-to-Equity Ratio', total_debt / equity, 'Total Debt / Equity'))
-            if curr_liab: ratios.append((stock_id, year, 'Leverage', 'Current Ratio', curr_assets / curr_liab, 'CA / CL'))
-            if interest: ratios.append((stock_id, year, 'Leverage', 'Interest Coverage Ratio', op_income / interest, 'EBIT / Interest'))
-            if ebitda: ratios.append((stock_id, year, 'Leverage', 'Net Debt / EBITDA', net_debt / ebitda, 'Net Debt / EBITDA'))
-
-            if total_assets: ratios.append((stock_id, year, 'Efficiency', 'Asset Turnover', rev / total_assets, 'Revenue / Total Assets'))
-            if inventory: ratios.append((stock_id, year, 'Efficiency', 'Inventory Turnover', cost_of_rev / inventory, 'COGS / Inventory'))
-            if receivables: ratios.append((stock_id, year, 'Efficiency', 'Receivables Turnover', rev / receivables, 'Revenue / AR'))
-            
-            if inv_cap:
-                nopat = op_income * 0.75 
-                ratios.append((stock_id, year, 'Return', 'ROIC', nopat / inv_cap, 'NOPAT / Invested Capital'))
-
-        except Exception as e:
-            print(f"計算 {year} 錯誤: {e}")
-            continue
+    # 所有年度一次向量化計算 (缺少的科目視為 NaN，算不出來的比率不輸出)
+    years = income.index if periods is None else income.index[income.index.isin(list(periods))]
+    ratios = evaluate_ratios(stock_id, {'income': income, 'balance': balance, 'cash': cash}, years, ANNUAL_RATIOS)
 
-    if ratios:
-        cursor = conn.cursor()
-        cursor.executemany('INSERT OR REPLACE INTO FinancialRatios (Stock_Id, ReportYear, Category, RatioName, RatioValue, Formula) VALUES (?, ?, ?, ?, ?, ?)', ratios)
-        conn.commit()
-        return True
-    
-    return False
+    # 季報 TTM 比率與年度比率寫在同一張表
+    if periods is None or TTM_PERIOD in periods:
+        ratios.extend(compute_ttm_ratios(stock_id, conn, quarterly))
+    return ratios
+
+TTM_PERIOD = 'TTM'
+RATIO_INPUT_UPSERT = "INSERT OR REPLACE INTO RatioInputs (Stock_Id, Period, InputHash, UpdatedAt) VALUES (?, ?, ?, CURRENT_TIMESTAMP)"
+# 比率定義或計算規則改變時所有指紋一起失效
+_RATIO_DEFINITION = hashlib.blake2b(repr((RULES_VERSION, ANNUAL_RATIOS)).encode(), digest_size=8).digest()
+
+def _hash_rows(h, df, rows=None):
+    """把寬表的欄位、index 與 rows (年度，None 為全部) 的數值寫進 hash"""
+    if df is None or df.empty:
+        h.update(b"-")
+        return
+    mask = slice(None) if rows is None else df.index.isin(rows)
+    h.update("\x1f".join(map(str, df.columns)).encode())
+    h.update(",".join(map(str, df.index[mask])).encode())
+    h.update(np.ascontiguousarray(df.to_numpy(dtype=np.float64)[mask]).tobytes())
+
+def ratio_input_fingerprints(annual, quarterly):
+    """
+    各期間比率輸入的指紋 {期間: hash}。年度 Y 涵蓋三張年報 Y 與 Y-1 兩年的所有科目 (成長率需要前一年)；
+    TTM 涵蓋全部季報。比率只由財報計算 (沒有使用股價)，因此財報沒變就不必重算。
+    """
+    income, balance, cash = annual
+    fingerprints = {}
+    if income is None or balance is None or income.empty:
+        return fingerprints
+    for year in income.index.unique():
+        h = hashlib.blake2b(_RATIO_DEFINITION, digest_size=16)
+        for df in (income, balance, cash):
+            _hash_rows(h, df, [year, year - 1])
+        fingerprints[int(year)] = h.hexdigest()
+
+    if quarterly[0] is not None and not quarterly[0].empty:
+        h = hashlib.blake2b(_RATIO_DEFINITION + b"ttm", digest_size=16)
+        for df in quarterly:
+            _hash_rows(h, df)
+        fingerprints[TTM_PERIOD] = h.hexdigest()
+    return fingerprints
+
+def stored_ratio_fingerprints(stock_id, conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT Period, InputHash FROM RatioInputs WHERE Stock_Id = ?", (stock_id,))
+    return {(p if p == TTM_PERIOD else int(p)): h for p, h in cursor.fetchall()}
+
+def ratio_fingerprint_rows(stock_id, fingerprints):
+    return [(stock_id, str(p), h) for p, h in fingerprints.items()] or None
+
+def ratio_update_statements(stock_id, conn, refresh_peers=True):
+    """
+    只重算輸入指紋改變的年度 / TTM，回傳 (寫入語句, 是否有比率)；全部沒變時寫入語句為空。
+    指紋與比率同一批寫入：比率沒寫進去時下次會重算。
+    refresh_peers=False 時不重算同業統計 (整批匯入最後以 rebuild_peers 一次重建)。
+    """
+    annual = get_dataframes_from_db(stock_id, conn)
+    quarterly = get_quarterly_dataframes_from_db(stock_id, conn)
+    current = ratio_input_fingerprints(annual, quarterly)
+    if not current:
+        return [], False
+    stored = stored_ratio_fingerprints(stock_id, conn)
+    changed = {p: h for p, h in current.items() if stored.get(p) != h}
+    if not changed:
+        print(f"✅ {stock_id} 財報未變動，沿用既有比率")
+        return [], True
+
+    ratios = compute_financial_ratios(stock_id, conn, set(changed), annual, quarterly)
+    statements = [
+        (YEAR_RATIO_DELETE, [(stock_id, p) for p in changed if p != TTM_PERIOD] or None),
+        *([(TTM_RATIO_DELETE, [(stock_id,)])] if TTM_PERIOD in changed else []),
+        (RATIO_UPSERT, ratios or None),
+        (RATIO_INPUT_UPSERT, ratio_fingerprint_rows(stock_id, changed)),
+        *(latest_ratio_statements(stock_id) if ratios else []),
+        # LatestRatios 更新後，同一交易內重算該股票所在 sector / industry 的同業統計
+        *([peer_statement(stock_id)] if ratios and refresh_peers else []),
+    ]
+    return statements, bool(ratios or stored)
+
+def calculate_financial_ratios(stock_id, conn):
+    statements, has_ratios = ratio_update_statements(stock_id, conn)
+    if statements:
+        db_writer.write(statements)
+    return has_ratios
 
 def search_symbol_alpha_vantage(keyword: str):
     print(f"🔍 [Backend 2] Search: {keyword}")
     api_key = settings.ALPHA_VANTAGE_API_KEY
     if not api_key: return []
     try:
-        url = f"https://www.alphavantage.co/query?function=SYMBOL_SEARCH&keywords={keyword}&apikey={api_key}"
-        res = requests.get(url).json()
+        res = fetch_alpha_vantage("SYMBOL_SEARCH", PRIORITY_SEARCH, keywords=keyword)
         raw = res.get("bestMatches", [])
         return [{
             "symbol": i.get("1. symbol"),
@@ -253,24 +628,26 @@ def search_symbol_alpha_vantage(keyword: str):
 
 
 def get_competitor_dataframe_markdown(ticker_list, conn):
+    """每檔股票在同 industry / sector 中各比率的百分位與四分位數 (PeerRanks / PeerStats，預先計算)"""
     if not ticker_list:
         return "無競爭對手數據"
     
-    placeholders = ','.join(['?']*len(ticker_list))
-    query = f"""
-    SELECT Stock_Id, RatioName, RatioValue
-    FROM FinancialRatios
-    WHERE Stock_Id IN ({placeholders})
-      AND ReportYear = (SELECT MAX(ReportYear) FROM FinancialRatios)
-      AND RatioName IN ('Return on Equity (ROE)', 'Gross Margin', 'Net Profit Margin', 'Debt-to-Equity Ratio')
-    """
-    
+    sections = []
     try:
-        df = pd.read_sql(query, conn, params=ticker_list)
-        if df.empty:
+        for ticker in ticker_list:
+            rows = get_peer_context(ticker, conn)
+            if not rows:
+                continue
+            for (group_type, group_name), group_rows in groupby(rows, key=lambda r: (r['GroupType'], r['GroupName'])):
+                group_rows = list(group_rows)
+                table = pd.DataFrame(group_rows)[['RatioName', 'ReportYear', 'RatioValue', 'PercentRank', 'P25', 'Median', 'P75', 'Peers']]
+                sections.append(
+                    f"{ticker} vs {group_type.capitalize()} peers ({group_name}, up to {table['Peers'].max()} companies):\n"
+                    + table.to_markdown(index=False, floatfmt=".4f")
+                )
+        if not sections:
             return "資料庫中暫無競爭對手數據"
-        pivot = df.pivot_table(index='Stock_Id', columns='RatioName', values='RatioValue')
-        return pivot.to_markdown()
+        return "\n\n".join(sections)
     except Exception as e:
         return f"無法產生比較表: {e}"
 
@@ -282,15 +659,12 @@ def get_context_str(stock_id, conn):
     彙整公司基本資料與最近 5 年的財務指標，轉成文字給 LLM 閱讀。
     """
     # 1. 讀取 Info
-    cursor = conn.cursor()
-    cursor.execute("SELECT DataKey, DataValue FROM CompanyInfo WHERE Stock_Id = ?", (stock_id,))
-    info = {row[0]: row[1] for row in cursor.fetchall()}
+    info = get_company_info(stock_id, conn)
     
-    # 2. 讀取 Ratios
-    query = "SELECT ReportYear, Category, RatioName, RatioValue FROM FinancialRatios WHERE Stock_Id = ? ORDER BY ReportYear DESC, Category"
-    df = pd.read_sql(query, conn, params=(stock_id,))
+    # 2. 讀取 Ratios (依年度新到舊、類別排序)
+    rows = read_ratio_rows(stock_id, conn)
     
-    if df.empty:
+    if not rows:
         return f"No financial data available for {stock_id}."
         
     # 3. 組裝文字
@@ -302,16 +676,13 @@ def get_context_str(stock_id, conn):
     
     res.append("\n=== Key Financial Ratios (Historical) ===")
     
-    years = sorted(df['ReportYear'].unique(), reverse=True)
-    for year in years:
+    for year, year_rows in groupby(rows, key=lambda r: r['ReportYear']):
         res.append(f"\n[Year {year}]")
-        year_data = df[df['ReportYear'] == year]
         
         # 依類別分群顯示
-        for cat in year_data['Category'].unique():
+        for cat, cat_rows in groupby(year_rows, key=lambda r: r['Category']):
             res.append(f"  * {cat}:")
-            cat_data = year_data[year_data['Category'] == cat]
-            for _, row in cat_data.iterrows():
+            for row in cat_rows:
                 res.append(f"    - {row['RatioName']}: {row['RatioValue']:.4f}")
                 
     return "\n".join(res)
\ No newline at end of file
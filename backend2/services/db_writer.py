@@ -0,0 +1,116 @@
+#單一寫入執行緒：所有寫入排進佇列，合併成較大的交易後一次 commit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from database import get_db_connection
+from common.db_backend import Stats
+from config import settings
+
+
+class WriteBatch:
+    """
+    一組要在同一個交易內完成的寫入。
+    statements: [(sql, params)]，params 為 list 時視為 executemany 的多筆參數；
+    sql 也可以是 database.BulkUpsert (大量寫入，Postgres 走 COPY)。
+    """
+    def __init__(self, statements):
+        self.statements = [(sql, params) for sql, params in statements if params is not None]
+        self.future = Future()
+
+
+class SQLiteWriter:
+    def __init__(self, max_batches, linger_ms):
+        self.max_batches = max_batches
+        self.linger = linger_ms / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        # 寫入執行緒更新、/api/db_stats 由請求執行緒讀取
+        self._stats = Stats(batches=0, transactions=0, statements=0, failed_batches=0)
+
+    def _ensure_started(self):
+        # fork 出來的 worker 程序沒有父程序的執行緒，需要自己啟動
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, statements):
+        """排入寫入並立即回傳 Future (完成時 result() 為 None，失敗時拋出原例外)"""
+        batch = WriteBatch(statements)
+        if not batch.statements:
+            batch.future.set_result(None)
+            return batch.future
+        self._ensure_started()
+        self._queue.put(batch)
+        return batch.future
+
+    def write(self, statements, timeout=None):
+        """排入寫入並等到 commit 完成 (預設最多等 DB_WRITER_TIMEOUT 秒)"""
+        return self.submit(statements).result(settings.DB_WRITER_TIMEOUT if timeout is None else timeout)
+
+    def _collect(self):
+        batches = [self._queue.get()]
+        deadline = time.monotonic() + self.linger
+        while len(batches) < self.max_batches:
+            remaining = deadline - time.monotonic()
+            try:
+                batches.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batches
+
+    def _run(self):
+        conn = get_db_connection()
+        while True:
+            batches = self._collect()
+            done = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for batch in batches:
+                    # 每個 batch 各自一個 savepoint，單一 batch 失敗不影響同一交易中的其他 batch
+                    conn.execute("SAVEPOINT batch")
+                    try:
+                        for sql, params in batch.statements:
+                            if callable(sql):
+                                sql(conn, params)
+                            elif isinstance(params, list):
+                                conn.executemany(sql, params)
+                            else:
+                                conn.execute(sql, params)
+                        conn.execute("RELEASE batch")
+                        done.append(batch)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO batch")
+                        conn.execute("RELEASE batch")
+                        batch.future.set_exception(e)
+                        self._stats.count(failed_batches=1)
+                conn.commit()
+            except Exception as e:
+                # BEGIN / commit 失敗 (例如其他程序持有寫入鎖超過 busy timeout)：本輪所有尚未完成的 batch 都要通知呼叫者
+                if conn.in_transaction:
+                    conn.rollback()
+                failed = [batch for batch in batches if not batch.future.done()]
+                for batch in failed:
+                    batch.future.set_exception(e)
+                self._stats.count(failed_batches=len(failed))
+                continue
+
+            for batch in done:
+                batch.future.set_result(None)
+            self._stats.count(batches=len(batches), transactions=1, statements=sum(len(b.statements) for b in batches))
+
+    def stats(self):
+        stats = self._stats.snapshot()
+        stats["queued"] = self._queue.qsize()
+        stats["batches_per_transaction"] = round(stats["batches"] / stats["transactions"], 2) if stats["transactions"] else 0.0
+        return stats
+
+
+db_writer = SQLiteWriter(settings.DB_WRITER_MAX_BATCHES, settings.DB_WRITER_LINGER_MS)
@@ -0,0 +1,131 @@
+#背景工作佇列 (SQLite Jobs 表)
+import asyncio
+import json
+import uuid
+from database import get_db_connection
+from config import settings
+from services.data_service import analyze_ticker
+from services.ai_service import generate_and_store_ai_report, run_technical_agent
+
+JOB_KINDS = ("analyze", "analyze_ai", "analyze_technical")
+
+
+def submit_job(kind, payload):
+    """建立工作並立即回傳 job id"""
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job_id = uuid.uuid4().hex
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            "INSERT INTO Jobs (Id, Kind, Payload, Status) VALUES (?, ?, ?, 'queued')",
+            (job_id, kind, json.dumps(payload)),
+        )
+        conn.commit()
+        return job_id
+    finally:
+        conn.close()
+
+
+def get_job(job_id):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT Id, Kind, Payload, Status, Result, Error, Attempts, CreatedAt, StartedAt, FinishedAt
+            FROM Jobs WHERE Id = ?
+        ''', (job_id,))
+        row = cursor.fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    return {
+        "id": row[0],
+        "kind": row[1],
+        "payload": json.loads(row[2]) if row[2] else {},
+        "status": row[3],
+        "result": json.loads(row[4]) if row[4] else None,
+        "error": row[5],
+        "attempts": row[6],
+        "created_at": row[7],
+        "started_at": row[8],
+        "finished_at": row[9],
+    }
+
+
+def claim_job(conn, worker_id):
+    """
+    以 BEGIN IMMEDIATE 取得寫入鎖後認領最舊的排隊工作，
+    多個 worker 程序同時呼叫也只會有一個拿到同一筆。
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT Id, Kind, Payload FROM Jobs WHERE Status = 'queued' ORDER BY CreatedAt, rowid LIMIT 1")
+        row = cursor.fetchone()
+        if row:
+            # 條件式更新：Postgres 下 BEGIN IMMEDIATE 不會鎖表，以 Status 判斷是否已被別的 worker 搶走
+            cursor.execute('''
+                UPDATE Jobs
+                SET Status = 'running', WorkerId = ?, Attempts = Attempts + 1,
+                    StartedAt = CURRENT_TIMESTAMP, HeartbeatAt = CURRENT_TIMESTAMP
+                WHERE Id = ? AND Status = 'queued'
+            ''', (worker_id, row[0]))
+            if cursor.rowcount != 1:
+                row = None
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if not row:
+        return None
+    return {"id": row[0], "kind": row[1], "payload": json.loads(row[2]) if row[2] else {}}
+
+
+def heartbeat(conn, job_id, worker_id):
+    conn.execute("UPDATE Jobs SET HeartbeatAt = CURRENT_TIMESTAMP WHERE Id = ? AND WorkerId = ?", (job_id, worker_id))
+    conn.commit()
+
+
+def finish_job(conn, job_id, worker_id, result=None, error=None):
+    conn.execute('''
+        UPDATE Jobs
+        SET Status = ?, Result = ?, Error = ?, FinishedAt = CURRENT_TIMESTAMP
+        WHERE Id = ? AND WorkerId = ?
+    ''', ("failed" if error else "done", json.dumps(result) if result is not None else None, error, job_id, worker_id))
+    conn.commit()
+
+
+def requeue_stale_jobs(conn):
+    """心跳逾時的工作 (worker 當掉) 重新排隊；超過重試上限則標記失敗"""
+    stale = f"-{settings.JOB_STALE_SECONDS} seconds"
+    conn.execute('''
+        UPDATE Jobs SET Status = 'failed', Error = 'Worker lost (max attempts reached)', FinishedAt = CURRENT_TIMESTAMP
+        WHERE Status = 'running' AND HeartbeatAt < datetime('now', ?) AND Attempts >= ?
+    ''', (stale, settings.JOB_MAX_ATTEMPTS))
+    cursor = conn.execute('''
+        UPDATE Jobs SET Status = 'queued', WorkerId = NULL
+        WHERE Status = 'running' AND HeartbeatAt < datetime('now', ?)
+    ''', (stale,))
+    conn.commit()
+    return cursor.rowcount
+
+
+def run_job(kind, payload):
+    """依工作類型呼叫對應的服務函式，回傳可 JSON 序列化的結果"""
+    ticker = payload["ticker"].upper()
+    if kind == "analyze":
+        data_list = analyze_ticker(ticker, force_refresh=payload.get("force_refresh", False))
+        if data_list is None:
+            raise RuntimeError("Download failed")
+        return {"status": "success", "data": data_list}
+    if kind == "analyze_ai":
+        result = generate_and_store_ai_report(ticker)
+        if result.get("status") != "success":
+            raise RuntimeError(result.get("message", "AI analysis failed"))
+        return result
+    if kind == "analyze_technical":
+        report = asyncio.run(run_technical_agent(ticker))
+        return {"status": "success", "report": report}
+    raise ValueError(f"Unknown job kind: {kind}")
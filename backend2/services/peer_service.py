@@ -0,0 +1,135 @@
+#同業比較：依 CompanyInfoLatest 的 sector / industry 分組，預先存好每個比率的四分位數 (PeerStats) 與各股票的百分位排名 (PeerRanks)；
+#比率改變時只重算該股票所在的組別，查詢同業位置只需一次主鍵查詢
+import datetime as dt
+import pandas as pd
+from services.screen_service import SCREEN_FIELDS
+
+GROUP_TYPES = ('industry', 'sector')
+
+PEER_STATS_INSERT = '''
+    INSERT OR REPLACE INTO PeerStats (GroupType, GroupName, RatioName, Peers, P25, Median, P75, UpdatedAt)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+PEER_RANK_INSERT = '''
+    INSERT OR REPLACE INTO PeerRanks (Stock_Id, GroupType, GroupName, RatioName, ReportYear, RatioValue, PercentRank)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+_columns = ", ".join(f"l.{c}" for c in SCREEN_FIELDS.values())
+
+
+def _in(values):
+    return ", ".join("?" for _ in values)
+
+
+def peer_groups(conn, stock_ids):
+    """股票目前所在的組別，加上 PeerRanks 中記錄的舊組別 (換產業時舊組別也要重算)"""
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT DISTINCT DataKey, DataValue FROM CompanyInfoLatest WHERE Stock_Id IN ({_in(stock_ids)}) AND DataKey IN ({_in(GROUP_TYPES)})",
+        (*stock_ids, *GROUP_TYPES),
+    )
+    groups = {(k, v) for k, v in cursor.fetchall() if v and v != 'None'}
+    cursor.execute(f"SELECT DISTINCT GroupType, GroupName FROM PeerRanks WHERE Stock_Id IN ({_in(stock_ids)})", tuple(stock_ids))
+    groups.update(cursor.fetchall())
+    return sorted(groups)
+
+
+def refresh_peer_groups(conn, groups):
+    """重算組別 [(GroupType, GroupName)] 的統計與排名 (在呼叫者的交易內，不 commit)"""
+    cursor = conn.cursor()
+    now = dt.datetime.now().isoformat(timespec="seconds")
+    for group_type, group_name in groups:
+        cursor.execute(f'''
+            SELECT l.Stock_Id, l.ReportYear, {_columns}
+            FROM CompanyInfoLatest c JOIN LatestRatios l ON l.Stock_Id = c.Stock_Id
+            WHERE c.DataKey = ? AND c.DataValue = ?
+        ''', (group_type, group_name))
+        members = pd.DataFrame(cursor.fetchall(), columns=["Stock_Id", "ReportYear", *SCREEN_FIELDS])
+        cursor.execute("DELETE FROM PeerStats WHERE GroupType = ? AND GroupName = ?", (group_type, group_name))
+        cursor.execute("DELETE FROM PeerRanks WHERE GroupType = ? AND GroupName = ?", (group_type, group_name))
+
+        stats, ranks = [], []
+        for name in SCREEN_FIELDS:
+            values = pd.to_numeric(members[name], errors="coerce")
+            valid = members[values.notna()]
+            values = values[values.notna()]
+            if values.empty:
+                continue
+            p25, median, p75 = values.quantile([0.25, 0.5, 0.75])
+            stats.append((group_type, group_name, name, len(values), float(p25), float(median), float(p75), now))
+            # 百分位排名 (0~1]，同值取平均名次
+            pct = values.rank(pct=True)
+            ranks.extend(
+                (stock_id, group_type, group_name, name, int(year), float(value), float(rank))
+                for stock_id, year, value, rank in zip(valid["Stock_Id"], valid["ReportYear"], values, pct)
+            )
+        if stats:
+            cursor.executemany(PEER_STATS_INSERT, stats)
+            cursor.executemany(PEER_RANK_INSERT, ranks)
+    return len(groups)
+
+
+def refresh_peers(conn, stock_ids):
+    """
+    db_writer 批次用：(refresh_peers, [Stock_Id, ...])，放在 LatestRatios 的寫入之後，
+    於同一個交易內重算這些股票所在的組別。
+    """
+    groups = peer_groups(conn, stock_ids)
+    return refresh_peer_groups(conn, groups)
+
+
+def refresh_moved_peers(conn, stock_ids):
+    """
+    db_writer 批次用：(refresh_moved_peers, [Stock_Id, ...])，放在 CompanyInfoLatest 的寫入之後。
+    sector / industry 與 PeerRanks 記錄的組別不同的股票 (換了產業) 重算新舊組別；還沒有比率的股票不在任何組別中，略過。
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT Stock_Id FROM LatestRatios WHERE Stock_Id IN ({_in(stock_ids)})", tuple(stock_ids))
+    moved = []
+    for (stock_id,) in cursor.fetchall():
+        cursor.execute(
+            f"SELECT DataKey, DataValue FROM CompanyInfoLatest WHERE Stock_Id = ? AND DataKey IN ({_in(GROUP_TYPES)})",
+            (stock_id, *GROUP_TYPES),
+        )
+        current = {(k, v) for k, v in cursor.fetchall() if v and v != 'None'}
+        cursor.execute("SELECT DISTINCT GroupType, GroupName FROM PeerRanks WHERE Stock_Id = ?", (stock_id,))
+        if current != set(cursor.fetchall()):
+            moved.append(stock_id)
+    return refresh_peers(conn, moved) if moved else 0
+
+
+def rebuild_peers(conn, _=None):
+    """重建所有組別 (整批重算比率後，或舊資料庫啟動時補建)"""
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM PeerRanks")
+    cursor.execute("DELETE FROM PeerStats")
+    cursor.execute(
+        f"SELECT DISTINCT DataKey, DataValue FROM CompanyInfoLatest WHERE DataKey IN ({_in(GROUP_TYPES)})", GROUP_TYPES
+    )
+    groups = [(k, v) for k, v in cursor.fetchall() if v and v != 'None']
+    return refresh_peer_groups(conn, groups)
+
+
+def peer_statement(stock_id):
+    return (refresh_peers, [stock_id])
+
+
+def get_peer_context(stock_id, conn):
+    """
+    股票在各組別中每個比率的位置，回傳 [{GroupType, GroupName, RatioName, ReportYear, RatioValue, PercentRank, Peers, P25, Median, P75}]。
+    PeerRanks 以 Stock_Id 開頭的主鍵查詢，PeerStats 以主鍵合併。
+    """
+    query = '''
+        SELECT r.GroupType, r.GroupName, r.RatioName, r.ReportYear, r.RatioValue, r.PercentRank,
+               s.Peers, s.P25, s.Median, s.P75
+        FROM PeerRanks r
+        JOIN PeerStats s ON s.GroupType = r.GroupType AND s.GroupName = r.GroupName AND s.RatioName = r.RatioName
+        WHERE r.Stock_Id = ?
+    '''
+    cursor = conn.cursor()
+    cursor.execute(query, (stock_id,))
+    rows = cursor.fetchall()
+    columns = ["GroupType", "GroupName", "RatioName", "ReportYear", "RatioValue", "PercentRank", "Peers", "P25", "Median", "P75"]
+    order = {name: i for i, name in enumerate(SCREEN_FIELDS)}
+    result = [dict(zip(columns, row)) for row in rows]
+    return sorted(result, key=lambda r: (GROUP_TYPES.index(r["GroupType"]), order.get(r["RatioName"], len(order))))
@@ -0,0 +1,225 @@
+#日K欄式封存檔 (由 DailyPrices 衍生)：每個欄位一個連續陣列，近年以 mmap 零拷貝切片，舊年份壓縮成冷區段
+#目錄結構: <PRICE_ARCHIVE_DIR>/<TICKER>/
+#  meta.json                    目前版本、熱區起始日、已封存的冷年份
+#  .lock                        sync_archive 的跨程序寫入鎖 (flock)
+#  hot-<gen>-<field>.npy        近 PRICE_ARCHIVE_HOT_YEARS 年，未壓縮 (np.load mmap_mode='r')
+#  cold-<year>.npz              更早的年份，每年一個壓縮檔
+import datetime as dt
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows：沒有 flock，只在程序內互斥
+    fcntl = None
+
+# DataFrame 欄名 -> (DailyPrices 欄位, 檔名)
+FIELDS = {
+    "Open": ("Open", "open"),
+    "High": ("High", "high"),
+    "Low": ("Low", "low"),
+    "Close": ("Close", "close"),
+    "Adj Close": ("AdjClose", "adjclose"),
+    "Volume": ("Volume", "volume"),
+}
+
+_open_lock = threading.Lock()
+_open = OrderedDict()  # (ticker, gen) -> {"dates": memmap, field: memmap}
+_sync_locks = {}
+
+
+class PriceSlice:
+    """一段日期的價格：dates 為 datetime64[D]，columns 為各欄位的 (唯讀) 陣列，熱區內的切片不複製資料"""
+    def __init__(self, dates, columns):
+        self.dates = dates
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def index(self):
+        return pd.DatetimeIndex(self.dates.astype("datetime64[ns]"), name="Date")
+
+    def series(self, field):
+        return pd.Series(self.columns[field], index=self.index, name=field, copy=False)
+
+    def to_frame(self, fields=None):
+        fields = fields or list(FIELDS)
+        return pd.DataFrame({f: self.columns[f] for f in fields}, index=self.index)
+
+
+def _ticker_dir(ticker):
+    return os.path.join(settings.PRICE_ARCHIVE_DIR, ticker.upper())
+
+
+def read_meta(ticker):
+    try:
+        with open(os.path.join(_ticker_dir(ticker), "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def _ticker_lock(folder):
+    """同一檔股票同時只有一個 sync_archive (跨程序以 flock，同程序內以 threading.Lock)"""
+    with _open_lock:
+        local = _sync_locks.setdefault(folder, threading.Lock())
+    with local, open(os.path.join(folder, ".lock"), "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _atomic_save(path, write):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def _load_rows(conn, ticker, start=None, end=None):
+    query = "SELECT TradeDate, Open, High, Low, Close, AdjClose, Volume FROM DailyPrices WHERE Stock_Id = ?"
+    params = [ticker]
+    if start is not None:
+        query += " AND TradeDate >= ?"
+        params.append(str(start))
+    if end is not None:
+        query += " AND TradeDate < ?"
+        params.append(str(end))
+    df = pd.read_sql(query + " ORDER BY TradeDate", conn, params=params)
+    arrays = {"dates": pd.to_datetime(df["TradeDate"]).to_numpy().astype("datetime64[D]")}
+    for col, (db_col, name) in FIELDS.items():
+        arrays[name] = df[db_col].to_numpy(dtype=np.float64)
+    return arrays
+
+
+def sync_archive(ticker, conn, full=False):
+    """
+    由 DailyPrices 更新封存檔：熱區每次重寫 (只有近幾年，資料量小)，
+    冷年份只在尚未封存或 full=True (除權息重抓後 Adj Close 全部改變) 時寫入。
+    寫入、切換 meta.json 與清理都在該股票的寫入鎖內完成。
+    """
+    ticker = ticker.upper()
+    folder = _ticker_dir(ticker)
+    os.makedirs(folder, exist_ok=True)
+    with _ticker_lock(folder):
+        return _sync_locked(ticker, folder, conn, full)
+
+
+def _sync_locked(ticker, folder, conn, full):
+    previous = read_meta(ticker)
+    meta = (None if full else previous) or {"cold_years": []}
+    hot_start = dt.date(dt.date.today().year - settings.PRICE_ARCHIVE_HOT_YEARS + 1, 1, 1)
+
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT DISTINCT substr(TradeDate, 1, 4) FROM DailyPrices WHERE Stock_Id = ? AND TradeDate < ?",
+        (ticker, hot_start.isoformat()),
+    )
+    cold_years = sorted(int(r[0]) for r in cursor.fetchall())
+    for year in cold_years:
+        if year in meta["cold_years"]:
+            continue
+        arrays = _load_rows(conn, ticker, dt.date(year, 1, 1), dt.date(year + 1, 1, 1))
+        _atomic_save(os.path.join(folder, f"cold-{year}.npz"), lambda f: np.savez_compressed(f, **arrays))
+
+    gen = f"{time.time_ns():x}{os.getpid():x}"
+    hot = _load_rows(conn, ticker, hot_start)
+    for name, arr in hot.items():
+        _atomic_save(os.path.join(folder, f"hot-{gen}-{name}.npy"), lambda f: np.save(f, arr))
+
+    new_meta = {
+        "generation": gen,
+        "hot_start": hot_start.isoformat(),
+        "cold_years": cold_years,
+        "rows": int(len(hot["dates"])),
+        "updated_at": dt.datetime.now().isoformat(timespec="seconds"),
+    }
+    _atomic_save(os.path.join(folder, "meta.json"), lambda f: f.write(json.dumps(new_meta).encode("utf-8")))
+
+    # 刪除更舊的熱區版本 (已 mmap 的讀取者不受影響) 與已不存在的冷年份；
+    # 剛被取代的版本保留到下次同步，讓切換前讀到舊 meta.json 的讀取者仍能開啟
+    keep = {f"cold-{y}.npz" for y in cold_years}
+    live = {f"hot-{gen}-"} | ({f"hot-{previous['generation']}-"} if previous else set())
+    for fname in os.listdir(folder):
+        stale_hot = fname.startswith("hot-") and not any(fname.startswith(p) for p in live)
+        stale_cold = fname.startswith("cold-") and fname.endswith(".npz") and fname not in keep
+        if stale_hot or stale_cold:
+            try:
+                os.remove(os.path.join(folder, fname))
+            except OSError:
+                pass
+    return new_meta
+
+
+def _hot_arrays(ticker, meta):
+    key = (ticker, meta["generation"])
+    with _open_lock:
+        if key in _open:
+            _open.move_to_end(key)
+            return _open[key]
+    folder = _ticker_dir(ticker)
+    names = ["dates"] + [name for _, name in FIELDS.values()]
+    arrays = {n: np.load(os.path.join(folder, f"hot-{meta['generation']}-{n}.npy"), mmap_mode="r") for n in names}
+    with _open_lock:
+        for old in [k for k in _open if k[0] == ticker]:
+            del _open[old]
+        _open[key] = arrays
+        while len(_open) > settings.PRICE_ARCHIVE_OPEN_TICKERS:
+            _open.popitem(last=False)
+    return arrays
+
+
+def _slice(arrays, start, end):
+    dates = arrays["dates"]
+    lo = 0 if start is None else int(np.searchsorted(dates, np.datetime64(start, "D"), side="left"))
+    hi = len(dates) if end is None else int(np.searchsorted(dates, np.datetime64(end, "D"), side="right"))
+    return {name: arr[lo:hi] for name, arr in arrays.items()}
+
+
+def read_archive(ticker, start=None, end=None):
+    """
+    讀取 [start, end] 區間 (日期字串或 date)，沒有封存檔時回傳 None。
+    只落在熱區的查詢直接回傳 mmap 切片；跨到冷年份時才解壓縮需要的年份。
+    """
+    ticker = ticker.upper()
+    for attempt in range(2):
+        meta = read_meta(ticker)
+        if meta is None:
+            return None
+        try:
+            parts = []
+            start_year = pd.Timestamp(start).year if start is not None else None
+            end_year = pd.Timestamp(end).year if end is not None else None
+            for year in meta["cold_years"]:
+                if (start_year is not None and year < start_year) or (end_year is not None and year > end_year):
+                    continue
+                with np.load(os.path.join(_ticker_dir(ticker), f"cold-{year}.npz")) as z:
+                    parts.append(_slice({n: z[n] for n in z.files}, start, end))
+            if end is None or pd.Timestamp(end).date() >= dt.date.fromisoformat(meta["hot_start"]):
+                parts.append(_slice(_hot_arrays(ticker, meta), start, end))
+            break
+        except FileNotFoundError:
+            # 剛好被新版本取代，重讀 meta 再試一次
+            if attempt:
+                raise
+    if len(parts) == 1:
+        merged = parts[0]
+    elif parts:
+        merged = {n: np.concatenate([p[n] for p in parts]) for n in parts[0]}
+    else:
+        return PriceSlice(np.array([], dtype="datetime64[D]"), {f: np.array([], dtype=np.float64) for f in FIELDS})
+    return PriceSlice(merged["dates"], {col: merged[name] for col, (_, name) in FIELDS.items()})
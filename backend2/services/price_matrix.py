@@ -0,0 +1,241 @@
+#共享記憶體價格矩陣：price_matrix_loader.py 把整個股票池的日K排成 日期 x 股票 矩陣放進 shared memory，
+#各 uvicorn worker 只讀 attach，不再各自載入同一份價格
+#只放收盤 (Adj Close) 與成交量；需要 OHLC 的呼叫者改讀封存檔
+#區段配置 (連續): dates datetime64[D][n_dates] | 每個欄位 float64[n_dates, n_tickers] (順序同 MATRIX_FIELDS) | present uint8[n_dates, n_tickers]
+import datetime as dt
+import json
+import os
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import pandas as pd
+from database import get_db_connection
+from config import settings
+from services import price_archive
+from services.price_archive import PriceSlice
+
+MATRIX_FIELDS = ("Adj Close", "Volume")
+
+_lock = threading.Lock()
+_attached = {"checked_at": 0.0, "mtime": None, "view": None}
+
+
+class _MatrixView:
+    """worker 端的唯讀視圖 (所有陣列都直接指向共享記憶體)"""
+    def __init__(self, manifest, segment):
+        self.segment = segment
+        buf = segment.buf.toreadonly()
+        self.manifest = manifest
+        self.generation = manifest["generation"]
+        self.start = manifest["start"]
+        self.tickers = manifest["tickers"]
+        self.index = {t: i for i, t in enumerate(self.tickers)}
+        n_dates, n_tickers = manifest["n_dates"], len(self.tickers)
+        self.dates = np.frombuffer(buf, dtype="datetime64[D]", count=n_dates)
+        offset = self.dates.nbytes
+        self.arrays = {}
+        for field in MATRIX_FIELDS:
+            self.arrays[field] = np.frombuffer(buf, dtype=np.float64, count=n_dates * n_tickers, offset=offset).reshape(n_dates, n_tickers)
+            offset += n_dates * n_tickers * 8
+        # 矩陣的日期是所有股票交易日的聯集；present 標記該股票在該日是否有K棒
+        self.present = np.frombuffer(buf, dtype=np.uint8, count=n_dates * n_tickers, offset=offset).reshape(n_dates, n_tickers)
+
+
+def _segment_size(n_dates, n_tickers):
+    return n_dates * 8 + len(MATRIX_FIELDS) * n_dates * n_tickers * 8 + n_dates * n_tickers
+
+
+class _AttachedSegment(shared_memory.SharedMemory):
+    """worker 端 attach 的區段：回傳出去的切片仍引用共享記憶體時，延後到切片釋放後才關閉"""
+    def __del__(self):
+        try:
+            self.close()
+        except BufferError:
+            pass
+
+
+def _attach(name):
+    """
+    attach loader 建立的區段 (唯讀使用)。worker 不擁有區段：不能讓 resource_tracker 在 worker 結束時把它 unlink。
+    """
+    try:
+        return _AttachedSegment(name=name, create=False, track=False)  # Python 3.13+
+    except TypeError:
+        segment = _AttachedSegment(name=name, create=False)
+        if os.name != "nt":
+            resource_tracker.unregister("/" + segment.name, "shared_memory")
+        return segment
+
+
+def _read_manifest():
+    try:
+        with open(settings.PRICE_MATRIX_MANIFEST, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _current():
+    """回傳目前的矩陣視圖；manifest 每 PRICE_MATRIX_CHECK_SECONDS 才檢查一次是否換了新版本"""
+    with _lock:
+        now = time.monotonic()
+        if now - _attached["checked_at"] < settings.PRICE_MATRIX_CHECK_SECONDS:
+            return _attached["view"]
+        _attached["checked_at"] = now
+        try:
+            mtime = os.stat(settings.PRICE_MATRIX_MANIFEST).st_mtime_ns
+        except OSError:
+            _attached.update(mtime=None, view=None)
+            return None
+        if mtime == _attached["mtime"]:
+            return _attached["view"]
+
+        manifest = _read_manifest()
+        view = None
+        if manifest and tuple(manifest.get("fields", ())) == MATRIX_FIELDS:
+            try:
+                segment = _attach(manifest["shm_name"])
+                if segment.size < _segment_size(manifest["n_dates"], len(manifest["tickers"])):
+                    raise ValueError(f"segment {segment.name} is smaller than its manifest")
+                view = _MatrixView(manifest, segment)
+            except (OSError, ValueError) as e:
+                # loader 已換下一版 (舊區段被 unlink)，下次檢查時再 attach
+                print(f"⚠️ 共享價格矩陣 attach 失敗: {e}")
+                mtime = None
+        # 舊視圖的陣列若仍被引用，mmap 會等到沒有引用時才釋放
+        _attached.update(mtime=mtime, view=view)
+        return view
+
+
+def get_slice(ticker, start=None, end=None, fields=None):
+    """
+    從共享矩陣取單一股票的 PriceSlice，只含該股票有K棒的日期 (與 read_archive 相同)；日期連續時為零拷貝。
+    要求矩陣以外的欄位、不在股票池、區間早於矩陣起始日，或封存檔在矩陣建好之後已更新時回傳 None，由呼叫者改讀封存檔。
+    """
+    if fields is None or not set(fields) <= set(MATRIX_FIELDS):
+        return None
+    view = _current()
+    if view is None or start is None or str(start) < view.start:
+        return None
+    i = view.index.get(ticker.upper())
+    if i is None:
+        return None
+    meta = price_archive.read_meta(ticker)
+    if meta is None or meta["generation"] != view.manifest["archive_generations"][i]:
+        return None
+
+    lo = max(int(np.searchsorted(view.dates, np.datetime64(start, "D"), side="left")), view.manifest["first"][i])
+    hi = view.manifest["last"][i] + 1
+    if end is not None:
+        hi = min(hi, int(np.searchsorted(view.dates, np.datetime64(end, "D"), side="right")))
+    lo = min(lo, hi)
+    present = view.present[lo:hi, i]
+    if present.all():
+        return PriceSlice(view.dates[lo:hi], {field: view.arrays[field][lo:hi, i] for field in MATRIX_FIELDS})
+    rows = np.flatnonzero(present) + lo
+    return PriceSlice(view.dates[rows], {field: view.arrays[field][rows, i] for field in MATRIX_FIELDS})
+
+
+def get_frame(field="Adj Close", start=None):
+    """整個股票池某欄位 (MATRIX_FIELDS) 的 日期 x 股票 DataFrame (零拷貝，唯讀；沒有K棒的日期為 NaN)，給橫斷面計算使用；沒有矩陣時回傳 None"""
+    view = _current()
+    if view is None:
+        return None
+    lo = 0 if start is None else int(np.searchsorted(view.dates, np.datetime64(start, "D"), side="left"))
+    return pd.DataFrame(
+        view.arrays[field][lo:],
+        index=pd.DatetimeIndex(view.dates[lo:].astype("datetime64[ns]"), name="Date"),
+        columns=pd.Index(view.tickers, name="Ticker"),
+        copy=False,
+    )
+
+
+def status():
+    view = _current()
+    if view is None:
+        return {"attached": False}
+    return {
+        "attached": True,
+        "generation": view.generation,
+        "tickers": len(view.tickers),
+        "dates": len(view.dates),
+        "start": view.start,
+        "built_at": view.manifest["built_at"],
+        "mb": round(_segment_size(len(view.dates), len(view.tickers)) / 1024 / 1024, 1),
+    }
+
+
+# ---------- loader 端 ----------
+
+def publish_matrix():
+    """
+    由各股票的封存檔組出新版本矩陣，寫入新的共享記憶體區段後再原子替換 manifest。
+    回傳 SharedMemory (由 loader 持有，換版後呼叫 close()/unlink() 釋放舊區段)。
+    """
+    start = (dt.date.today() - dt.timedelta(days=settings.PRICE_MATRIX_YEARS * 366)).isoformat()
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT Stock_Id FROM DailyPrices ORDER BY Stock_Id")
+        universe = [r[0] for r in cursor.fetchall()]
+        slices, generations = {}, {}
+        for ticker in universe:
+            if price_archive.read_meta(ticker) is None:
+                price_archive.sync_archive(ticker, conn)
+            meta = price_archive.read_meta(ticker)
+            price_slice = price_archive.read_archive(ticker, start)
+            if meta is None or price_slice is None or len(price_slice) == 0:
+                continue
+            slices[ticker] = price_slice
+            generations[ticker] = meta["generation"]
+    finally:
+        conn.close()
+
+    tickers = list(slices)
+    dates = np.unique(np.concatenate([s.dates for s in slices.values()])) if tickers else np.array([], dtype="datetime64[D]")
+    gen = f"{time.time_ns():x}"
+    name = f"aam_px_{gen}"
+    shm = shared_memory.SharedMemory(name=name, create=True, size=max(_segment_size(len(dates), len(tickers)), 1))
+    buf = shm.buf
+    np.frombuffer(buf, dtype="datetime64[D]", count=len(dates))[:] = dates
+    offset = dates.nbytes
+    matrices = {}
+    for field in MATRIX_FIELDS:
+        matrices[field] = np.frombuffer(buf, dtype=np.float64, count=len(dates) * len(tickers), offset=offset).reshape(len(dates), len(tickers))
+        matrices[field][:] = np.nan
+        offset += len(dates) * len(tickers) * 8
+    present = np.frombuffer(buf, dtype=np.uint8, count=len(dates) * len(tickers), offset=offset).reshape(len(dates), len(tickers))
+    present[:] = 0
+
+    first, last = [], []
+    for i, ticker in enumerate(tickers):
+        price_slice = slices[ticker]
+        rows = np.searchsorted(dates, price_slice.dates)
+        for field in MATRIX_FIELDS:
+            matrices[field][rows, i] = price_slice.columns[field]
+        present[rows, i] = 1
+        first.append(int(rows[0]))
+        last.append(int(rows[-1]))
+    del matrices, present, buf
+
+    manifest = {
+        "generation": gen,
+        "shm_name": name,
+        "start": start,
+        "n_dates": int(len(dates)),
+        "fields": list(MATRIX_FIELDS),
+        "tickers": tickers,
+        "first": first,
+        "last": last,
+        "archive_generations": [generations[t] for t in tickers],
+        "built_at": dt.datetime.now().isoformat(timespec="seconds"),
+    }
+    path = settings.PRICE_MATRIX_MANIFEST
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+    print(f"🧮 共享價格矩陣已更新: {len(tickers)} 檔 x {len(dates)} 日 ({name})")
+    return shm
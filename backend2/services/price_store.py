@@ -0,0 +1,139 @@
+#本地日K價格庫 (DailyPrices)：只補抓最後一筆之後缺少的K棒
+import datetime as dt
+import pandas as pd
+from database import get_db_connection, bulk_upsert
+from config import settings
+from common import market_data
+from services import price_archive, price_matrix
+
+PRICE_COLUMNS = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+
+_PERIOD_DAYS = {"1d": 1, "5d": 5, "1mo": 31, "3mo": 92, "6mo": 183, "1y": 366, "2y": 731, "5y": 1827, "10y": 3653}
+
+
+def period_start(period, today=None):
+    """把 yfinance 的 period 字串 (2y, 6mo, ytd, max...) 轉成起始日；max 回傳 None"""
+    today = today or dt.date.today()
+    if period == "max":
+        return None
+    if period == "ytd":
+        return dt.date(today.year, 1, 1)
+    if period in _PERIOD_DAYS:
+        return today - dt.timedelta(days=_PERIOD_DAYS[period])
+    raise ValueError(f"Unsupported period: {period}")
+
+
+def _naive_dates(index):
+    dates = pd.to_datetime(index)
+    if getattr(dates, "tz", None) is not None:
+        dates = dates.tz_localize(None)
+    return dates
+
+
+def _store_bars(conn, ticker, df):
+    if df is None or df.empty:
+        return 0
+    df = df.copy()
+    if "Adj Close" not in df.columns:
+        df["Adj Close"] = df["Close"]
+    dates = _naive_dates(df.index)
+    rows = [
+        (ticker, d.strftime("%Y-%m-%d"), r[0], r[1], r[2], r[3], r[4], r[5])
+        for d, r in zip(dates, df[PRICE_COLUMNS].itertuples(index=False, name=None))
+        if pd.notna(r[3])
+    ]
+    return bulk_upsert(conn, "DailyPrices", ["Stock_Id", "TradeDate", "Open", "High", "Low", "Close", "AdjClose", "Volume"], rows)
+
+
+def update_prices(ticker, force=False):
+    """
+    同步 ticker 的日K：
+    - 尚無資料時一次抓完整歷史 (period=max)
+    - 之後只從最後一筆 (含，覆蓋盤中未收盤的K棒) 抓到今天
+    - 新K棒中出現除權息/分割時重抓全部，讓 Adj Close 保持一致
+    """
+    ticker = ticker.upper()
+    resync = False
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if not force:
+            cursor.execute("SELECT FetchedAt FROM IngestLog WHERE Stock_Id = ? AND Endpoint = 'PRICES'", (ticker,))
+            row = cursor.fetchone()
+            if row and dt.datetime.now() - dt.datetime.fromisoformat(row[0]) < dt.timedelta(minutes=settings.PRICE_REFRESH_MINUTES):
+                return 0
+
+        cursor.execute("SELECT MAX(TradeDate) FROM DailyPrices WHERE Stock_Id = ?", (ticker,))
+        last = cursor.fetchone()[0]
+        ttl = settings.PRICE_REFRESH_MINUTES * 60
+
+        if last is None:
+            df = market_data.get_history(ticker, ttl=ttl, period="max", auto_adjust=False, actions=True)
+        else:
+            df = market_data.get_history(ticker, ttl=ttl, start=last, auto_adjust=False, actions=True)
+            new_bars = df[_naive_dates(df.index) > pd.Timestamp(last)]
+            has_actions = any(
+                col in new_bars.columns and (new_bars[col].fillna(0) != 0).any() for col in ("Dividends", "Stock Splits")
+            )
+            if has_actions:
+                print(f"🔁 {ticker} 出現除權息/分割，重新同步完整歷史")
+                conn.execute("DELETE FROM DailyPrices WHERE Stock_Id = ?", (ticker,))
+                resync = True
+                df = market_data.get_history(ticker, ttl=ttl, period="max", auto_adjust=False, actions=True)
+
+        stored = _store_bars(conn, ticker, df)
+        conn.execute(
+            "INSERT OR REPLACE INTO IngestLog (Stock_Id, Endpoint, FetchedAt) VALUES (?, 'PRICES', ?)",
+            (ticker, dt.datetime.now().isoformat(timespec="seconds")),
+        )
+        conn.commit()
+        try:
+            price_archive.sync_archive(ticker, conn, full=resync)
+        except Exception as e:
+            print(f"⚠️ {ticker} 封存檔更新失敗: {e}")
+        return stored
+    finally:
+        conn.close()
+
+
+def get_price_slice(ticker, period="max", start=None, end=None, fields=None):
+    """
+    讀日K (必要時先補抓缺少的K棒)，回傳 price_archive.PriceSlice。
+    fields: 呼叫者會用到的欄位；只需要收盤 / 成交量時可由共享矩陣提供，否則讀封存檔。
+    共享矩陣或封存檔熱區內的日期區間都是零拷貝切片，只會讀到需要的頁面。
+    """
+    ticker = ticker.upper()
+    try:
+        update_prices(ticker)
+    except Exception as e:
+        # 上游失敗時仍回傳本地已有的資料
+        print(f"⚠️ {ticker} 價格更新失敗，使用本地資料: {e}")
+
+    start = start or period_start(period)
+    # 先用共享記憶體矩陣 (有 loader 時)，否則讀本程序 mmap 的封存檔
+    price_slice = price_matrix.get_slice(ticker, start, end, fields)
+    if price_slice is not None:
+        return price_slice
+    price_slice = price_archive.read_archive(ticker, start, end)
+    if price_slice is None:
+        conn = get_db_connection()
+        try:
+            price_archive.sync_archive(ticker, conn)
+        finally:
+            conn.close()
+        price_slice = price_archive.read_archive(ticker, start, end)
+    return price_slice
+
+
+def get_price_history(ticker, period="max", start=None, adjusted=False):
+    """
+    以 DataFrame 回傳日K，欄位與 yfinance 相同 (Open/High/Low/Close/Adj Close/Volume)，index 為 Date。
+    adjusted=True 時依 Adj Close / Close 比例調整 OHLC (等同 yfinance auto_adjust=True)。
+    """
+    df = get_price_slice(ticker, period=period, start=start).to_frame(PRICE_COLUMNS)
+    if adjusted and not df.empty:
+        factor = (df["Adj Close"] / df["Close"]).fillna(1.0)
+        for col in ("Open", "High", "Low"):
+            df[col] = df[col] * factor
+        df["Close"] = df["Adj Close"]
+    return df
@@ -0,0 +1,293 @@
+#Alpha Vantage 配額排程：每分鐘為 token bucket，每日為固定視窗計數 (與上游相同，於每日重置時刻歸零)
+#配額狀態存在 ALPHA_VANTAGE_QUOTA_FILE，以檔案鎖互斥：同一把 key 的所有程序與重新啟動後共用同一份額度
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows：沒有 flock，只在程序內互斥
+    fcntl = None
+
+# 優先權：數字越小越先取得配額
+PRIORITY_SEARCH = 0     # 互動式搜尋
+PRIORITY_ANALYZE = 1    # 使用者觸發的單檔分析
+PRIORITY_BATCH = 2      # 批次匯入
+
+
+class QuotaExceeded(Exception):
+    """在等待時限內無法取得配額"""
+
+
+class TokenBucket:
+    """容量為 capacity、每 period 秒補滿的 token bucket；capacity <= 0 代表不限制。時間為 time.time() (跨程序共用)"""
+    def __init__(self, name, capacity, period):
+        self.name = name
+        self.capacity = capacity
+        self.period = period
+        self.tokens = float(capacity)
+        self.updated = time.time()
+
+    @property
+    def unlimited(self):
+        return self.capacity <= 0
+
+    def refill(self, now):
+        if self.unlimited:
+            return
+        rate = self.capacity / self.period
+        self.tokens = min(self.capacity, self.tokens + max(now - self.updated, 0.0) * rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """距離可取得 1 個 token 還要幾秒"""
+        self.refill(now)
+        if self.unlimited or self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * self.period / self.capacity
+
+    def consume(self):
+        if not self.unlimited:
+            self.tokens -= 1
+
+    def drain(self):
+        if not self.unlimited:
+            self.tokens = 0.0
+
+    def load(self, state):
+        """套用狀態檔中的 {tokens, updated} (None 代表沒有記錄，沿用目前的值)"""
+        if state:
+            self.tokens = min(float(self.capacity), float(state["tokens"]))
+            self.updated = float(state["updated"])
+
+    def dump(self):
+        return {"tokens": self.tokens, "updated": self.updated}
+
+    def describe(self, now):
+        self.refill(now)
+        return {
+            "limit": self.capacity if not self.unlimited else None,
+            "remaining": int(self.tokens) if not self.unlimited else None,
+            "next_token_in_s": round(self.wait_time(now), 2),
+        }
+
+
+class DailyWindow:
+    """
+    每日固定視窗：視窗內最多 capacity 次，於每日 reset_hour (UTC) 歸零；capacity <= 0 代表不限制。
+    上游的每日額度是固定視窗，用 token bucket 會讓一個日曆日用掉將近兩倍額度。
+    """
+    def __init__(self, name, capacity, reset_hour=0):
+        self.name = name
+        self.capacity = capacity
+        self.reset_hour = reset_hour
+        self.window = self._window_start(time.time())
+        self.used = 0
+
+    @property
+    def unlimited(self):
+        return self.capacity <= 0
+
+    def _window_start(self, now):
+        offset = self.reset_hour * 3600
+        return (now - offset) // 86400 * 86400 + offset
+
+    def refill(self, now):
+        window = self._window_start(now)
+        if window != self.window:
+            self.window = window
+            self.used = 0
+
+    def wait_time(self, now):
+        """距離可再呼叫還要幾秒 (額度用完時為到下次重置的時間)"""
+        self.refill(now)
+        if self.unlimited or self.used < self.capacity:
+            return 0.0
+        return self.window + 86400 - now
+
+    def consume(self):
+        self.used += 1
+
+    def drain(self):
+        """上游已回報每日額度用完：本視窗剩下的時間都不再呼叫"""
+        self.used = max(self.used, self.capacity)
+
+    def load(self, state):
+        if state and "window" in state:
+            self.window = float(state["window"])
+            self.used = int(state["used"])
+
+    def dump(self):
+        return {"window": self.window, "used": self.used}
+
+    def describe(self, now):
+        self.refill(now)
+        return {
+            "limit": self.capacity if not self.unlimited else None,
+            "remaining": max(self.capacity - self.used, 0) if not self.unlimited else None,
+            "used": self.used,
+            "resets_in_s": round(self.window + 86400 - now, 2),
+            "next_token_in_s": round(self.wait_time(now), 2),
+        }
+
+
+def _load(f, buckets):
+    f.seek(0)
+    try:
+        saved = json.loads(f.read() or "{}")
+    except ValueError:
+        saved = {}
+    for b in buckets:
+        b.load(saved.get(b.name))
+
+
+class SharedBucketState:
+    """配額狀態檔：locked() 期間持有獨占檔案鎖，進入時載入、正常離開時寫回；read() 只以共享鎖載入"""
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, buckets):
+        try:
+            f = open(self.path, encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                _load(f, buckets)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextmanager
+    def locked(self, buckets):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a+", encoding="utf-8") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                _load(f, buckets)
+                yield
+                f.seek(0)
+                f.truncate()
+                json.dump({b.name: b.dump() for b in buckets}, f)
+                f.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class QuotaScheduler:
+    """
+    配額排程器：程序內的呼叫者依優先權排隊，由隊首依序向所有 bucket 取 token，避免浪費被限流的呼叫。
+    有 state 時 bucket 狀態在檔案鎖內讀取 / 扣除 / 寫回，其他程序用掉的額度也會被扣掉。
+    """
+    def __init__(self, buckets, state=None):
+        self.buckets = buckets
+        self.state = state
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self.granted = 0
+        self.rejected = 0
+        self.throttled = 0
+
+    @contextmanager
+    def _shared(self):
+        """呼叫者需持有 self._cond"""
+        if self.state is None:
+            yield
+        else:
+            with self.state.locked(self.buckets):
+                yield
+
+    def _take(self):
+        """可以時扣掉一個 token 並回傳 0，否則回傳還要等幾秒"""
+        with self._shared():
+            now = time.time()
+            wait = max(b.wait_time(now) for b in self.buckets)
+            if wait <= 0:
+                for b in self.buckets:
+                    b.consume()
+            return wait
+
+    def acquire(self, priority=PRIORITY_ANALYZE, timeout=None):
+        """排隊等待一個呼叫額度；超過 timeout 仍拿不到就拋出 QuotaExceeded"""
+        timeout = settings.ALPHA_VANTAGE_QUEUE_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        ticket = (priority, next(self._seq))
+
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if self._queue[0] == ticket:
+                        wait = self._take()
+                        if wait <= 0:
+                            heapq.heappop(self._queue)
+                            self.granted += 1
+                            self._cond.notify_all()
+                            return
+                        if now + wait > deadline:
+                            raise QuotaExceeded(f"Alpha Vantage quota exhausted, next slot in {wait:.0f}s")
+
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise QuotaExceeded("Timed out waiting in Alpha Vantage queue")
+                    self._cond.wait(remaining if wait is None else min(wait, remaining))
+            except BaseException:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                    heapq.heapify(self._queue)
+                self.rejected += 1
+                self._cond.notify_all()
+                raise
+
+    def report_throttled(self, daily=False):
+        """
+        上游仍回傳限流訊息 (例如其他服務共用同一把 key)：清空每分鐘 bucket；
+        daily=True (每日額度用完) 時連每日視窗一起清空，直到下次重置都不再呼叫。
+        """
+        with self._cond:
+            self.throttled += 1
+            with self._shared():
+                for b in self.buckets:
+                    if daily or not isinstance(b, DailyWindow):
+                        b.drain()
+
+    def status(self):
+        """唯讀：只以共享鎖讀取狀態檔，不寫回"""
+        with self._cond:
+            if self.state is not None:
+                self.state.read(self.buckets)
+            now = time.time()
+            buckets = {b.name: b.describe(now) for b in self.buckets}
+            return {
+                "buckets": buckets,
+                "shared": self.state is not None,
+                "queued": len(self._queue),
+                "granted": self.granted,
+                "rejected": self.rejected,
+                "throttled": self.throttled,
+            }
+
+
+av_scheduler = QuotaScheduler(
+    [
+        TokenBucket("per_minute", settings.ALPHA_VANTAGE_PER_MINUTE, 60),
+        DailyWindow("per_day", settings.ALPHA_VANTAGE_PER_DAY, settings.ALPHA_VANTAGE_DAY_RESET_UTC_HOUR),
+    ],
+    SharedBucketState(settings.ALPHA_VANTAGE_QUOTA_FILE) if settings.ALPHA_VANTAGE_QUOTA_FILE else None,
+)
+
+
+def get_quota_status():
+    return av_scheduler.status()
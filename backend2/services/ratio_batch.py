@@ -0,0 +1,101 @@
+#整批重算財務比率：每批股票一次查詢寬表，以 (Stock_Id, 年度) 為索引一次向量化算完，
+#大型股票池分批交給多個程序，最後以單一 bulk upsert 寫回 FinancialRatios
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from database import get_db_connection
+from services.db_writer import db_writer
+from common.statement_store import load_statement_pivot_groups
+from common.ratio_engine import evaluate_ratios_grouped
+from services.screen_service import rebuild_latest_statements
+from services.peer_service import rebuild_peers
+from services.data_service import ANNUAL_RATIOS, RATIO_UPSERT, RATIO_DELETE, STATEMENT_FUNCTIONS, QUARTERLY_SUFFIX, ttm_ratio_rows
+from config import settings
+
+
+def _annual_frames(pivots):
+    """ReportDate 轉成年度 (同一年度有多期時保留最新一期)"""
+    frames = {}
+    for key, stmt_type in (('income', 'Income'), ('balance', 'BalanceSheet'), ('cash', 'CashFlow')):
+        df = pivots[stmt_type]
+        if not df.empty:
+            years = df.index.get_level_values(1).year
+            df = df.set_axis(pd.MultiIndex.from_arrays([df.index.get_level_values(0), years], names=['Stock_Id', 'ReportYear']), axis=0)
+            df = df[~df.index.duplicated(keep='last')]
+        frames[key] = df
+    return frames
+
+
+def compute_ratio_batch(stock_ids):
+    """一批股票的年度 + TTM 比率 (FinancialRatios 的列)；可在 worker 程序中執行"""
+    conn = get_db_connection()
+    try:
+        # 與單檔計算相同：缺少的科目視為 NaN
+        annual = load_statement_pivot_groups(stock_ids, conn, list(STATEMENT_FUNCTIONS))
+        quarterly = load_statement_pivot_groups(
+            stock_ids, conn, [t + QUARTERLY_SUFFIX for t in STATEMENT_FUNCTIONS]
+        )
+    finally:
+        conn.close()
+
+    rows = []
+    frames = _annual_frames(annual)
+    if not frames['income'].empty:
+        rows.extend(evaluate_ratios_grouped(frames, frames['income'].index, ANNUAL_RATIOS))
+
+    income, balance, cash = (quarterly[t + QUARTERLY_SUFFIX] for t in STATEMENT_FUNCTIONS)
+    if not income.empty and not balance.empty:
+        # 沒有季資產負債表的股票不算 TTM (與單檔計算相同)
+        income = income[income.index.get_level_values(0).isin(balance.index.get_level_values(0))]
+        rows.extend(ttm_ratio_rows(income, balance, cash))
+    return rows
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def list_ratio_tickers(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT Stock_Id FROM StatementPivots ORDER BY Stock_Id")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def recompute_ratios(stock_ids=None, chunk_size=None, workers=None):
+    """
+    重算 stock_ids (預設: 所有有財報寬表的股票) 的財務比率並寫回，回傳 {"tickers", "rows", "seconds"}。
+    只有一批時直接在目前程序計算；寫入 (清掉舊比率 + 比率 + LatestRatios / 同業統計重建) 在同一個交易內完成。
+    """
+    started = time.monotonic()
+    chunk_size = chunk_size or settings.RATIO_BATCH_CHUNK
+    workers = workers or settings.RATIO_BATCH_WORKERS
+    if stock_ids is None:
+        conn = get_db_connection()
+        try:
+            stock_ids = list_ratio_tickers(conn)
+        finally:
+            conn.close()
+    stock_ids = sorted({s.upper() for s in stock_ids})
+    chunks = list(_chunks(stock_ids, chunk_size))
+
+    rows = []
+    if len(chunks) <= 1 or workers <= 1:
+        for chunk in chunks:
+            rows.extend(compute_ratio_batch(chunk))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            for chunk_rows in pool.map(compute_ratio_batch, chunks):
+                rows.extend(chunk_rows)
+    computed = time.monotonic() - started
+
+    if rows:
+        db_writer.write([
+            (RATIO_DELETE, [(s,) for s in stock_ids]),
+            (RATIO_UPSERT, rows),
+            *rebuild_latest_statements(),
+            (rebuild_peers, []),
+        ])
+    elapsed = time.monotonic() - started
+    print(f"🧮 整批重算 {len(stock_ids)} 檔 ({len(chunks)} 批): {len(rows)} 筆比率 | 計算 {computed:.1f}s / 含寫入 {elapsed:.1f}s")
+    return {"tickers": len(stock_ids), "rows": len(rows), "seconds": round(elapsed, 2)}
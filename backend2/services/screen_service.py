@@ -0,0 +1,108 @@
+#選股：以 LatestRatios (每檔最新年度一列、每個比率一欄且有索引) 回答複合條件篩選，不掃 FinancialRatios 的 EAV 列
+from database import get_db_connection
+
+# FinancialRatios.RatioName -> LatestRatios 欄位
+SCREEN_FIELDS = {
+    'Return on Equity (ROE)': 'ROE',
+    'Gross Margin': 'GrossMargin',
+    'Operating Margin': 'OperatingMargin',
+    'Net Profit Margin': 'NetMargin',
+    'Revenue Growth': 'RevenueGrowth',
+    'Net Income Growth': 'NetIncomeGrowth',
+    'EPS Growth': 'EPSGrowth',
+    'FCF Growth': 'FCFGrowth',
+    'Debt-to-Equity Ratio': 'DebtToEquity',
+    'Current Ratio': 'CurrentRatio',
+    'Interest Coverage Ratio': 'InterestCoverage',
+    'Net Debt / EBITDA': 'NetDebtToEBITDA',
+    'Asset Turnover': 'AssetTurnover',
+    'Inventory Turnover': 'InventoryTurnover',
+    'Receivables Turnover': 'ReceivablesTurnover',
+    'ROIC': 'ROIC',
+}
+OPERATORS = {'>': '>', '>=': '>=', '<': '<', '<=': '<=', '=': '=', '==': '=', '!=': '!='}
+
+_columns = ", ".join(SCREEN_FIELDS.values())
+_pivots = ",\n        ".join(f"MAX(CASE WHEN r.RatioName = '{name}' THEN r.RatioValue END)" for name in SCREEN_FIELDS)
+# 只取年度比率 (TTM 列的 Category 為 'TTM')；{filter} 為空字串時重建全部
+LATEST_REFRESH_SQL = f'''
+    INSERT OR REPLACE INTO LatestRatios (Stock_Id, ReportYear, {_columns}, UpdatedAt)
+    SELECT r.Stock_Id, r.ReportYear,
+        {_pivots},
+        CURRENT_TIMESTAMP
+    FROM FinancialRatios r
+    JOIN (SELECT Stock_Id, MAX(ReportYear) AS LatestYear FROM FinancialRatios
+          WHERE Category != 'TTM'{{filter}} GROUP BY Stock_Id) m
+      ON r.Stock_Id = m.Stock_Id AND r.ReportYear = m.LatestYear
+    WHERE r.Category != 'TTM'
+    GROUP BY r.Stock_Id, r.ReportYear
+'''
+LATEST_DELETE_SQL = "DELETE FROM LatestRatios WHERE Stock_Id = ?"
+
+
+def latest_ratio_statements(stock_id):
+    """更新單一股票寬表列的寫入語句，與 FinancialRatios 的寫入放在同一批 (db_writer)"""
+    return [
+        (LATEST_DELETE_SQL, (stock_id,)),
+        (LATEST_REFRESH_SQL.format(filter=" AND Stock_Id = ?"), (stock_id,)),
+    ]
+
+
+def rebuild_latest_statements():
+    """重建整張寬表的寫入語句 (整批重算比率後與比率寫在同一批)"""
+    return [
+        ("DELETE FROM LatestRatios", ()),
+        (LATEST_REFRESH_SQL.format(filter=""), ()),
+    ]
+
+
+def resolve_field(field):
+    """接受比率名稱 ('Return on Equity (ROE)') 或欄位名稱 ('ROE')，不分大小寫"""
+    for name, column in SCREEN_FIELDS.items():
+        if field.lower() in (name.lower(), column.lower()):
+            return column
+    if field.lower() == 'reportyear':
+        return 'ReportYear'
+    raise ValueError(f"Unknown screen field: {field}. Supported: {', '.join(SCREEN_FIELDS.values())}")
+
+
+def screen(filters, sort=None, order="desc", limit=50, offset=0, min_year=None):
+    """
+    filters: [(field, op, value)]，全部條件以 AND 組合。
+    回傳 {"total", "limit", "offset", "results": [{Stock_Id, ReportYear, 比率名稱: 值}]}。
+    """
+    where, params = [], []
+    for field, op, value in filters:
+        if op not in OPERATORS:
+            raise ValueError(f"Unsupported operator: {op}")
+        where.append(f"{resolve_field(field)} {OPERATORS[op]} ?")
+        params.append(float(value))
+    if min_year is not None:
+        where.append("ReportYear >= ?")
+        params.append(int(min_year))
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    if order.lower() not in ("asc", "desc"):
+        raise ValueError("order must be 'asc' or 'desc'")
+    sort_column = resolve_field(sort) if sort else "Stock_Id"
+    order_sql = f"ORDER BY {sort_column} {order.upper()} NULLS LAST, Stock_Id"
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM LatestRatios {where_sql}", params)
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            f"SELECT Stock_Id, ReportYear, {_columns} FROM LatestRatios {where_sql} {order_sql} LIMIT ? OFFSET ?",
+            params + [int(limit), int(offset)],
+        )
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    names = list(SCREEN_FIELDS)
+    results = [
+        {"Stock_Id": row[0], "ReportYear": row[1], **dict(zip(names, row[2:]))}
+        for row in rows
+    ]
+    return {"total": total, "limit": limit, "offset": offset, "results": results}
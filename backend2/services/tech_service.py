@@ -6,10 +6,10 @@
 
 # backend2/services/tech_service.py
 
-import yfinance as yf
 import pandas as pd
 import pandas_ta as ta  # [NEW] 引入 pandas_ta
 import numpy as np
+from services.price_store import get_price_slice
 
 # ==========================================
 # 核心計算邏輯 (整合 Momentum & Sentiment)
@@ -19,7 +19,8 @@ def fetch_stock_data(ticker: str, years: int = 2) -> pd.DataFrame:
     """下載 OHLCV 數據"""
     try:
         # 下載較短的區間即可滿足技術指標計算 (2年足夠)
-        df = yf.download(ticker, period=f"{years}y", progress=False, auto_adjust=False)
+        # 只把需要的欄位從 mmap 切片組成 DataFrame
+        df = get_price_slice(ticker, period=f"{years}y").to_frame(["Open", "High", "Low", "Adj Close", "Volume"])
         
         # 處理 MultiIndex (yfinance 新版相容性)
         if isinstance(df.columns, pd.MultiIndex):
@@ -0,0 +1,92 @@
+#測試以 backend2 目錄為匯入根目錄 (與 uvicorn / worker.py 相同)；資料庫、快取等相對路徑都落在暫存工作目錄
+import os
+import shutil
+import sys
+import tempfile
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+_workdir = None
+
+
+def pytest_configure(config):
+    global _workdir
+    _workdir = tempfile.mkdtemp(prefix="backend2-tests-")
+    os.chdir(_workdir)
+
+
+def pytest_unconfigure(config):
+    os.chdir(BACKEND_DIR)
+    shutil.rmtree(_workdir, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def tables():
+    """SQLite 測試資料庫 (暫存目錄下的 stock.db) 建好所有表格"""
+    from database import create_fundamental_tables
+    create_fundamental_tables()
+
+
+@pytest.fixture
+def conn(tables):
+    from database import get_db_connection
+    conn = get_db_connection()
+    yield conn
+    conn.close()
+
+
+STATEMENT_ITEMS = {
+    "Income": ["Total Revenue", "Net Income", "Gross Profit", "Operating Income", "Cost Of Revenue",
+               "Interest Expense", "EBITDA", "Basic EPS"],
+    "BalanceSheet": ["Total Equity Gross Minority Interest", "Total Assets", "Total Debt", "Net Debt", "Inventory",
+                     "Accounts Receivable", "Current Assets", "Current Liabilities", "Invested Capital"],
+    "CashFlow": ["Free Cash Flow"],
+}
+
+
+@pytest.fixture(scope="session")
+def statements(tables):
+    """
+    隨機財報 (固定種子)：部分股票缺科目、缺年度、有 0 值，RS0003 有會計年度變更 (同一年度兩期)，
+    RS0005 沒有季報資產負債表。回傳股票代號清單。
+    """
+    import datetime as dt
+    import numpy as np
+    from database import get_db_connection
+    from common.statement_store import rebuild_pivots
+
+    rng = np.random.default_rng(7)
+    tickers = [f"RS{k:04d}" for k in range(8)]
+    rows = []
+    for ticker in tickers:
+        for stmt_type, items in STATEMENT_ITEMS.items():
+            items = [i for i in items if rng.random() > 0.1]
+            for year in range(2019, 2025):
+                if rng.random() < 0.1:
+                    continue
+                for item in items:
+                    value = float(rng.normal(100, 60)) if rng.random() > 0.05 else 0.0
+                    rows.append((ticker, stmt_type, item, f"{year}-12-31", value))
+                    if ticker == "RS0003" and year == 2023:
+                        rows.append((ticker, stmt_type, item, "2023-06-30", value * 1.3 + 1))
+            if ticker == "RS0005" and stmt_type == "BalanceSheet":
+                continue
+            for q in range(8):
+                date = (dt.date(2023, 3, 31) + dt.timedelta(days=int(91.3 * q))).isoformat()
+                for item in items:
+                    rows.append((ticker, stmt_type + "_Q", item, date, float(rng.normal(25, 15))))
+
+    conn = get_db_connection()
+    try:
+        conn.executemany(
+            "INSERT OR REPLACE INTO FinancialStatements (Stock_Id, StatementType, Item, ReportDate, Value) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        rebuild_pivots(conn, tickers)
+        conn.commit()
+    finally:
+        conn.close()
+    return tickers
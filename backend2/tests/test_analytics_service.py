@@ -0,0 +1,75 @@
+#分析查詢層：只接受單一 SELECT，載入後的 DuckDB 不能存取外部檔案
+import duckdb
+import pytest
+from services import analytics_service
+from services.analytics_service import run_query
+
+
+@pytest.fixture
+def engine(statements, monkeypatch):
+    monkeypatch.setattr(analytics_service, "_engine", {"db": None, "mtime": None, "checked_at": 0.0, "refreshing": True})
+    analytics_service._refresh(export=True)
+    assert analytics_service._engine["db"] is not None
+    return analytics_service._engine["db"]
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT 1",
+    "WITH t AS (SELECT 1 AS x) SELECT x FROM t",
+    "select Stock_Id from statements -- trailing comment",
+])
+def test_accepts_single_select(sql):
+    assert analytics_service._check_read_only(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "DELETE FROM ratios",
+    "DROP TABLE statements",
+    "CREATE TABLE x AS SELECT 1",
+    "INSERT INTO ratios SELECT * FROM ratios",
+    "SELECT 1; DROP TABLE ratios",
+    "SELECT 1; SELECT 2",
+    "COPY ratios TO 'out.csv'",
+    "ATTACH 'other.db'",
+    "SET enable_external_access = true",
+    "",
+])
+def test_rejects_anything_but_one_select(sql):
+    with pytest.raises(ValueError):
+        analytics_service._check_read_only(sql)
+
+
+def test_pragmas_are_not_expanded_with_file_access(tmp_path):
+    # PRAGMA import_database 在解析階段就會讀取並執行 schema.sql / load.sql
+    out = tmp_path / "out.csv"
+    (tmp_path / "schema.sql").write_text("CREATE TABLE pwned AS SELECT 1 AS x;")
+    (tmp_path / "load.sql").write_text(f"COPY pwned TO '{out}';")
+    with pytest.raises(duckdb.Error):
+        analytics_service._check_read_only(f"PRAGMA import_database('{tmp_path}')")
+    assert not out.exists()
+
+
+def test_query_runs_on_snapshot(engine, statements):
+    columns, rows, _ = run_query(
+        "SELECT Stock_Id, COUNT(*) AS n FROM statements WHERE Stock_Id = ? GROUP BY Stock_Id", [statements[0]]
+    )
+    assert columns == ["Stock_Id", "n"] and rows[0][0] == statements[0] and rows[0][1] > 0
+
+
+def test_query_cannot_read_files(engine):
+    with pytest.raises(duckdb.Error):
+        run_query("SELECT * FROM read_csv('/etc/passwd')")
+    with pytest.raises(duckdb.Error):
+        run_query(f"SELECT * FROM read_parquet('{analytics_service._path('ratios')}')")
+
+
+def test_query_cannot_change_the_snapshot(engine):
+    with pytest.raises(ValueError):
+        run_query("DELETE FROM statements")
+    assert run_query("SELECT COUNT(*) FROM statements")[1][0][0] > 0
+
+
+def test_row_limit_is_capped(engine, monkeypatch):
+    monkeypatch.setattr(analytics_service.settings, "ANALYTICS_MAX_ROWS", 5)
+    _, rows, _ = run_query("SELECT * FROM statements", limit=1000)
+    assert len(rows) == 5
@@ -0,0 +1,77 @@
+#單一寫入執行緒：batch 失敗只回滾自己的 savepoint，交易層級失敗時通知本輪所有 batch
+import sqlite3
+import pytest
+from config import settings
+from services.db_writer import SQLiteWriter
+
+INSERT = "INSERT INTO WriterTest (k, v) VALUES (?, ?)"
+
+
+@pytest.fixture
+def writer_table(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS WriterTest (k TEXT PRIMARY KEY, v INTEGER)")
+    conn.execute("DELETE FROM WriterTest")
+    conn.commit()
+    return conn
+
+
+def rows(conn):
+    return dict(conn.execute("SELECT k, v FROM WriterTest").fetchall())
+
+
+def test_failed_batch_rolls_back_only_itself(writer_table):
+    # linger 夠長，三個 batch 進同一個交易
+    writer = SQLiteWriter(max_batches=10, linger_ms=200)
+    ok1 = writer.submit([(INSERT, ("a", 1)), (INSERT, [("b", 2), ("c", 3)])])
+    bad = writer.submit([(INSERT, ("d", 4)), (INSERT, ("a", 5))])  # 主鍵重複
+    ok2 = writer.submit([(INSERT, ("e", 6))])
+
+    assert ok1.result(5) is None and ok2.result(5) is None
+    with pytest.raises(sqlite3.IntegrityError):
+        bad.result(5)
+    assert rows(writer_table) == {"a": 1, "b": 2, "c": 3, "e": 6}
+
+    stats = writer.stats()
+    assert stats["failed_batches"] == 1
+    assert stats["transactions"] == 1
+    assert stats["batches"] == 3
+
+
+def test_callable_statement_failure_rolls_back(writer_table):
+    def explode(conn, params):
+        conn.execute(INSERT, params)
+        raise ValueError("boom")
+
+    writer = SQLiteWriter(max_batches=10, linger_ms=0)
+    with pytest.raises(ValueError):
+        writer.write([(INSERT, ("x", 1)), (explode, ("y", 2))], timeout=5)
+    assert rows(writer_table) == {}
+    assert writer.stats()["failed_batches"] == 1
+
+
+def test_transaction_failure_fails_every_batch(writer_table, monkeypatch):
+    # 其他程序持有寫入鎖超過 busy timeout：BEGIN IMMEDIATE 失敗
+    monkeypatch.setattr(settings, "DB_BUSY_TIMEOUT", 0.1)
+    blocker = sqlite3.connect(settings.DB_NAME)
+    blocker.execute("BEGIN IMMEDIATE")
+    writer = SQLiteWriter(max_batches=10, linger_ms=200)
+    try:
+        futures = [writer.submit([(INSERT, (k, 1))]) for k in ("p", "q")]
+        for future in futures:
+            with pytest.raises(sqlite3.OperationalError):
+                future.result(5)
+    finally:
+        blocker.rollback()
+        blocker.close()
+    assert writer.stats()["failed_batches"] == 2
+    assert writer.stats()["transactions"] == 0
+
+    # 寫入執行緒仍在，鎖釋放後照常寫入
+    writer.write([(INSERT, ("r", 1))], timeout=5)
+    assert rows(writer_table) == {"r": 1}
+
+
+def test_empty_batches_are_not_queued():
+    writer = SQLiteWriter(max_batches=10, linger_ms=0)
+    assert writer.submit([(INSERT, None)]).result(0) is None
+    assert writer._thread is None
@@ -0,0 +1,91 @@
+#Jobs 佇列：認領順序、多 worker 同時認領、心跳逾時重新排隊
+import threading
+import pytest
+from config import settings
+from database import get_db_connection
+from services import job_service
+from services.job_service import claim_job, finish_job, heartbeat, requeue_stale_jobs
+
+
+@pytest.fixture
+def jobs(conn):
+    conn.execute("DELETE FROM Jobs")
+    conn.commit()
+    return conn
+
+
+def enqueue(conn, *job_ids, created_at="2026-01-01 00:00:00"):
+    for job_id in job_ids:
+        conn.execute(
+            "INSERT INTO Jobs (Id, Kind, Payload, Status, CreatedAt) VALUES (?, 'analyze', '{\"ticker\": \"AAPL\"}', 'queued', ?)",
+            (job_id, created_at),
+        )
+    conn.commit()
+
+
+def statuses(conn):
+    return dict(conn.execute("SELECT Id, Status FROM Jobs").fetchall())
+
+
+def test_claims_oldest_first_then_insertion_order(jobs):
+    enqueue(jobs, "late", created_at="2026-01-02 00:00:00")
+    enqueue(jobs, "b", "a", "c")
+    claimed = [claim_job(jobs, "w1") for _ in range(4)]
+    assert [job["id"] for job in claimed] == ["b", "a", "c", "late"]
+    assert claimed[0]["payload"] == {"ticker": "AAPL"}
+    assert claim_job(jobs, "w1") is None
+    assert jobs.execute("SELECT Attempts, WorkerId FROM Jobs WHERE Id = 'a'").fetchone() == (1, "w1")
+
+
+def test_concurrent_workers_never_claim_the_same_job(jobs):
+    job_ids = [f"j{i:03d}" for i in range(60)]
+    enqueue(jobs, *job_ids)
+    claimed = []
+    lock = threading.Lock()
+
+    def worker(name):
+        conn = get_db_connection()
+        try:
+            while (job := claim_job(conn, name)) is not None:
+                with lock:
+                    claimed.append(job["id"])
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(claimed) == job_ids
+
+
+def test_requeue_stale_jobs(jobs, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_STALE_SECONDS", 60)
+    monkeypatch.setattr(settings, "JOB_MAX_ATTEMPTS", 2)
+    enqueue(jobs, "lost", "exhausted", "alive", "finished")
+    for _ in range(4):
+        claim_job(jobs, "w1")
+    finish_job(jobs, "finished", "w1", result={"ok": True})
+    jobs.execute("UPDATE Jobs SET HeartbeatAt = datetime('now', '-10 minutes') WHERE Id <> 'alive'")
+    jobs.execute("UPDATE Jobs SET Attempts = 2 WHERE Id = 'exhausted'")
+    jobs.commit()
+    heartbeat(jobs, "alive", "w1")
+
+    assert requeue_stale_jobs(jobs) == 1
+    assert statuses(jobs) == {"lost": "queued", "exhausted": "failed", "alive": "running", "finished": "done"}
+    assert jobs.execute("SELECT WorkerId FROM Jobs WHERE Id = 'lost'").fetchone() == (None,)
+
+    # 重新排隊的工作可以再被認領，嘗試次數累加
+    job = claim_job(jobs, "w2")
+    assert job["id"] == "lost"
+    assert jobs.execute("SELECT Attempts FROM Jobs WHERE Id = 'lost'").fetchone() == (2,)
+
+
+def test_finish_job_ignores_other_workers(jobs):
+    enqueue(jobs, "x")
+    claim_job(jobs, "w1")
+    finish_job(jobs, "x", "w2", error="not mine")
+    assert statuses(jobs) == {"x": "running"}
+    finish_job(jobs, "x", "w1", error="boom")
+    assert job_service.get_job("x")["status"] == "failed"
@@ -0,0 +1,133 @@
+#Postgres 後端對真正的 Postgres 執行 (設定 TEST_DATABASE_URL 才會跑，需安裝 requirements-postgres.txt)
+#每次在獨立的 schema 建表，結束後整個刪除
+import os
+import uuid
+from types import SimpleNamespace
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+from psycopg2.extensions import make_dsn
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+
+
+@pytest.fixture(scope="module")
+def pg(tables):
+    import database
+    from common.db_backend import make_backend
+
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(TEST_DATABASE_URL)
+    admin.autocommit = True
+    admin.cursor().execute(f"CREATE SCHEMA {schema}")
+    backend = make_backend(SimpleNamespace(
+        DB_BACKEND="postgres",
+        DATABASE_URL=make_dsn(TEST_DATABASE_URL, options=f"-csearch_path={schema}"),
+        DB_POOL_MIN=1, DB_POOL_MAX=4, DB_BUSY_TIMEOUT=5,
+    ))
+    sqlite_backend = database.backend
+    database.backend = backend
+    try:
+        database.create_fundamental_tables()
+        yield backend
+    finally:
+        database.backend = sqlite_backend
+        backend._pool.closeall()
+        admin.cursor().execute(f"DROP SCHEMA {schema} CASCADE")
+        admin.close()
+
+
+@pytest.fixture
+def pg_conn(pg):
+    conn = pg.connect()
+    yield conn
+    conn.close()
+
+
+def test_insert_or_replace_becomes_upsert(pg_conn):
+    sql = "INSERT OR REPLACE INTO IngestLog (Stock_Id, Endpoint, FetchedAt) VALUES (?, ?, ?)"
+    pg_conn.execute(sql, ("AAPL", "OVERVIEW", "2026-01-01 00:00:00"))
+    pg_conn.execute(sql, ("AAPL", "OVERVIEW", "2026-02-01 00:00:00"))
+    pg_conn.execute("INSERT OR IGNORE INTO IngestLog (Stock_Id, Endpoint, FetchedAt) VALUES (?, ?, ?)",
+                    ("AAPL", "OVERVIEW", "2026-03-01 00:00:00"))
+    pg_conn.commit()
+    rows = pg_conn.execute("SELECT FetchedAt FROM IngestLog WHERE Stock_Id = ?", ("AAPL",)).fetchall()
+    assert rows == [("2026-02-01 00:00:00",)]
+
+
+def test_is_distinct_upsert_skips_unchanged_rows(pg, pg_conn):
+    sql = f'''
+        INSERT INTO CompanyInfoLatest (Stock_Id, UpdatedAt, DataKey, DataValue, NumValue) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(Stock_Id, DataKey) DO UPDATE SET
+            DataValue = excluded.DataValue, NumValue = excluded.NumValue, UpdatedAt = excluded.UpdatedAt
+        WHERE {pg.is_distinct("CompanyInfoLatest.DataValue", "excluded.DataValue")}
+    '''
+    pg_conn.execute(sql, ("MSFT", "2026-01-01", "Sector", None, None))
+    assert pg_conn.execute(sql, ("MSFT", "2026-01-02", "Sector", None, None)).rowcount == 0
+    assert pg_conn.execute(sql, ("MSFT", "2026-01-03", "Sector", "TECHNOLOGY", None)).rowcount == 1
+    assert pg_conn.execute(sql, ("MSFT", "2026-01-04", "Sector", "TECHNOLOGY", None)).rowcount == 0
+    pg_conn.commit()
+
+
+def test_string_literals_are_not_rewritten(pg_conn):
+    row = pg_conn.execute(
+        "SELECT 'it IS NOT what it IS', ? IS NULL, CAST(NULL AS TEXT) IS NOT NULL", ("x",)
+    ).fetchone()
+    assert row == ("it IS NOT what it IS", False, False)
+
+
+def test_datetime_now_offset(pg_conn):
+    past, now = pg_conn.execute(
+        "SELECT datetime('now', ?), CURRENT_TIMESTAMP", ("-120 seconds",)
+    ).fetchone()
+    assert len(past) == len(now) == 19
+    assert past < now
+
+
+def test_bulk_upsert_copy_keeps_last_duplicate(pg, pg_conn):
+    columns = ["Stock_Id", "StatementType", "Item", "ReportDate", "Value"]
+    rows = [
+        ("NVDA", "Income", "Total Revenue", "2025-01-31", 1.0),
+        ("NVDA", "Income", "Total Revenue", "2025-01-31", 2.0),
+        ("NVDA", "Income", "Net Income, \"adjusted\"", "2025-01-31", None),
+    ]
+    assert pg.bulk_upsert(pg_conn, "FinancialStatements", columns, rows) == 3
+    assert pg.bulk_upsert(pg_conn, "FinancialStatements", columns, rows[1:2]) == 1
+    pg_conn.commit()
+    got = pg_conn.execute(
+        "SELECT Item, Value FROM FinancialStatements WHERE Stock_Id = ? ORDER BY Item", ("NVDA",)
+    ).fetchall()
+    assert got == [("Net Income, \"adjusted\"", None), ("Total Revenue", 2.0)]
+
+
+def test_bulk_upsert_copy_bytes(pg, pg_conn):
+    pg_conn.execute("CREATE TABLE IF NOT EXISTS BlobTest (Id TEXT PRIMARY KEY, Body BLOB)")
+    pg.bulk_upsert(pg_conn, "BlobTest", ["Id", "Body"], [("a", b"\x00\xff,\n\"")])
+    pg_conn.commit()
+    body = pg_conn.execute("SELECT Body FROM BlobTest WHERE Id = ?", ("a",)).fetchone()[0]
+    assert bytes(body) == b"\x00\xff,\n\""
+
+
+def test_claim_job_order_and_requeue(pg_conn, monkeypatch):
+    from config import settings
+    from services.job_service import claim_job, requeue_stale_jobs
+
+    for job_id in ("j2", "j1", "j3"):
+        pg_conn.execute(
+            "INSERT INTO Jobs (Id, Kind, Payload, Status, CreatedAt) VALUES (?, 'analyze', '{}', 'queued', ?)",
+            (job_id, "2026-01-01 00:00:00"),
+        )
+    pg_conn.commit()
+
+    # 同一 CreatedAt 依插入順序 (rowid / ctid) 認領
+    assert [claim_job(pg_conn, "w1")["id"] for _ in range(3)] == ["j2", "j1", "j3"]
+    assert claim_job(pg_conn, "w1") is None
+
+    monkeypatch.setattr(settings, "JOB_MAX_ATTEMPTS", 2)
+    pg_conn.execute("UPDATE Jobs SET HeartbeatAt = ? WHERE Id IN ('j1', 'j2')", ("2000-01-01 00:00:00",))
+    pg_conn.execute("UPDATE Jobs SET Attempts = 2 WHERE Id = 'j2'")
+    pg_conn.commit()
+    assert requeue_stale_jobs(pg_conn) == 1
+    status = dict(pg_conn.execute("SELECT Id, Status FROM Jobs").fetchall())
+    assert status == {"j1": "queued", "j2": "failed", "j3": "running"}
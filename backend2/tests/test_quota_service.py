@@ -0,0 +1,114 @@
+#Alpha Vantage 配額：每日固定視窗、每分鐘 token bucket、跨程序共用的狀態檔
+import pytest
+from services import quota_service
+from services.quota_service import DailyWindow, QuotaExceeded, QuotaScheduler, SharedBucketState, TokenBucket
+
+DAY = 86400
+# 2026-01-01 00:00:00 UTC
+MIDNIGHT = 1767225600.0
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(MIDNIGHT + 10 * 3600)
+    monkeypatch.setattr(quota_service.time, "time", clock)
+    return clock
+
+
+def test_daily_window_does_not_refill_within_the_day(clock):
+    window = DailyWindow("per_day", 3)
+    for _ in range(3):
+        assert window.wait_time(clock()) == 0
+        window.consume()
+    # 一個 token bucket 到這時早已回補了一部分；固定視窗要等到下次重置
+    clock.now = MIDNIGHT + DAY - 60
+    assert window.wait_time(clock()) == 60
+    clock.now = MIDNIGHT + DAY
+    assert window.wait_time(clock()) == 0
+    assert window.describe(clock())["remaining"] == 3
+
+
+def test_daily_window_reset_hour(clock):
+    window = DailyWindow("per_day", 1, reset_hour=8)
+    assert window.window == MIDNIGHT + 8 * 3600
+    window.consume()
+    clock.now = MIDNIGHT + DAY + 7 * 3600
+    assert window.wait_time(clock()) == 3600
+    clock.now = MIDNIGHT + DAY + 8 * 3600
+    assert window.wait_time(clock()) == 0
+
+
+def test_daily_window_unlimited(clock):
+    window = DailyWindow("per_day", 0)
+    for _ in range(100):
+        window.consume()
+    assert window.wait_time(clock()) == 0
+    assert window.describe(clock())["remaining"] is None
+
+
+def test_token_bucket_refills_at_rate(clock):
+    bucket = TokenBucket("per_minute", 5, 60)
+    for _ in range(5):
+        bucket.consume()
+    assert bucket.wait_time(clock()) == pytest.approx(12)
+    clock.now += 30
+    assert bucket.wait_time(clock()) == 0
+    assert int(bucket.tokens) == 2
+
+
+def test_scheduler_rejects_when_day_is_used_up(clock):
+    scheduler = QuotaScheduler([TokenBucket("per_minute", 0, 60), DailyWindow("per_day", 2)])
+    scheduler.acquire(timeout=0)
+    scheduler.acquire(timeout=0)
+    with pytest.raises(QuotaExceeded):
+        scheduler.acquire(timeout=1)
+    assert (scheduler.granted, scheduler.rejected) == (2, 1)
+
+
+def test_report_throttled_only_drains_daily_when_asked(clock):
+    minute, day = TokenBucket("per_minute", 5, 60), DailyWindow("per_day", 10)
+    scheduler = QuotaScheduler([minute, day])
+    scheduler.report_throttled()
+    assert minute.tokens == 0 and day.used == 0
+    scheduler.report_throttled(daily=True)
+    assert day.used == 10
+
+
+def test_shared_state_is_used_by_every_scheduler(clock, tmp_path):
+    path = str(tmp_path / "quota.json")
+
+    def process():
+        # 每個程序有自己的 bucket 物件，共用同一個狀態檔
+        return QuotaScheduler([TokenBucket("per_minute", 0, 60), DailyWindow("per_day", 3)], SharedBucketState(path))
+
+    first, second = process(), process()
+    first.acquire(timeout=0)
+    second.acquire(timeout=0)
+    first.acquire(timeout=0)
+    with pytest.raises(QuotaExceeded):
+        second.acquire(timeout=0)
+
+    # 重新啟動後沿用同一視窗的用量
+    restarted = process()
+    assert restarted.status()["buckets"]["per_day"]["remaining"] == 0
+    clock.now = MIDNIGHT + DAY
+    restarted.acquire(timeout=0)
+    assert restarted.status()["buckets"]["per_day"]["used"] == 1
+
+
+def test_status_does_not_write_state(clock, tmp_path):
+    path = tmp_path / "quota.json"
+    scheduler = QuotaScheduler([DailyWindow("per_day", 3)], SharedBucketState(str(path)))
+    scheduler.acquire(timeout=0)
+    before = path.read_text()
+    clock.now = MIDNIGHT + DAY
+    assert scheduler.status()["buckets"]["per_day"]["remaining"] == 3
+    assert path.read_text() == before
@@ -0,0 +1,71 @@
+#common.ratio_engine：單檔 (evaluate_ratios) 與多檔一次計算 (evaluate_ratios_grouped / ratio_batch) 結果相同
+import numpy as np
+import pandas as pd
+import pytest
+from common.ratio_engine import Ratio, evaluate_ratios, evaluate_ratios_grouped, yoy
+from services import data_service
+from services.ratio_batch import compute_ratio_batch
+
+
+def keyed(rows):
+    return {(r[0], r[1], r[3]): r for r in rows}
+
+
+def assert_same_rows(actual, expected):
+    actual, expected = keyed(actual), keyed(expected)
+    assert set(actual) == set(expected)
+    for key, row in expected.items():
+        assert actual[key][2] == row[2] and actual[key][5] == row[5]
+        assert actual[key][4] == pytest.approx(row[4], rel=1e-12)
+
+
+def test_batch_matches_single_ticker(statements, conn):
+    single = []
+    for ticker in statements:
+        single.extend(data_service.compute_financial_ratios(ticker, conn))
+    assert single
+    assert_same_rows(compute_ratio_batch(statements), single)
+
+
+def test_grouped_matches_single_for_shared_frames():
+    years = [2021, 2022, 2023]
+    income = pd.DataFrame(
+        {"Total Revenue": [100.0, 0.0, 150.0], "Net Income": [10.0, 5.0, np.nan]}, index=years
+    )
+    balance = pd.DataFrame({"Total Equity Gross Minority Interest": [50.0, -20.0, 60.0]}, index=years)
+    frames = {"income": income, "balance": balance, "cash": pd.DataFrame()}
+
+    grouped = {
+        key: pd.concat({"AAA": df, "BBB": df * 2}, names=["Stock_Id", "ReportYear"]) if not df.empty else df
+        for key, df in frames.items()
+    }
+    rows = evaluate_ratios_grouped(grouped, grouped["income"].index, data_service.ANNUAL_RATIOS)
+    expected = (evaluate_ratios("AAA", frames, years, data_service.ANNUAL_RATIOS)
+                + evaluate_ratios("BBB", {k: df * 2 for k, df in frames.items()}, years, data_service.ANNUAL_RATIOS))
+    assert_same_rows(rows, expected)
+
+
+def test_guards_and_missing_values():
+    registry = [
+        Ratio("P", "Margin", ("income", "Net Income"), ("income", "Total Revenue"), "NI / Rev"),
+        Ratio("P", "ROE", ("income", "Net Income"), ("balance", "Equity"), "NI / Eq", guard="positive"),
+        Ratio("P", "Missing", ("income", "Gross Profit"), ("income", "Total Revenue"), "GP / Rev"),
+        yoy("G", "Growth", ("income", "Total Revenue")),
+    ]
+    income = pd.DataFrame({"Total Revenue": [100.0, 0.0, 200.0], "Net Income": [10.0, 5.0, np.nan]},
+                          index=[2020, 2021, 2023])
+    balance = pd.DataFrame({"Equity": [50.0, -1.0, 10.0]}, index=[2020, 2021, 2023])
+    rows = keyed(evaluate_ratios("X", {"income": income, "balance": balance}, income.index, registry))
+
+    assert rows[("X", 2020, "Margin")][4] == pytest.approx(0.1)
+    assert ("X", 2021, "Margin") not in rows       # 分母為 0
+    assert ("X", 2023, "Margin") not in rows       # 分子為 NaN
+    assert ("X", 2021, "ROE") not in rows          # guard='positive'
+    assert not any(k[2] == "Missing" for k in rows)  # 缺少的分子不當成 0
+    assert ("X", 2021, "Growth") in rows and rows[("X", 2021, "Growth")][4] == pytest.approx(-1.0)
+    assert ("X", 2023, "Growth") not in rows       # 前一年度 (2022) 不在報表中
+
+
+def test_registry_is_required():
+    with pytest.raises(TypeError):
+        evaluate_ratios("X", {}, [2020])
@@ -0,0 +1,63 @@
+#對外提供的比率 (read_ratio_rows，直接讀 FinancialRatios) 與比率引擎即時計算的結果一致
+import pytest
+from common.ratio_engine import evaluate_ratios
+from common.statement_store import refresh_statement_pivots
+from services import data_service
+
+
+def engine_rows(ticker, conn):
+    income, balance, cash = data_service.get_dataframes_from_db(ticker, conn)
+    return evaluate_ratios(ticker, {"income": income, "balance": balance, "cash": cash}, income.index,
+                           data_service.ANNUAL_RATIOS)
+
+
+def assert_served_matches_engine(ticker, conn):
+    expected = {(r[1], r[3]): r for r in engine_rows(ticker, conn)}
+    served = {(r["ReportYear"], r["RatioName"]): r for r in data_service.read_ratio_rows(ticker, conn)
+              if r["Category"] != "TTM"}
+    assert expected and set(served) == set(expected)
+    for key, row in expected.items():
+        assert served[key]["Category"] == row[2]
+        assert served[key]["Formula"] == row[5]
+        assert served[key]["RatioValue"] == pytest.approx(row[4], rel=1e-12)
+
+
+def test_served_ratios_match_engine(statements, conn):
+    for ticker in statements:
+        data_service.calculate_financial_ratios(ticker, conn)
+        assert_served_matches_engine(ticker, conn)
+
+
+def test_served_ratios_follow_statement_changes(statements, conn):
+    ticker = statements[0]
+    data_service.calculate_financial_ratios(ticker, conn)
+    conn.execute(
+        "UPDATE FinancialStatements SET Value = Value * 3 + 7 WHERE Stock_Id = ? AND StatementType = 'Income' AND ReportDate LIKE '2022%'",
+        (ticker,),
+    )
+    refresh_statement_pivots(ticker, conn)
+    conn.commit()
+
+    # 只有 2022 / 2023 (成長率用到 2022) 的指紋改變，其餘年度沿用
+    data_service.calculate_financial_ratios(ticker, conn)
+    assert_served_matches_engine(ticker, conn)
+
+
+def test_only_latest_ttm_is_served(statements, conn):
+    ticker = statements[1]
+    data_service.calculate_financial_ratios(ticker, conn)
+    ttm = [r for r in data_service.read_ratio_rows(ticker, conn) if r["Category"] == "TTM"]
+    assert ttm
+    latest = ttm[0]["ReportYear"]
+    conn.execute(
+        "INSERT INTO FinancialRatios (Stock_Id, ReportYear, Category, RatioName, RatioValue, Formula) VALUES (?, ?, 'TTM', 'Stale (TTM)', 1, 'x')",
+        (ticker, latest - 1),
+    )
+    conn.commit()
+    served = data_service.read_ratio_rows(ticker, conn)
+    assert {r["ReportYear"] for r in served if r["Category"] == "TTM"} == {latest}
+
+
+def test_ratio_views_are_gone(tables, conn):
+    names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'view'").fetchall()}
+    assert "FinancialRatiosView" not in names and "StatementYearsView" not in names
@@ -0,0 +1,76 @@
+#背景工作 worker (多程序)
+#用法: python worker.py --processes 4
+import argparse
+import os
+import socket
+import threading
+import time
+import traceback
+from multiprocessing import Process
+from database import get_db_connection, create_fundamental_tables
+from config import settings
+from services.job_service import claim_job, heartbeat, finish_job, requeue_stale_jobs, run_job
+
+
+def _heartbeat_loop(job_id, worker_id, stop):
+    conn = get_db_connection()
+    try:
+        while not stop.wait(settings.JOB_HEARTBEAT_SECONDS):
+            heartbeat(conn, job_id, worker_id)
+    finally:
+        conn.close()
+
+
+def worker_loop(index):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+    print(f"👷 Worker {worker_id} 啟動")
+    conn = get_db_connection()
+    last_reap = 0.0
+    try:
+        while True:
+            if time.monotonic() - last_reap > settings.JOB_HEARTBEAT_SECONDS:
+                requeued = requeue_stale_jobs(conn)
+                if requeued:
+                    print(f"♻️ 重新排隊 {requeued} 個逾時工作")
+                last_reap = time.monotonic()
+
+            job = claim_job(conn, worker_id)
+            if not job:
+                time.sleep(settings.JOB_POLL_SECONDS)
+                continue
+
+            print(f"▶️ [{worker_id}] {job['kind']} {job['payload']} ({job['id']})")
+            stop = threading.Event()
+            beat = threading.Thread(target=_heartbeat_loop, args=(job["id"], worker_id, stop), daemon=True)
+            beat.start()
+            try:
+                result = run_job(job["kind"], job["payload"])
+                finish_job(conn, job["id"], worker_id, result=result)
+                print(f"✅ [{worker_id}] 完成 {job['id']}")
+            except Exception as e:
+                traceback.print_exc()
+                finish_job(conn, job["id"], worker_id, error=str(e))
+            finally:
+                stop.set()
+                beat.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background job workers.")
+    parser.add_argument("--processes", type=int, default=settings.JOB_WORKERS)
+    args = parser.parse_args()
+
+    create_fundamental_tables()
+    procs = [Process(target=worker_loop, args=(i,)) for i in range(args.processes)]
+    for p in procs:
+        p.start()
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.join()
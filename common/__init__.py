@@ -0,0 +1,2 @@
+#backend 與 backend2 共用的模組 (兩個後端的 config.py 會把 repo 根目錄加進 sys.path)
+#這些模組仍以 `from config import settings` / `from database import ...` 取得目前執行中後端的設定與資料庫
@@ -0,0 +1,393 @@
+#資料庫後端：預設 SQLite 本機檔案；設定 DB_BACKEND=postgres 時改用 Postgres 連線池 (多 worker / 多主機)
+#服務層一律寫 SQLite 語法 (? 參數、INSERT OR REPLACE...)，Postgres 後端在執行前轉譯；
+#兩種方言寫法不同、無法安全轉譯的運算 (例如 NULL 安全比較) 由後端物件提供，例如 backend.is_distinct()
+import csv
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import threading
+import warnings
+
+
+class PooledConnection(sqlite3.Connection):
+    """close() 不真的關閉，而是歸還給目前執行緒的閒置池，下次 get_db_connection() 直接重用"""
+    backend = None
+
+    def close(self):
+        self.backend.release(self)
+
+    def _really_close(self):
+        sqlite3.Connection.close(self)
+
+
+class Stats:
+    """執行緒安全的計數器 (寫入端 count，讀取端 snapshot 取得一致的複本)"""
+    def __init__(self, **counters):
+        self._lock = threading.Lock()
+        self._counters = counters
+
+    def count(self, **deltas):
+        with self._lock:
+            for k, v in deltas.items():
+                self._counters[k] += v
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+class SQLiteBackend:
+    dialect = "sqlite"
+
+    def __init__(self, settings):
+        self.settings = settings
+        self._local = threading.local()
+        self._stats = Stats(created=0, reused=0, released=0, discarded=0, active=0, idle=0)
+
+    def _idle_list(self):
+        # fork 出來的子程序 (worker.py) 不能沿用父程序的連線
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.pid = os.getpid()
+            self._local.idle = []
+        return self._local.idle
+
+    def _new_connection(self):
+        s = self.settings
+        conn = sqlite3.connect(s.DB_NAME, timeout=s.DB_BUSY_TIMEOUT, factory=PooledConnection)
+        conn.backend = self
+        # WAL：讀取不會被寫入阻擋；NORMAL 在 WAL 下仍保證一致性
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{s.DB_CACHE_SIZE_MB * 1024}")
+        conn.execute(f"PRAGMA mmap_size={s.DB_MMAP_SIZE_MB * 1024 * 1024}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def connect(self):
+        """
+        優先重用本執行緒歸還的閒置連線 (sqlite3 連線不跨執行緒共用)。
+        同一執行緒巢狀呼叫會拿到不同的連線，不會互相影響交易。
+        """
+        idle = self._idle_list()
+        if idle:
+            conn = idle.pop()
+            self._stats.count(reused=1, active=1, idle=-1)
+        else:
+            conn = self._new_connection()
+            self._stats.count(created=1, active=1)
+        conn.in_pool = False
+        return conn
+
+    def release(self, conn):
+        if getattr(conn, "in_pool", True):
+            return  # 重複 close()
+        conn.in_pool = True
+        # 沒 commit 的變更照 sqlite3 close() 的語意丟棄
+        if conn.in_transaction:
+            conn.rollback()
+        idle = self._idle_list()
+        if len(idle) < self.settings.DB_POOL_MAX_IDLE_PER_THREAD:
+            idle.append(conn)
+            self._stats.count(released=1, active=-1, idle=1)
+        else:
+            conn._really_close()
+            self._stats.count(discarded=1, active=-1)
+
+    def stats(self):
+        stats = self._stats.snapshot()
+        lookups = stats["created"] + stats["reused"]
+        stats["reuse_ratio"] = round(stats["reused"] / lookups, 3) if lookups else 0.0
+        stats["backend"] = self.dialect
+        return stats
+
+    @staticmethod
+    def is_distinct(a, b):
+        """NULL 安全的「不相等」"""
+        return f"{a} IS NOT {b}"
+
+    def bulk_upsert(self, conn, table, columns, rows):
+        placeholders = ", ".join("?" for _ in columns)
+        conn.executemany(f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+        return len(rows)
+
+
+# ---------------------------------------------------------------------------
+# Postgres
+# ---------------------------------------------------------------------------
+_PG_NOW = "(to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'))"
+_INSERT_OR = re.compile(r"^\s*INSERT\s+OR\s+(REPLACE|IGNORE)\s+INTO\s+(\w+)\s*\(([^)]*)\)(.*?);?\s*$", re.I | re.S)
+_SKIP = re.compile(r"^\s*(BEGIN|PRAGMA)\b", re.I)
+_IDENT = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+class PgCursor:
+    def __init__(self, conn):
+        self._conn = conn
+        self._raw = conn.raw.cursor()
+        self._sql = ""
+
+    def _params(self, params):
+        return params if params else None
+
+    def execute(self, sql, params=None):
+        self._sql = sql
+        translated = self._conn.backend.translate(self._conn.raw, sql, bool(params))
+        if translated is not None:
+            self._raw.execute(translated, self._params(params))
+        return self
+
+    def executemany(self, sql, seq):
+        self._sql = sql
+        seq = list(seq)
+        translated = self._conn.backend.translate(self._conn.raw, sql, True)
+        if translated is not None and seq:
+            self._raw.executemany(translated, seq)
+        return self
+
+    @property
+    def description(self):
+        # Postgres 把未加引號的識別字轉成小寫，還原成查詢 / 建表時的大小寫，讓 DataFrame 欄名與 SQLite 一致
+        if self._raw.description is None:
+            return None
+        return [(self._conn.backend.restore_case(d[0], self._sql),) + tuple(d[1:]) for d in self._raw.description]
+
+    @property
+    def rowcount(self):
+        return self._raw.rowcount
+
+    def fetchone(self):
+        return self._raw.fetchone()
+
+    def fetchall(self):
+        return self._raw.fetchall()
+
+    def fetchmany(self, size=None):
+        return self._raw.fetchmany(size) if size else self._raw.fetchmany()
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def close(self):
+        self._raw.close()
+
+
+class PgConnection:
+    """介面與 sqlite3.Connection 相同的子集 (execute / cursor / commit / close...)"""
+    def __init__(self, backend, raw):
+        self.backend = backend
+        self.raw = raw
+        self.in_pool = False
+
+    def cursor(self):
+        return PgCursor(self)
+
+    def execute(self, sql, params=None):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.cursor().executemany(sql, seq)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    @property
+    def in_transaction(self):
+        from psycopg2 import extensions
+        return self.raw.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.backend.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+
+class PostgresBackend:
+    dialect = "postgres"
+
+    def __init__(self, settings):
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._slots = None
+        self._keys = {}
+        self._identifiers = {}
+        self._translated = {}
+        self._stats = Stats(acquired=0, released=0, waits=0, active=0)
+        # pd.read_sql 對非 SQLAlchemy 連線會警告；PgConnection 實作了它用到的 DB-API 子集
+        warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy")
+
+    def _ensure_pool(self):
+        if self._pool is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                return
+            try:
+                from psycopg2.pool import ThreadedConnectionPool
+            except ImportError as e:
+                raise RuntimeError("DB_BACKEND=postgres requires psycopg2 (pip install psycopg2-binary)") from e
+            s = self.settings
+            self._pool = ThreadedConnectionPool(s.DB_POOL_MIN, s.DB_POOL_MAX, s.DATABASE_URL)
+            self._slots = threading.BoundedSemaphore(s.DB_POOL_MAX)
+            self._pid = os.getpid()
+
+    def connect(self):
+        self._ensure_pool()
+        if not self._slots.acquire(blocking=False):
+            self._stats.count(waits=1)
+            if not self._slots.acquire(timeout=self.settings.DB_BUSY_TIMEOUT):
+                raise TimeoutError("Postgres connection pool exhausted")
+        try:
+            raw = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        self._stats.count(acquired=1, active=1)
+        return PgConnection(self, raw)
+
+    def release(self, conn):
+        if conn.in_pool:
+            return
+        conn.in_pool = True
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.putconn(conn.raw, close=bool(conn.raw.closed))
+        finally:
+            self._slots.release()
+            self._stats.count(released=1, active=-1)
+
+    def stats(self):
+        stats = self._stats.snapshot()
+        stats["backend"] = self.dialect
+        stats["max_connections"] = self.settings.DB_POOL_MAX
+        return stats
+
+    @staticmethod
+    def is_distinct(a, b):
+        """NULL 安全的「不相等」(SQLite 的 IS NOT)"""
+        return f"{a} IS DISTINCT FROM {b}"
+
+    # --- 語法轉譯 -----------------------------------------------------------
+    def conflict_keys(self, raw, table):
+        """表格的唯一鍵 (有 sno 這類流水號主鍵時取 UNIQUE 約束)，供 ON CONFLICT 使用"""
+        table = table.lower()
+        if table not in self._keys:
+            with raw.cursor() as cur:
+                cur.execute('''
+                    SELECT i.indisprimary, array_agg(a.attname ORDER BY array_position(i.indkey, a.attnum))
+                    FROM pg_index i
+                    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+                    WHERE i.indrelid = to_regclass(%s) AND i.indisunique
+                    GROUP BY i.indexrelid, i.indisprimary
+                ''', (table,))
+                candidates = cur.fetchall()
+            if not candidates:
+                raise ValueError(f"No unique key on {table}")
+            # 流水號主鍵 (單欄、非業務鍵) 排在最後
+            candidates.sort(key=lambda c: (c[0] and len(c[1]) == 1, -len(c[1])))
+            self._keys[table] = list(candidates[0][1])
+        return self._keys[table]
+
+    def _upsert(self, raw, table, columns, rest, ignore):
+        keys = self.conflict_keys(raw, table)
+        updates = [c for c in columns if c.lower() not in keys]
+        if ignore or not updates:
+            return f"INSERT INTO {table} ({', '.join(columns)}){rest} ON CONFLICT DO NOTHING"
+        assignments = ", ".join(f"{c} = EXCLUDED.{c}" for c in updates)
+        return f"INSERT INTO {table} ({', '.join(columns)}){rest} ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {assignments}"
+
+    def translate(self, raw, sql, has_params):
+        cache_key = (sql, has_params)
+        if cache_key in self._translated:
+            return self._translated[cache_key]
+        for ident in _IDENT.findall(sql):
+            self._identifiers.setdefault(ident.lower(), ident)
+
+        if _SKIP.match(sql):
+            out = None  # psycopg2 自動開始交易；PRAGMA 只對 SQLite 有意義
+        else:
+            out = sql
+            if re.match(r"^\s*CREATE\s+TABLE", out, re.I):
+                out = re.sub(r"\bINTEGER PRIMARY KEY AUTOINCREMENT\b", "BIGSERIAL PRIMARY KEY", out)
+                out = re.sub(r"\)\s*WITHOUT ROWID", ")", out)
+                # 日期沿用 SQLite 的 ISO 字串，讓字串比較與 fromisoformat() 行為一致
+                out = re.sub(r"\b(DATETIME|DATE)\b", "TEXT", out)
+                out = re.sub(r"\bREAL\b", "DOUBLE PRECISION", out)
+                out = re.sub(r"\bBLOB\b", "BYTEA", out)
+            m = _INSERT_OR.match(out)
+            if m:
+                mode, table, cols, rest = m.groups()
+                columns = [c.strip() for c in cols.split(",")]
+                out = self._upsert(raw, table, columns, rest.rstrip(), mode.upper() == "IGNORE")
+            out = re.sub(r"datetime\('now',\s*\?\)", "to_char(now() AT TIME ZONE 'UTC' + CAST(? AS INTERVAL), 'YYYY-MM-DD HH24:MI:SS')", out)
+            out = re.sub(r"\bCURRENT_TIMESTAMP\b", _PG_NOW, out)
+            out = re.sub(r"\browid\b", "ctid", out)
+            if has_params:
+                out = out.replace("%", "%%").replace("?", "%s")
+        self._translated[cache_key] = out
+        return out
+
+    def restore_case(self, name, sql):
+        for ident in _IDENT.findall(sql):
+            if ident.lower() == name:
+                return ident
+        return self._identifiers.get(name, name)
+
+    # --- 大量寫入 -----------------------------------------------------------
+    @staticmethod
+    def _copy_value(value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return "\\x" + bytes(value).hex()
+        return value
+
+    def bulk_upsert(self, conn, table, columns, rows):
+        """COPY 進暫存表後一次 INSERT ... ON CONFLICT 合併 (同鍵多筆時以最後一筆為準)"""
+        if not rows:
+            return 0
+        raw = conn.raw
+        keys = self.conflict_keys(raw, table)
+        cols = ", ".join(columns)
+        tmp = f"_bulk_{table.lower()}_{hashlib.md5(cols.encode()).hexdigest()[:8]}"
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for row in rows:
+            writer.writerow([self._copy_value(v) for v in row])
+        buf.seek(0)
+
+        updates = [c for c in columns if c.lower() not in keys]
+        conflict = (
+            f"DO UPDATE SET {', '.join(f'{c} = EXCLUDED.{c}' for c in updates)}" if updates else "DO NOTHING"
+        )
+        with raw.cursor() as cur:
+            cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {tmp} ON COMMIT DELETE ROWS AS SELECT {cols} FROM {table} WITH NO DATA")
+            cur.copy_expert(f"COPY {tmp} ({cols}) FROM STDIN WITH (FORMAT csv)", buf)
+            cur.execute(f'''
+                INSERT INTO {table} ({cols})
+                SELECT DISTINCT ON ({', '.join(keys)}) {cols} FROM {tmp} ORDER BY {', '.join(keys)}, ctid DESC
+                ON CONFLICT ({', '.join(keys)}) {conflict}
+            ''')
+            cur.execute(f"TRUNCATE {tmp}")
+        return len(rows)
+
+
+def make_backend(settings):
+    if settings.DB_BACKEND == "postgres":
+        return PostgresBackend(settings)
+    if settings.DB_BACKEND != "sqlite":
+        raise ValueError(f"Unknown DB_BACKEND: {settings.DB_BACKEND}")
+    return SQLiteBackend(settings)
@@ -0,0 +1,117 @@
+#Fama-French 因子本地快取 (月 / 日)：每月更新一次，估值時直接讀記憶體
+import datetime as dt
+import threading
+import time
+import pandas as pd
+import pandas_datareader.data as web
+from database import get_db_connection, bulk_upsert
+from config import settings
+
+FF_DATASETS = {
+    "monthly": "F-F_Research_Data_Factors",
+    "daily": "F-F_Research_Data_Factors_daily",
+}
+FACTOR_COLUMNS = ["Mkt-RF", "SMB", "HML", "RF"]
+
+_memory = {}  # dataset -> (loaded_at, vintage, DataFrame)
+_lock = threading.Lock()
+
+
+def _is_stale(row):
+    """
+    row = (Vintage, FetchedAt, CheckedAt)。
+    French 資料庫約在月中發布上個月的因子，所以：
+    - 已有上個月的資料 -> 直到超過 FF_MAX_AGE_DAYS 才重抓 (吸收官方修正)
+    - 還沒有 -> 每 FF_RECHECK_HOURS 檢查一次是否已發布
+    """
+    if not row:
+        return True
+    vintage, fetched_at, checked_at = row
+    now = dt.datetime.now()
+    if now - dt.datetime.fromisoformat(fetched_at) > dt.timedelta(days=settings.FF_MAX_AGE_DAYS):
+        return True
+    expected = (now.date().replace(day=1) - dt.timedelta(days=1)).replace(day=1)
+    if dt.date.fromisoformat(vintage) >= expected:
+        return False
+    return now - dt.datetime.fromisoformat(checked_at) > dt.timedelta(hours=settings.FF_RECHECK_HOURS)
+
+
+def _download(dataset):
+    """下載完整歷史 (官方為百分比，轉成小數)"""
+    ff = web.DataReader(FF_DATASETS[dataset], "famafrench", start="1926-01-01")[0] / 100
+    index = ff.index.to_timestamp() if isinstance(ff.index, pd.PeriodIndex) else pd.to_datetime(ff.index)
+    ff.index = index
+    return ff[FACTOR_COLUMNS].dropna()
+
+
+def refresh_factors(dataset, force=False):
+    """必要時重新下載並整批替換；回傳目前的 vintage (最後一期日期)"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT Vintage, FetchedAt, CheckedAt FROM FactorVintage WHERE Dataset = ?", (dataset,))
+        row = cursor.fetchone()
+        if not force and not _is_stale(row):
+            return row[0]
+
+        now = dt.datetime.now().isoformat(timespec="seconds")
+        try:
+            ff = _download(dataset)
+        except Exception as e:
+            if not row:
+                raise
+            # 下載失敗時沿用舊資料，並記錄檢查時間避免每次估值都重試
+            print(f"⚠️ Fama-French ({dataset}) 更新失敗，沿用 vintage {row[0]}: {e}")
+            conn.execute("UPDATE FactorVintage SET CheckedAt = ? WHERE Dataset = ?", (now, dataset))
+            conn.commit()
+            return row[0]
+
+        vintage = ff.index.max().strftime("%Y-%m-%d")
+        conn.execute("DELETE FROM FactorReturns WHERE Dataset = ?", (dataset,))
+        bulk_upsert(
+            conn, "FactorReturns", ["Dataset", "Period", "MktRF", "SMB", "HML", "RF"],
+            [(dataset, d.strftime("%Y-%m-%d"), *vals) for d, vals in zip(ff.index, ff.itertuples(index=False, name=None))],
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO FactorVintage (Dataset, Vintage, Rows, FetchedAt, CheckedAt) VALUES (?, ?, ?, ?, ?)",
+            (dataset, vintage, len(ff), now, now),
+        )
+        conn.commit()
+        print(f"📥 Fama-French ({dataset}) 已更新: {len(ff)} 筆，資料至 {vintage}")
+        return vintage
+    finally:
+        conn.close()
+
+
+def _load(dataset):
+    conn = get_db_connection()
+    try:
+        df = pd.read_sql(
+            "SELECT Period, MktRF, SMB, HML, RF FROM FactorReturns WHERE Dataset = ? ORDER BY Period",
+            conn, params=(dataset,), parse_dates=["Period"],
+        )
+    finally:
+        conn.close()
+    df = df.set_index("Period")
+    df.columns = FACTOR_COLUMNS
+    return df
+
+
+def get_factors(dataset="monthly", start=None, end=None):
+    """
+    回傳 (DataFrame, vintage)；DataFrame 欄位為 Mkt-RF / SMB / HML / RF (小數)。
+    記憶體中的副本每 FF_RECHECK_HOURS 才回頭確認一次是否需要更新。
+    """
+    if dataset not in FF_DATASETS:
+        raise ValueError(f"Unknown Fama-French dataset: {dataset}")
+    with _lock:
+        cached = _memory.get(dataset)
+        if cached is None or time.monotonic() - cached[0] > settings.FF_RECHECK_HOURS * 3600:
+            vintage = refresh_factors(dataset)
+            if cached is None or cached[1] != vintage:
+                cached = (time.monotonic(), vintage, _load(dataset))
+            else:
+                cached = (time.monotonic(), vintage, cached[2])
+            _memory[dataset] = cached
+    _, vintage, df = cached
+    return df.loc[start:end].copy(), vintage
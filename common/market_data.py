@@ -0,0 +1,78 @@
+#統一的市場數據來源 (yfinance)：請求內記憶化 + 跨程序 TTL 快取
+#所有 service 都透過這裡取 yfinance 數據，不要直接呼叫 yf.Ticker(...).info 等
+import contextlib
+import contextvars
+import pandas as pd
+import yfinance as yf
+from config import settings
+from common.response_cache import response_cache
+
+INFO_TTL = settings.CACHE_TTL_INFO_HOURS * 3600
+STATEMENTS_TTL = settings.CACHE_TTL_STATEMENTS_HOURS * 3600
+HISTORY_TTL = settings.CACHE_TTL_HISTORY_HOURS * 3600
+
+_request_memo = contextvars.ContextVar("market_data_memo", default=None)
+
+
+@contextlib.contextmanager
+def request_scope():
+    """同一個請求 (或一次估值流程) 內，相同查詢只會讀一次快取/網路；可巢狀使用"""
+    token = _request_memo.set({}) if _request_memo.get() is None else None
+    try:
+        yield
+    finally:
+        if token is not None:
+            _request_memo.reset(token)
+
+
+def _fetch(namespace, ttl, fetch, *parts, **kwargs):
+    memo = _request_memo.get()
+    key = response_cache.make_key(namespace, *parts, **kwargs)
+    if memo is not None and key in memo:
+        value = memo[key]
+    else:
+        value = response_cache.cached(namespace, ttl, fetch, *parts, **kwargs)
+        if memo is not None:
+            memo[key] = value
+    # 呼叫端常會就地修改 DataFrame (例如改欄位型別)，回傳副本避免污染記憶化的內容
+    if isinstance(value, pd.DataFrame):
+        return value.copy()
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+
+def get_info(ticker):
+    return _fetch("yf.info", INFO_TTL, lambda: yf.Ticker(ticker).info, ticker)
+
+
+def get_financials(ticker):
+    return _fetch("yf.financials", STATEMENTS_TTL, lambda: yf.Ticker(ticker).financials, ticker)
+
+
+def get_balance_sheet(ticker):
+    return _fetch("yf.balance_sheet", STATEMENTS_TTL, lambda: yf.Ticker(ticker).balance_sheet, ticker)
+
+
+def get_cashflow(ticker):
+    return _fetch("yf.cashflow", STATEMENTS_TTL, lambda: yf.Ticker(ticker).cashflow, ticker)
+
+
+def get_history(ticker, ttl=None, **kwargs):
+    """yf.Ticker.history；start/end 請傳日期字串，讓快取 key 穩定"""
+    ttl = HISTORY_TTL if ttl is None else ttl
+    return _fetch("yf.history", ttl, lambda: yf.Ticker(ticker).history(**kwargs), ticker, **kwargs)
+
+
+def download(tickers, **kwargs):
+    """yf.download (多檔 OHLCV)"""
+    tickers = list(tickers)
+    return _fetch(
+        "yf.download", HISTORY_TTL,
+        lambda: yf.download(tickers, progress=False, **kwargs),
+        tickers, **kwargs
+    )
+
+
+def get_industry_top_companies(industry_key):
+    return _fetch("yf.industry.top_companies", INFO_TTL, lambda: yf.Industry(industry_key).top_companies, industry_key)
@@ -0,0 +1,108 @@
+#宣告式財務比率：每個比率只宣告一次，所有年度以整欄陣列運算一次算完；YoY 讀取前一年度的落後欄位
+#比率清單 (registry) 由各後端的 data_service.ANNUAL_RATIOS 宣告
+from typing import NamedTuple, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+
+class Ratio(NamedTuple):
+    """
+    numerator / denominator 為 (報表, 科目)，報表為 'income' / 'balance' / 'cash'。
+    yoy=True 時不用 denominator，值為 (本期 - 前一年度) / |前一年度|。
+    guard: 'nonzero' (分母 != 0) 或 'positive' (分母 > 0)；YoY 的分母為前一年度的值。
+    """
+    category: str
+    name: str
+    numerator: Tuple[str, str]
+    denominator: Optional[Tuple[str, str]]
+    formula: str
+    guard: str = "nonzero"
+    scale: float = 1.0
+    yoy: bool = False
+
+
+def yoy(category, name, item, formula="YoY", guard="nonzero"):
+    return Ratio(category, name, item, None, formula, guard, yoy=True)
+
+
+# 計算規則 (缺值處理等) 改變時遞增，讓既有的比率輸入指紋失效
+RULES_VERSION = 2
+
+
+def _column(frames, key, years, fill):
+    """取出 years 對應的科目值；整個科目或整個年度不存在時補 fill (None 為 NaN)，報表內的空值維持 NaN"""
+    stmt, item = key
+    df = frames.get(stmt)
+    if df is None or df.empty or item not in df.columns:
+        return np.full(len(years), np.nan if fill is None else fill)
+    values = df[item].reindex(years).to_numpy(dtype=np.float64, copy=True)
+    if fill is not None:
+        values[~years.isin(df.index)] = fill
+    return values
+
+
+def _evaluate(frames, keys, prev_keys, registry, fill):
+    """逐比率產生 (比率, 有效位置, 值)；keys 可以是年度或 (Stock_Id, 年度)"""
+    cache = {}
+
+    def column(key, lagged=False, fill=fill):
+        k = (key, lagged, fill)
+        if k not in cache:
+            cache[k] = _column(frames, key, prev_keys if lagged else keys, fill)
+        return cache[k]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for ratio in registry:
+            # 分子不補值：缺少的科目不能當成真的 0 (例如沒有 Gross Profit 不代表毛利率 0%)
+            num = column(ratio.numerator, fill=None) * ratio.scale
+            if ratio.yoy:
+                den = column(ratio.numerator, lagged=True, fill=None)
+                # 本期或前一年度不在報表中時不計算成長率
+                stmt = frames.get(ratio.numerator[0])
+                if stmt is None:
+                    has_prev = np.zeros(len(keys), dtype=bool)
+                else:
+                    has_prev = keys.isin(stmt.index) & prev_keys.isin(stmt.index)
+                values = (num - den) / np.abs(den)
+            else:
+                den = column(ratio.denominator)
+                has_prev = True
+                values = num / den
+            ok = (den > 0) if ratio.guard == "positive" else (den != 0)
+            ok &= np.isfinite(values) & has_prev
+            positions = np.flatnonzero(ok)
+            yield ratio, positions, values[positions]
+
+
+def evaluate_ratios(stock_id, frames, years, registry, fill=None):
+    """
+    frames: {'income': df, 'balance': df, 'cash': df}，index 為年度 (int)。
+    years: 要輸出的年度，registry 為 [Ratio]。fill 為分母缺少科目 / 年度時的補值 (None 代表維持 NaN)，分子缺少時一律不計算；
+    結果不是有限數值的比率不輸出。
+    回傳比率列 [(Stock_Id, ReportYear, Category, RatioName, RatioValue, Formula)]。
+    """
+    years = pd.Index(years).astype(int)
+    year_list = years.tolist()
+    return [
+        (stock_id, year_list[i], ratio.category, ratio.name, float(v), ratio.formula)
+        for ratio, positions, values in _evaluate(frames, years, years - 1, registry, fill)
+        for i, v in zip(positions, values)
+    ]
+
+
+def evaluate_ratios_grouped(frames, keys, registry, fill=None):
+    """
+    多檔股票一次計算：frames 的 index 為 (Stock_Id, 年度) MultiIndex (不可重複)，keys 為要輸出的 (Stock_Id, 年度)。
+    某檔股票沒有的科目請在 frames 中先補成 fill，與 evaluate_ratios 單檔計算的結果相同。
+    """
+    stocks = keys.get_level_values(0)
+    years = keys.get_level_values(1).astype(int)
+    keys = pd.MultiIndex.from_arrays([stocks, years])
+    prev_keys = pd.MultiIndex.from_arrays([stocks, years - 1])
+    stock_list, year_list = stocks.tolist(), years.tolist()
+    return [
+        (stock_list[i], year_list[i], ratio.category, ratio.name, float(v), ratio.formula)
+        for ratio, positions, values in _evaluate(frames, keys, prev_keys, registry, fill)
+        for i, v in zip(positions, values)
+    ]
+
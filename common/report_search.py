@@ -0,0 +1,132 @@
+#AI 報告全文檢索：SQLite FTS5 (external content，trigger 同步) / Postgres tsvector + GIN，回傳依相關度排序的片段
+import re
+import sqlite3
+from typing import NamedTuple, Tuple
+
+SNIPPET_TOKENS = 24
+
+
+class ReportIndex(NamedTuple):
+    """
+    要建立全文索引的報告表 (由各後端的 database.py 宣告)：
+    key 為 INTEGER PRIMARY KEY 欄位 (FTS5 的 content_rowid)，columns 為要索引的文字欄位，
+    slug 用於 trigger / index 名稱，extra 為搜尋結果額外回傳的欄位。
+    """
+    table: str
+    key: str
+    columns: Tuple[str, ...]
+    slug: str
+    extra: Tuple[str, ...] = ()
+
+    @property
+    def fts(self):
+        return f"{self.table}_fts"
+
+    @property
+    def document(self):
+        """Postgres：所有文字欄位合併成一份文件"""
+        return " || ' ' || ".join(f"coalesce({c}, '')" for c in self.columns)
+
+
+def create_search_index(cursor, dialect, index):
+    """建立全文索引 (不 commit)；SQLite 第一次建立時為既有報告建索引"""
+    if dialect != "sqlite":
+        cursor.execute(f'''
+        ALTER TABLE {index.table} ADD COLUMN IF NOT EXISTS SearchVector tsvector
+            GENERATED ALWAYS AS (to_tsvector('english', {index.document})) STORED''')
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{index.slug}_search ON {index.table} USING GIN (SearchVector)")
+        return
+
+    fts_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (index.fts,)
+    ).fetchone()
+    columns = ", ".join(index.columns)
+    new = ", ".join(f"NEW.{c}" for c in index.columns)
+    old = ", ".join(f"OLD.{c}" for c in index.columns)
+    cursor.execute(f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {index.fts} USING fts5(
+        {columns}, content='{index.table}', content_rowid='{index.key}', tokenize='porter unicode61'
+    );''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_{index.slug}_fts_insert AFTER INSERT ON {index.table}
+    BEGIN
+        INSERT INTO {index.fts} (rowid, {columns}) VALUES (NEW.{index.key}, {new});
+    END;''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_{index.slug}_fts_delete AFTER DELETE ON {index.table}
+    BEGIN
+        INSERT INTO {index.fts} ({index.fts}, rowid, {columns}) VALUES ('delete', OLD.{index.key}, {old});
+    END;''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_{index.slug}_fts_update AFTER UPDATE OF {columns} ON {index.table}
+    BEGIN
+        INSERT INTO {index.fts} ({index.fts}, rowid, {columns}) VALUES ('delete', OLD.{index.key}, {old});
+        INSERT INTO {index.fts} (rowid, {columns}) VALUES (NEW.{index.key}, {new});
+    END;''')
+    if not fts_exists:
+        # 既有報告一次性建立索引
+        cursor.execute(f"INSERT INTO {index.fts} ({index.fts}) VALUES ('rebuild')")
+
+
+def _search_sql(index, sqlite, ticker):
+    extra = "".join(f", r.{c}" for c in index.extra)
+    if sqlite:
+        # 欄位 -1：片段取自最相符的欄位
+        return f'''
+            SELECT r.Stock_Id, r.ReportDate{extra},
+                   snippet({index.fts}, -1, '**', '**', '…', {SNIPPET_TOKENS}) AS Snippet,
+                   bm25({index.fts}) AS Score
+            FROM {index.fts}
+            JOIN {index.table} r ON r.{index.key} = {index.fts}.rowid
+            WHERE {index.fts} MATCH ?{" AND r.Stock_Id = ?" if ticker else ""}
+            ORDER BY Score
+            LIMIT ? OFFSET ?
+        '''
+    return f'''
+        SELECT r.Stock_Id, r.ReportDate{extra},
+               ts_headline('english', {index.document}, q,
+                           'StartSel=**, StopSel=**, MaxFragments=1, MaxWords={SNIPPET_TOKENS}') AS Snippet,
+               -ts_rank_cd(SearchVector, q) AS Score
+        FROM {index.table} r, websearch_to_tsquery('english', ?) AS q
+        WHERE SearchVector @@ q{" AND r.Stock_Id = ?" if ticker else ""}
+        ORDER BY Score
+        LIMIT ? OFFSET ?
+    '''
+
+
+def _quote_terms(query):
+    """把使用者輸入轉成 FTS5 片語 (每個詞加雙引號，全部以 AND 組合)，避免特殊符號造成語法錯誤"""
+    terms = re.findall(r"\w+", query, re.UNICODE)
+    return " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def search_reports(index, query, ticker=None, limit=20, offset=0):
+    """
+    依相關度搜尋所有報告，回傳 [{Stock_Id, ReportDate, *index.extra, Snippet, Score}]。
+    SQLite 先以 FTS5 查詢語法執行 (支援 AND/OR/NOT、"片語"、前綴*)，語法錯誤時改成逐詞比對。
+    """
+    # 延後匯入：database 匯入本模組以建立索引
+    from database import get_db_connection, backend
+
+    sqlite = backend.dialect == "sqlite"
+    sql = _search_sql(index, sqlite, ticker)
+
+    conn = get_db_connection()
+    try:
+        def run(match):
+            params = [match] + ([ticker.upper()] if ticker else []) + [int(limit), int(offset)]
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            columns = [d[0] for d in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        if not sqlite:
+            return run(query)
+        try:
+            return run(query)
+        except sqlite3.OperationalError:
+            # FTS5 語法錯誤 (未配對的引號、欄位名稱等)
+            quoted = _quote_terms(query)
+            return run(quoted) if quoted else []
+    finally:
+        conn.close()
@@ -0,0 +1,149 @@
+#上游原始回應的磁碟快取 (壓縮 / TTL / LRU / 離線重播)
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from config import settings
+
+
+class OfflineCacheMiss(Exception):
+    """離線模式下快取中找不到對應的回應"""
+
+
+class ResponseCache:
+    """
+    以內容雜湊定址的回應快取：
+    - 請求 (namespace + 參數) 雜湊成 Key，指向壓縮後內容的 sha256 (BlobHash)
+    - 相同內容只存一份 blob，所有參照都被淘汰後才刪檔
+    - 依 LastAccess 做 LRU，總大小不超過 max_bytes
+    """
+    def __init__(self, cache_dir, max_bytes, compression_level=6, offline=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.compression_level = compression_level
+        self.offline = offline
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, "blobs"), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS Entries (
+                Key TEXT PRIMARY KEY,
+                Namespace TEXT,
+                BlobHash TEXT,
+                CreatedAt REAL,
+                LastAccess REAL
+            );''')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS Blobs (
+                BlobHash TEXT PRIMARY KEY,
+                Size INTEGER
+            );''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_access ON Entries(LastAccess)")
+
+    def _connect(self):
+        return sqlite3.connect(os.path.join(self.cache_dir, "index.db"), timeout=30)
+
+    def _blob_path(self, blob_hash):
+        return os.path.join(self.cache_dir, "blobs", blob_hash[:2], blob_hash + ".z")
+
+    @staticmethod
+    def make_key(namespace, *parts, **kwargs):
+        raw = json.dumps([namespace, parts, kwargs], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key, ttl):
+        """回傳 (hit, value)；離線模式忽略 TTL"""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT BlobHash, CreatedAt FROM Entries WHERE Key = ?", (key,)).fetchone()
+            if not row:
+                return False, None
+            blob_hash, created_at = row
+            if not self.offline and ttl is not None and now - created_at > ttl:
+                return False, None
+            conn.execute("UPDATE Entries SET LastAccess = ? WHERE Key = ?", (now, key))
+        try:
+            with open(self._blob_path(blob_hash), "rb") as f:
+                return True, pickle.loads(zlib.decompress(f.read()))
+        except (OSError, zlib.error, pickle.UnpicklingError):
+            return False, None
+
+    def put(self, key, namespace, value):
+        data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), self.compression_level)
+        blob_hash = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(blob_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            old = conn.execute("SELECT BlobHash FROM Entries WHERE Key = ?", (key,)).fetchone()
+            conn.execute("INSERT OR IGNORE INTO Blobs (BlobHash, Size) VALUES (?, ?)", (blob_hash, len(data)))
+            conn.execute("INSERT OR REPLACE INTO Entries (Key, Namespace, BlobHash, CreatedAt, LastAccess) VALUES (?, ?, ?, ?, ?)",
+                         (key, namespace, blob_hash, now, now))
+            if old and old[0] != blob_hash:
+                self._drop_orphan(conn, old[0])
+            self._evict(conn)
+
+    def _drop_orphan(self, conn, blob_hash):
+        if conn.execute("SELECT 1 FROM Entries WHERE BlobHash = ? LIMIT 1", (blob_hash,)).fetchone():
+            return
+        conn.execute("DELETE FROM Blobs WHERE BlobHash = ?", (blob_hash,))
+        try:
+            os.remove(self._blob_path(blob_hash))
+        except OSError:
+            pass
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(Size), 0) FROM Blobs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        rows = conn.execute("SELECT Key, BlobHash FROM Entries ORDER BY LastAccess").fetchall()
+        for key, blob_hash in rows:
+            if total <= target:
+                break
+            conn.execute("DELETE FROM Entries WHERE Key = ?", (key,))
+            size = conn.execute("SELECT Size FROM Blobs WHERE BlobHash = ?", (blob_hash,)).fetchone()
+            self._drop_orphan(conn, blob_hash)
+            if size and not conn.execute("SELECT 1 FROM Blobs WHERE BlobHash = ?", (blob_hash,)).fetchone():
+                total -= size[0]
+
+    def cached(self, namespace, ttl, fetch, *parts, refresh=False, **kwargs):
+        """
+        取得快取內容，未命中 (或過期) 時呼叫 fetch() 並寫入快取。
+        fetch 拋出的例外不會被快取；離線模式下未命中直接拋出 OfflineCacheMiss。
+        """
+        key = self.make_key(namespace, *parts, **kwargs)
+        if not refresh or self.offline:
+            hit, value = self.get(key, ttl)
+            if hit:
+                return value
+        if self.offline:
+            raise OfflineCacheMiss(f"{namespace} {parts} {kwargs} not in cache (offline mode)")
+        value = fetch()
+        self.put(key, namespace, value)
+        return value
+
+    def stats(self):
+        with self._lock, self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM Entries").fetchone()[0]
+            blobs, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(Size), 0) FROM Blobs").fetchone()
+        return {"entries": entries, "blobs": blobs, "bytes": size, "max_bytes": self.max_bytes, "offline": self.offline}
+
+
+response_cache = ResponseCache(
+    settings.RAW_CACHE_DIR,
+    settings.RAW_CACHE_MAX_MB * 1024 * 1024,
+    settings.RAW_CACHE_COMPRESSION_LEVEL,
+    settings.OFFLINE_MODE,
+)
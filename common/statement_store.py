@@ -0,0 +1,112 @@
+#財報寬表快取 (StatementPivots)：寫入財報時預先 pivot，讀取時直接還原成 日期 x 科目 矩陣
+import json
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+PIVOT_UPSERT = '''
+    INSERT OR REPLACE INTO StatementPivots (Stock_Id, StatementType, Dates, Items, Matrix, UpdatedAt)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+
+def build_pivot_rows(stock_id, conn):
+    """由 FinancialStatements 重新產生該股票所有報表類型的寬表 (回傳 PIVOT_UPSERT 參數)"""
+    df_all = pd.read_sql(
+        "SELECT StatementType, Item, ReportDate, Value FROM FinancialStatements WHERE Stock_Id = ?",
+        conn, params=(stock_id,),
+    )
+    now = dt.datetime.now().isoformat(timespec="seconds")
+    rows = []
+    for stmt_type, d in df_all.groupby("StatementType"):
+        p = d.pivot_table(index="ReportDate", columns="Item", values="Value").sort_index()
+        matrix = np.ascontiguousarray(p.to_numpy(dtype=np.float64))
+        rows.append((
+            stock_id, stmt_type,
+            json.dumps(list(p.index)), json.dumps(list(p.columns)),
+            matrix.tobytes(), now,
+        ))
+    return rows
+
+
+def refresh_statement_pivots(stock_id, conn):
+    """重建寬表 (不 commit，交易邊界由呼叫者決定)"""
+    rows = build_pivot_rows(stock_id, conn)
+    conn.execute("DELETE FROM StatementPivots WHERE Stock_Id = ?", (stock_id,))
+    if rows:
+        conn.executemany(PIVOT_UPSERT, rows)
+    return len(rows)
+
+
+def rebuild_pivots(conn, stock_ids):
+    """
+    db_writer 批次用：(rebuild_pivots, [Stock_Id, ...])，放在財報寫入之後，
+    於同一個交易內由剛寫入的 FinancialStatements 重建寬表 (財報與寬表一起 commit 或一起回滾)。
+    """
+    return sum(refresh_statement_pivots(stock_id, conn) for stock_id in stock_ids)
+
+
+def load_statement_pivots(stock_id, conn, stmt_types):
+    """
+    回傳 {StatementType: DataFrame}，index 為 ReportDate (Timestamp，由舊到新)、欄位為科目。
+    矩陣直接引用資料庫讀出的 bytes (唯讀)，需要修改請先 copy()。
+    沒有寬表的類型回傳空 DataFrame；整檔都沒有時回傳 None。
+    """
+    placeholders = ", ".join("?" for _ in stmt_types)
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT StatementType, Dates, Items, Matrix FROM StatementPivots WHERE Stock_Id = ? AND StatementType IN ({placeholders})",
+        (stock_id, *stmt_types),
+    )
+    found = cursor.fetchall()
+    if not found:
+        return None
+
+    pivots = {t: pd.DataFrame() for t in stmt_types}
+    for stmt_type, dates, items, blob in found:
+        dates, items = json.loads(dates), json.loads(items)
+        matrix = np.frombuffer(blob, dtype=np.float64).reshape(len(dates), len(items))
+        pivots[stmt_type] = pd.DataFrame(
+            matrix, index=pd.DatetimeIndex(dates, name="ReportDate"), columns=pd.Index(items, name="Item")
+        )
+    return pivots
+
+
+def load_statement_pivot_groups(stock_ids, conn, stmt_types, absent=np.nan):
+    """
+    多檔股票一次查詢：回傳 {StatementType: DataFrame}，index 為 (Stock_Id, ReportDate) MultiIndex、欄位為所有股票科目的聯集。
+    某檔股票本身沒有的科目填 absent (報表內原本的空值維持 NaN)；沒有寬表的股票不會出現在 index 中。
+    """
+    stock_ids = list(stock_ids)
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT Stock_Id, StatementType, Dates, Items, Matrix FROM StatementPivots "
+        f"WHERE Stock_Id IN ({', '.join('?' for _ in stock_ids)}) AND StatementType IN ({', '.join('?' for _ in stmt_types)})",
+        (*stock_ids, *stmt_types),
+    )
+    parts = {t: [] for t in stmt_types}
+    for stock_id, stmt_type, dates, items, blob in cursor.fetchall():
+        parts[stmt_type].append((stock_id, json.loads(dates), json.loads(items), blob))
+
+    pivots = {}
+    for stmt_type, found in parts.items():
+        if not found:
+            pivots[stmt_type] = pd.DataFrame()
+            continue
+        found.sort(key=lambda f: f[0])
+        columns = pd.Index(sorted({item for _, _, items, _ in found for item in items}), name="Item")
+        n_rows = sum(len(dates) for _, dates, _, _ in found)
+        matrix = np.full((n_rows, len(columns)), absent, dtype=np.float64)
+        stocks, all_dates = [], []
+        row = 0
+        for stock_id, dates, items, blob in found:
+            block = np.frombuffer(blob, dtype=np.float64).reshape(len(dates), len(items))
+            matrix[row:row + len(dates), columns.get_indexer(items)] = block
+            stocks.extend([stock_id] * len(dates))
+            all_dates.extend(dates)
+            row += len(dates)
+        index = pd.MultiIndex.from_arrays(
+            [pd.Index(stocks, name="Stock_Id"), pd.DatetimeIndex(all_dates, name="ReportDate")]
+        )
+        pivots[stmt_type] = pd.DataFrame(matrix, index=index, columns=columns)
+    return pivots